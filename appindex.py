@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import time
+
+
+DEFAULT_INDEX_PATH = '.onboard_apps.json'
+
+# the fields kept per object, enough to answer existence checks and find service principals
+SELECT_FIELDS = 'id,appId,displayName'
+
+COLLECTIONS = ('applications', 'servicePrincipals')
+
+
+class AppIndex:
+    """Local index of the tenant's applications and service principals, kept current with Graph delta queries.
+
+    The first refresh pages through applications/delta and servicePrincipals/delta once;
+    later refreshes only replay the changes since the stored deltaLinks. Lookups by display
+    name, appId and object id are then answered from memory. With path=None nothing is persisted.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._objects = {collection: {} for collection in COLLECTIONS}
+        self._delta_links = {}
+        self.refreshed_at = None
+        self.load()
+
+        # in-memory lookups, rebuilt after every refresh
+        self._by_name = {}
+        self._apps_by_app_id = {}
+        self._principals_by_app_id = {}
+        self._rebuild()
+
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'r', encoding='utf-8') as index_file:
+            index = json.load(index_file)
+
+        self._objects = {collection: index.get(collection, {}) for collection in COLLECTIONS}
+        self._delta_links = index.get('delta_links', {})
+        self.refreshed_at = index.get('refreshed_at')
+
+
+    def save(self):
+        """Write the index atomically, like the state journal"""
+        if self.path is None:
+            return
+
+        temp_path = f"{self.path}.tmp"
+
+        with open(temp_path, 'w', encoding='utf-8') as index_file:
+            json.dump({
+                'version': 1,
+                'refreshed_at': self.refreshed_at,
+                'delta_links': self._delta_links,
+                **self._objects
+            }, index_file)
+
+        os.replace(temp_path, self.path)
+
+
+    async def _sync(self, batcher, collection):
+        """Replay one collection's delta, from scratch when there is no usable deltaLink"""
+        url = self._delta_links.get(collection)
+        full_sync = url is None
+
+        if full_sync:
+            url = f"/{collection}/delta?$select={SELECT_FIELDS}"
+
+        objects = {} if full_sync else dict(self._objects[collection])
+        changes = 0
+
+        while url:
+            response = await batcher.get(url)
+
+            # an expired delta token means starting over
+            if response.status_code == 410 and not full_sync:
+                print(f"Delta token for {collection} expired, rebuilding the index.")
+                self._delta_links.pop(collection, None)
+                return await self._sync(batcher, collection)
+
+            if response.status_code != 200:
+                raise Exception(f"Failed to read {collection} delta: {response.status_code} - {response.text}")
+
+            page = response.json()
+
+            for item in page.get('value', []):
+                changes += 1
+
+                if '@removed' in item:
+                    objects.pop(item['id'], None)
+                else:
+                    previous = objects.get(item['id'], {})
+                    objects[item['id']] = {field: item.get(field, previous.get(field)) for field in SELECT_FIELDS.split(',')}
+
+            url = page.get('@odata.nextLink')
+
+            if not url:
+                self._delta_links[collection] = page['@odata.deltaLink']
+
+        self._objects[collection] = objects
+        return changes
+
+
+    async def refresh(self, batcher):
+        """Bring the index up to date with both delta queries and save it"""
+        changes = await asyncio.gather(*[self._sync(batcher, collection) for collection in COLLECTIONS])
+
+        self.refreshed_at = time.time()
+        self._rebuild()
+        self.save()
+
+        print(f"App index refreshed: {sum(changes)} changes, "
+              f"{len(self._objects['applications'])} applications, {len(self._objects['servicePrincipals'])} service principals")
+
+
+    def _rebuild(self):
+        self._by_name = {}
+        for app in self._objects['applications'].values():
+            self._by_name.setdefault((app.get('displayName') or '').lower(), []).append(app)
+
+        self._apps_by_app_id = {app['appId']: app for app in self._objects['applications'].values() if app.get('appId')}
+        self._principals_by_app_id = {
+            sp['appId']: sp for sp in self._objects['servicePrincipals'].values() if sp.get('appId')
+        }
+
+
+    def by_object_id(self, object_id):
+        return self._objects['applications'].get(object_id)
+
+
+    def by_app_id(self, app_id):
+        return self._apps_by_app_id.get(app_id)
+
+
+    def service_principal_id(self, app_id):
+        service_principal = self._principals_by_app_id.get(app_id)
+        return service_principal['id'] if service_principal else None
+
+
+    def find(self, display_name):
+        """Apps with this display name as [{'id', 'appId', 'displayName', 'servicePrincipalId'}]"""
+        return [
+            {**app, 'servicePrincipalId': self.service_principal_id(app['appId'])}
+            for app in self._by_name.get(display_name.lower(), [])
+        ]
+
+
+    def find_many(self, names):
+        """Same result shape as find_apps_by_display_names, answered from memory.
+
+        Every name is answered, one no app holds maps to [], so callers never look it up again.
+        """
+        return {name: self.find(name) for name in names}
+
+
+    def duplicates(self, names=None):
+        """Display names held by more than one app, limited to names when given"""
+        wanted = {name.lower() for name in names} if names is not None else None
+
+        return {
+            apps[0]['displayName']: apps for key, apps in self._by_name.items()
+            if len(apps) > 1 and (wanted is None or key in wanted)
+        }
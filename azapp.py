@@ -1,46 +1,380 @@
 import asyncio
-from azure.identity import DefaultAzureCredential, AzureCliCredential
-from azure.mgmt.authorization import AuthorizationManagementClient
-from azure.mgmt.resource import ResourceManagementClient, SubscriptionClient
-from msgraph import GraphServiceClient
-from msgraph.generated.models.application import Application
-from msgraph.generated.models.service_principal import ServicePrincipal
-from msgraph.generated.models.federated_identity_credential import FederatedIdentityCredential
-from msgraph.generated.applications.applications_request_builder import ApplicationsRequestBuilder
+import copy
+import fnmatch
+import hashlib
+import os
+import random
+import time
+import re
+import uuid
+from contextlib import contextmanager, nullcontext
+from urllib.parse import quote
+from instrumentation import tracer
+from graphbatch import GraphBatcher, GraphBatchRequest, MAX_BATCH_SIZE
+
+# The azure and msgraph SDK modules are large, they are imported where first used
+# so that startup only pays for the clients a run actually needs.
+
+
+GITHUB_OIDC_ISSUER = "https://token.actions.githubusercontent.com"
+FEDERATED_AUDIENCES = ["api://AzureADTokenExchange"]
+
+# Entra allows letters, digits, '-' and '_' up to 120 characters in a credential name
+FEDERATED_NAME_MAX_LENGTH = 120
+
+
+# the action a caller needs to create role assignments
+ROLE_ASSIGNMENT_WRITE = 'Microsoft.Authorization/roleAssignments/write'
+
+ACR_RESOURCE_TYPE = 'Microsoft.ContainerRegistry/registries'
+AKS_RESOURCE_TYPE = 'Microsoft.ContainerService/managedClusters'
+
+
+# ARM error codes returned while a new service principal is still replicating
+PRINCIPAL_NOT_FOUND_CODES = ('PrincipalNotFound',)
+
+
+def is_principal_not_found(error):
+    """True if the error is Azure's 'principal does not exist' replication error"""
+    code = getattr(getattr(error, 'error', None), 'code', None)
+    if code in PRINCIPAL_NOT_FOUND_CODES:
+        return True
+
+    return 'does not exist in the directory' in str(error)
+
+
+def action_allowed(permissions, action):
+    """True if any ARM permission grants action through its actions and not its not_actions wildcards"""
+    action = action.lower()
+
+    def matches(patterns):
+        return any(fnmatch.fnmatchcase(action, pattern.lower()) for pattern in patterns or [])
+
+    return any(matches(permission.actions) and not matches(permission.not_actions) for permission in permissions)
+
+
+def record_arm_response(pipeline_response):
+    """raw_response_hook of ARM calls, runs once per attempt and adds it to the call's span"""
+    response = pipeline_response.http_response
+
+    try:
+        size = len(response.body() or b'')
+    except Exception:
+        size = int(response.headers.get('Content-Length') or 0)
+
+    tracer.record_response(response.status_code, size)
+
+
+async def record_graph_response(response):
+    """httpx response hook of the Graph SDK client, runs once per call after its retries"""
+    await response.aread()
+    tracer.record_response(response.status_code, len(response.content), int(response.request.headers.get('Retry-Attempt', 0)))
+
+
+async def wait_until_ready(probe, deadline=120.0, initial_delay=1.0, max_delay=15.0, retry_if=is_principal_not_found):
+    """Await probe() with exponential backoff and full jitter until it succeeds.
+
+    Only errors matching retry_if are retried, anything else is raised straight away.
+    Sleeps go through asyncio so waits for several apps overlap on one loop.
+    Returns (probe result, seconds waited).
+    """
+    started = time.monotonic()
+    delay = initial_delay
+    attempt = 0
+
+    with tracer.span('wait_until_ready', 'propagation') as span:
+        while True:
+            attempt += 1
+            span.set(attempts=attempt)
+            try:
+                return await probe(), time.monotonic() - started
+
+            except Exception as e:
+                elapsed = time.monotonic() - started
+                if not retry_if(e) or elapsed >= deadline:
+                    raise
+
+                sleep_for = min(random.uniform(0, delay), deadline - elapsed)
+                print(f"Not ready yet (attempt {attempt}), retrying in {sleep_for:.1f}s...")
+                await asyncio.sleep(sleep_for)
+                delay = min(delay * 2, max_delay)
+
+
+def single_app(app_name, matches):
+    """The one app registration among matches, None when there is none.
+
+    Display names are not unique, several apps with the name are reported instead of one being picked.
+    """
+    if len(matches) > 1:
+        app_ids = ", ".join(app['appId'] for app in matches)
+        raise Exception(
+            f"{len(matches)} app registrations are named '{app_name}' ({app_ids}), delete or rename the extra ones"
+        )
+
+    return matches[0] if matches else None
+
+
+async def find_apps_by_display_names(batcher, names):
+    """Look up many app registrations by display name through Graph $batch.
+
+    Returns {name: [{'id', 'appId', 'displayName'}, ...]}; names whose lookup failed are left out.
+    """
+    names = list(dict.fromkeys(names))
+    requests = [
+        GraphBatchRequest(
+            position,
+            'GET',
+            "/applications?$select=id,appId,displayName&$filter="
+            + quote(f"displayName eq '{name.replace(chr(39), chr(39) * 2)}'")
+        )
+        for position, name in enumerate(names)
+    ]
+
+    results = await batcher.execute(requests)
+
+    found = {}
+    for position, name in enumerate(names):
+        result = results.get(str(position), {})
+
+        if result.get('status') == 200:
+            found[name] = result['body'].get('value', [])
+        else:
+            print(f"App lookup for '{name}' failed: {result.get('status')}")
+
+    return found
+
+
+async def ensure_roles_across_scopes(managers):
+    """Assign app roles at the resource group scope of every manager.
+
+    Managers for the same app and subscription share one listing of the principal's
+    assignments instead of one per resource group, then all missing roles are created concurrently.
+    """
+    groups = {}
+    for manager in managers:
+        groups.setdefault((manager.subscription_id, manager.app_id), []).append(manager)
+
+    async def load_index(group):
+        first = group[0]
+        if first.service_principal_id is None:
+            first.service_principal_id = await first.get_service_principal_id(first.app_id)
+
+        if first.service_principal_id is not None:
+            await first._load_subscription_role_index(first.service_principal_id, group)
+
+        for manager in group[1:]:
+            manager.service_principal_id = first.service_principal_id
+
+    await asyncio.gather(*[load_index(group) for group in groups.values()])
+    await asyncio.gather(*[manager.ensure_app_roles() for manager in managers])
 
 
 class AzureAppRegManager:
 
-    def __init__(self, rgname, cluster=None, containerreg=None, aks_enabled=False):
+    def __init__(self, rgname, cluster=None, containerreg=None, aks_enabled=False, subscription_id=None, tenant_id=None):
         
-        """Initialize the Azure clients"""
-        # Use default credential chain (includes Azure CLI, managed identity, etc.)
-        self.credential = DefaultAzureCredential()
+        """Initialize the Azure clients.
+
+        Pass subscription_id and tenant_id (or set AZURE_SUBSCRIPTION_ID / AZURE_TENANT_ID)
+        to skip subscription discovery. Clients are built lazily on first use.
+        """
+        self._init_clients(is_async=False)
+
+        with self._timed('credential'):
+            from azure.identity import DefaultAzureCredential
+
+            # Use default credential chain (includes Azure CLI, managed identity, etc.)
+            self.credential = DefaultAzureCredential()
         
         # Get subscription ID and tenant ID from Azure SDK
-        self.subscription_id, self.tenant_id = self._get_azure_context()
+        with self._timed('context'):
+            self.subscription_id, self.tenant_id = self._get_azure_context(subscription_id, tenant_id)
         
         print(f"Connected to Azure:")
         print(f"Tenant ID: {self.tenant_id}")
         print(f"Subscription ID: {self.subscription_id}")
-        
-        # Initialize clients
-        self.graph_client = GraphServiceClient(
-            credentials=self.credential,
-            scopes=['https://graph.microsoft.com/.default']
-        )
-        self.auth_client = AuthorizationManagementClient(
-            credential=self.credential,
-            subscription_id=self.subscription_id
-        )
-        self.resource_client = ResourceManagementClient(
-            credential=self.credential,
-            subscription_id=self.subscription_id
-        )
-                
+
         # If a resource group name is provided, get its details        
-        rgres = self.resource_client.resource_groups.get(rgname)
+        with self._timed('resource_group'):
+            with tracer.span('resource_groups.get', 'arm', resource_group=rgname):
+                rgres = self.resource_client.resource_groups.get(rgname)
         
+        self._init_state(rgname, rgres, cluster, containerreg, aks_enabled)
+        self._print_startup_timings()
+
+
+    @classmethod
+    async def create(cls, rgname, cluster=None, containerreg=None, aks_enabled=False, subscription_id=None, tenant_id=None, pool=None):
+        """Build a manager on the azure aio clients, sharing one aiohttp transport.
+
+        Use this from async code instead of the constructor so no call blocks the event loop.
+        Pass an AzureClientPool to share credentials and clients with other managers of the
+        same run, the pool is then closed instead of the manager. Otherwise call close() when done.
+        """
+        self = cls.__new__(cls)
+        self._init_clients(is_async=True)
+
+        if pool is not None:
+            # credential, transport and clients belong to the pool
+            self._pool = pool
+            self._transport = pool.transport
+            self.credential = pool.credential(tenant_id)
+
+        else:
+            with self._timed('credential'):
+                import aiohttp
+                from azure.core.pipeline.transport import AioHttpTransport
+                from azure.identity.aio import DefaultAzureCredential
+
+                # one aiohttp session and transport shared by every ARM client
+                self._session = aiohttp.ClientSession()
+                self._transport = AioHttpTransport(session=self._session, session_owner=False)
+                self.credential = DefaultAzureCredential()
+
+        try:
+            with self._timed('context'):
+                self.subscription_id, self.tenant_id = await self._get_azure_context_async(subscription_id, tenant_id)
+
+            print(f"Connected to Azure:")
+            print(f"Tenant ID: {self.tenant_id}")
+            print(f"Subscription ID: {self.subscription_id}")
+
+            with self._timed('resource_group'):
+                rgres = await self._arm(self.resource_client.resource_groups.get, rgname)
+
+            self._init_state(rgname, rgres, cluster, containerreg, aks_enabled)
+
+        except Exception:
+            await self.close()
+            raise
+
+        self._print_startup_timings()
+        return self
+
+
+    def _init_clients(self, is_async):
+        self._is_async = is_async
+        self._pool = None
+        self._session = None
+        self._transport = None
+        self._graph_client = None
+        self._auth_client = None
+        self._resource_client = None
+        self._graph_batcher = None
+
+        #seconds spent per startup phase
+        self.startup_timings = {}
+        self._started_at = time.perf_counter()
+
+
+    @contextmanager
+    def _timed(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_timings[phase] = self.startup_timings.get(phase, 0.0) + time.perf_counter() - started
+
+
+    def _print_startup_timings(self):
+        total = time.perf_counter() - self._started_at
+        phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.startup_timings.items())
+        print(f"Startup took {total:.2f}s ({phases})")
+
+
+    @property
+    def graph_client(self):
+        """Microsoft Graph client, built on first use"""
+        if self._graph_client is None:
+            with self._timed('graph_client'):
+                from msgraph import GraphServiceClient, GraphRequestAdapter
+                from msgraph_core import GraphClientFactory
+                from kiota_authentication_azure.azure_identity_authentication_provider import AzureIdentityAuthenticationProvider
+
+                def build():
+                    # the SDK's own httpx client, with a hook putting status, size and retries on each span
+                    http_client = GraphClientFactory.create_with_default_middleware(client=self._http_client())
+                    http_client.event_hooks['response'] = [record_graph_response]
+
+                    # msgraph is async natively and takes either credential flavour
+                    return GraphServiceClient(request_adapter=GraphRequestAdapter(
+                        AzureIdentityAuthenticationProvider(self.credential, scopes=['https://graph.microsoft.com/.default']),
+                        client=http_client
+                    ))
+
+                self._graph_client = self._shared('graph', build)
+
+        return self._graph_client
+
+
+    @property
+    def graph_batcher(self):
+        """Graph JSON $batch client sharing this manager's credential, built on first use"""
+        if self._graph_batcher is None:
+            self._graph_batcher = self._shared('graph_batcher', lambda: GraphBatcher(
+                self.credential, client=self._http_client(), semaphore=self._pool.limit('graph') if self._pool else None
+            ))
+
+        return self._graph_batcher
+
+
+    @property
+    def auth_client(self):
+        """Authorization management client, built on first use"""
+        if self._auth_client is None:
+            with self._timed('auth_client'):
+                if self._is_async:
+                    from azure.mgmt.authorization.aio import AuthorizationManagementClient
+                else:
+                    from azure.mgmt.authorization import AuthorizationManagementClient
+
+                self._auth_client = self._shared('auth', lambda: AuthorizationManagementClient(
+                    credential=self.credential,
+                    subscription_id=self.subscription_id,
+                    **self._client_kwargs()
+                ), self.subscription_id)
+
+        return self._auth_client
+
+
+    @property
+    def resource_client(self):
+        """Resource management client, built on first use"""
+        if self._resource_client is None:
+            with self._timed('resource_client'):
+                if self._is_async:
+                    from azure.mgmt.resource.resources.aio import ResourceManagementClient
+                else:
+                    from azure.mgmt.resource import ResourceManagementClient
+
+                self._resource_client = self._shared('resource', lambda: ResourceManagementClient(
+                    credential=self.credential,
+                    subscription_id=self.subscription_id,
+                    **self._client_kwargs()
+                ), self.subscription_id)
+
+        return self._resource_client
+
+
+    def _shared(self, kind, build, subscription_id=None):
+        """Build a client, or reuse the pool's client for this credential and subscription"""
+        if self._pool is None:
+            return build()
+
+        return self._pool.shared((self.credential, kind, subscription_id), build)
+
+
+    def _http_client(self):
+        """httpx client for Graph when the pool replaces the transport, None for the default"""
+        return self._pool.http_client() if self._pool is not None else None
+
+
+    def _client_kwargs(self):
+        return {'transport': self._transport} if self._transport is not None else {}
+
+
+    def _init_state(self, rgname, rgres, cluster, containerreg, aks_enabled):
+
         if not rgres:
             raise Exception(f"Resource group '{rgname}' not found in subscription {self.subscription_id}")
 
@@ -53,6 +387,8 @@ class AzureAppRegManager:
 
         #initialize app registration variables
         self.app_object_id = None
+        self.app_id = None
+        self.service_principal_id = None
 
         #app registration created flag
         self.appreg_created = False
@@ -60,18 +396,112 @@ class AzureAppRegManager:
         #set aks enabled
         self.aks_enabled = aks_enabled
 
-    def _get_azure_context(self):
-                                
+        #seconds spent waiting on service principal propagation
+        self.propagation_wait_seconds = 0.0
+
+        #existing role assignments as (scope, role definition guid, principal id), lower-cased
+        self._role_index = set()
+        self._indexed_role_scopes = set()
+
+
+    async def close(self):
+        """Close the clients, credential and shared transport"""
+        if self._pool is not None:
+            return
+
+        if self._graph_batcher is not None:
+            await self._graph_batcher.aclose()
+
+        if not self._is_async:
+            self.credential.close()
+            return
+
+        for client in (self._auth_client, self._resource_client):
+            if client is not None:
+                await client.close()
+
+        await self.credential.close()
+        await self._session.close()
+
+
+    def _operation_name(self, operation):
+        # e.g. RoleAssignmentsOperations.create -> role_assignments.create
+        owner, _, method = operation.__qualname__.rpartition('.')
+        owner = re.sub(r'(?<!^)(?=[A-Z])', '_', owner.replace('Operations', '')).lower()
+        return f"{owner}.{method}"
+
+
+    def _limit(self, service):
+        """The pool's cap on concurrent calls to service, shared with every manager of the pool"""
+        semaphore = self._pool.limit(service) if self._pool is not None else None
+        return semaphore or nullcontext()
+
+
+    async def _arm(self, operation, *args, **kwargs):
+        """Run an ARM client call without blocking the loop, whichever client flavour is in use"""
+        kwargs.setdefault('raw_response_hook', record_arm_response)
+
+        async with self._limit('arm'):
+            with tracer.span(self._operation_name(operation), 'arm', scope=kwargs.get('scope')):
+                if self._is_async:
+                    return await operation(*args, **kwargs)
+
+                return await asyncio.to_thread(operation, *args, **kwargs)
+
+
+    async def _arm_list(self, operation, *args, **kwargs):
+        """Collect every item of an ARM list call, whichever client flavour is in use"""
+        kwargs.setdefault('raw_response_hook', record_arm_response)
+
+        async with self._limit('arm'):
+            with tracer.span(self._operation_name(operation), 'arm') as span:
+                if self._is_async:
+                    items = [item async for item in operation(*args, **kwargs)]
+                else:
+                    items = await asyncio.to_thread(lambda: list(operation(*args, **kwargs)))
+
+                span.set(items=len(items))
+                return items
+
+
+    async def _graph(self, name, request):
+        """Await a Graph request inside a span"""
+        async with self._limit('graph'):
+            with tracer.span(name, 'graph'):
+                return await request
+
+
+    def _explicit_context(self, subscription_id, tenant_id):
+        """Subscription and tenant passed in or taken from the environment"""
+        return (
+            subscription_id or os.getenv('AZURE_SUBSCRIPTION_ID'),
+            tenant_id or os.getenv('AZURE_TENANT_ID')
+        )
+
+
+    def _get_azure_context(self, subscription_id=None, tenant_id=None):
+
+            subscription_id, tenant_id = self._explicit_context(subscription_id, tenant_id)
+            if subscription_id and tenant_id:
+                return subscription_id, tenant_id
+
             # Method 1: Try using SubscriptionClient to get default subscription
             try:
+                from azure.mgmt.resource import SubscriptionClient
+
                 subscription_client = SubscriptionClient(self.credential)
-                subscriptions = list(subscription_client.subscriptions.list())
+
+                # a known subscription only needs its tenant, one GET instead of a listing
+                if subscription_id:
+                    subscription = subscription_client.subscriptions.get(subscription_id)
+                    return subscription.subscription_id, subscription.tenant_id
+
+                # Get the first subscription, stop after the first page instead of listing them all
+                default_subscription = next(iter(subscription_client.subscriptions.list()), None)
                 
-                if not subscriptions:
+                if default_subscription is None:
                     raise Exception("No subscriptions found")
                 
-                # Get the first subscription (or you could implement logic to choose)
-                default_subscription = subscriptions[0]
                 subscription_id = default_subscription.subscription_id
                 tenant_id = default_subscription.tenant_id
                 
@@ -81,9 +511,52 @@ class AzureAppRegManager:
             except Exception as e:
                 print(f"SubscriptionClient method failed: {str(e)}")
                 raise
+
+
+    async def _get_azure_context_async(self, subscription_id=None, tenant_id=None):
+
+        subscription_id, tenant_id = self._explicit_context(subscription_id, tenant_id)
+        if subscription_id and tenant_id:
+            return subscription_id, tenant_id
+
+        try:
+            from azure.mgmt.resource.subscriptions.aio import SubscriptionClient
+
+            async with SubscriptionClient(self.credential, transport=self._transport) as subscription_client:
+                # a known subscription only needs its tenant, one GET instead of a listing
+                if subscription_id:
+                    subscription = await subscription_client.subscriptions.get(subscription_id)
+                    return subscription.subscription_id, subscription.tenant_id
+
+                # only the first subscription is used, stop after it instead of listing them all
+                async for default_subscription in subscription_client.subscriptions.list():
+                    print(f"Found subscription: {default_subscription.display_name}")
+                    return default_subscription.subscription_id, default_subscription.tenant_id
+
+            raise Exception("No subscriptions found")
+
+        except Exception as e:
+            print(f"SubscriptionClient method failed: {str(e)}")
+            raise
               
 
-    async def create_app_registration(self, app_name, app_description="App created via Python"):
+    async def find_apps_by_display_names(self, names):
+        """Look up many app registrations by display name through Graph $batch"""
+        return await find_apps_by_display_names(self.graph_batcher, names)
+
+
+    async def create_app_registration(self, app_name, app_description="App created via Python", assign_roles=None, existing=None):
+        """Create the app registration and service principal, or reuse an existing one.
+
+        By default roles are assigned only when the app is created. Pass assign_roles=True to
+        also reconcile them on an existing app, or False to leave them to ensure_app_roles().
+        existing takes a find_apps_by_display_names or AppIndex.find result for app_name to skip
+        the lookup; several apps with the name raise instead of one being picked.
+        """
+        from msgraph.generated.models.application import Application
+        from msgraph.generated.models.service_principal import ServicePrincipal
+        from msgraph.generated.applications.applications_request_builder import ApplicationsRequestBuilder
+
         try:                        
             # Create the application
             application = Application()
@@ -96,189 +569,574 @@ class AzureAppRegManager:
                 )
             )
 
-            appexists = await self.graph_client.applications.get(request_configuration)
+            if existing is None:
+                appexists = await self._graph('applications.get', self.graph_client.applications.get(request_configuration))
+                existing = [{'id': app.id, 'appId': app.app_id} for app in appexists.value or []]
 
             # If app registration exists, return existing app details
-            if appexists.value and len(appexists.value) > 0:
+            existing_app = single_app(app_name, existing)
+            if existing_app:
                 print(f"App registration '{app_name}' already exists.")                
-                existing_app = appexists.value[0]
-                self.app_object_id = existing_app.id
-
-                if self.aks_enabled:               
-
-                    return {
-                        'subscription_id': self.subscription_id,
-                        'tenant_id': self.tenant_id,
-                        'client_id': existing_app.app_id,
-                        'resource_group': self.resource_group,
-                        'cluster_name': self.cluster_name,
-                        'container_registry': self.container_registry
-                    }
-                else:
+                self.app_object_id = existing_app['id']
+                self.app_id = existing_app['appId']
 
-                    return {
-                        'subscription_id': self.subscription_id,
-                        'tenant_id': self.tenant_id,
-                        'client_id': existing_app.app_id,
-                        'resource_group': self.resource_group,                        
-                        'container_registry': self.container_registry
-                    }
+                # an AppIndex result also knows the service principal
+                if existing_app.get('servicePrincipalId'):
+                    self.service_principal_id = existing_app['servicePrincipalId']
+
+                if assign_roles:
+                    await self.ensure_app_roles()
+
+                return self.app_info()
 
             # existing app not found, create new one
             else:
                 # Create the app registration
-                created_app = await self.graph_client.applications.post(application)
+                created_app = await self._graph('applications.post', self.graph_client.applications.post(application))
                 print(f"App registration created successfully!")
                 print(f"App Name: {created_app.display_name}")
                 print(f"Application ID: {created_app.app_id}")
                 print(f"Object ID: {created_app.id}")
                 self.appreg_created = True
                 self.app_object_id = created_app.id
+                self.app_id = created_app.app_id
             
                 # Create service principal for the app
                 service_principal = ServicePrincipal()
                 service_principal.app_id = created_app.app_id
-                created_sp = await self.graph_client.service_principals.post(service_principal)
+                created_sp = await self._graph(
+                    'service_principals.post', self.graph_client.service_principals.post(service_principal)
+                )
+                self.service_principal_id = created_sp.id
             
                 print(f"Service Principal ID: {created_sp.id}")
-                print("Waiting for service principal to propagate...")
-            
-                await asyncio.sleep(30)  # Now properly awaited within async context            
-           
-                # Assign roles to the service principal (this is sync)
-                self.assign_roles_to_app(created_sp.id)
-
-                return {
-                    'subscription_id': self.subscription_id,
-                    'tenant_id': self.tenant_id,
-                    'client_id': created_app.app_id,
-                    'resource_group': self.resource_group,
-                    'cluster_name': self.cluster_name,
-                    'container_registry': self.container_registry
-                }
+
+                if assign_roles is not False:
+                    await self.ensure_app_roles()
+
+                return self.app_info()
 
         except Exception as e:
             print(f"Error creating app registration: {str(e)}")
             raise
 
 
-    def assign_roles_to_app(self, service_principal_id):
-        """Assign Azure roles to the service principal"""
-        print(f"Assigning roles to service principal...")
+    def app_info(self):
+        """Values written to GitHub as secrets for the current app registration"""
+        app_info = {
+            'subscription_id': self.subscription_id,
+            'tenant_id': self.tenant_id,
+            'client_id': self.app_id,
+            'resource_group': self.resource_group,
+            'container_registry': self.container_registry
+        }
+
+        if self.aks_enabled:
+            app_info['cluster_name'] = self.cluster_name
+
+        return app_info
+
 
-        scope=f"/subscriptions/{self.subscription_id}/resourceGroups/{self.resource_group}"
+    def app_record(self):
+        """Identifiers of the current app registration, as kept in the local state journal"""
+        return {
+            'app_object_id': self.app_object_id,
+            'app_id': self.app_id,
+            'service_principal_id': self.service_principal_id,
+            'subscription_id': self.subscription_id,
+            'tenant_id': self.tenant_id,
+            'resource_group': self.resource_group
+        }
 
+
+    def restore_app(self, record):
+        """Adopt an app registration recorded by a previous run without looking it up again"""
+        self.app_object_id = record['app_object_id']
+        self.app_id = record['app_id']
+        self.service_principal_id = record.get('service_principal_id')
+
+
+    def for_app(self, source=None):
+        """A manager for another app registration that shares this one's credential and clients.
+
+        With source, the new manager adopts source's app registration, e.g. to assign its roles
+        in this manager's subscription. Only the manager it was made from should be closed.
+        """
+        other = copy.copy(self)
+        other.app_object_id = source.app_object_id if source else None
+        other.app_id = source.app_id if source else None
+        other.service_principal_id = source.service_principal_id if source else None
+        other.appreg_created = source.appreg_created if source else False
+        other.propagation_wait_seconds = 0.0
+
+        return other
+
+
+    async def ensure_app_roles(self):
+        """Assign any missing roles to the app's service principal.
+
+        A freshly created principal is probed with the first role assignment until it has
+        replicated, instead of sleeping for a fixed time.
+        """
+        if self.service_principal_id is None:
+            self.service_principal_id = await self.get_service_principal_id(self.app_id)
+
+            if self.service_principal_id is None:
+                print(f"No service principal found for app '{self.app_id}', skipping role assignment.")
+                return
+
+        roles = self._roles_to_assign()
+
+        if self.appreg_created:
+            print("Waiting for service principal to propagate...")
+
+            # probe with the first role assignment until the principal has replicated
+            first_role_id, first_role_name = roles[0]
+
+            _, waited = await wait_until_ready(
+                lambda: self._assign_role(self.service_principal_id, first_role_id, first_role_name)
+            )
+            self.propagation_wait_seconds += waited
+            print(f"Service principal ready after {waited:.1f}s")
+            roles = roles[1:]
+
+        # Assign the remaining roles to the service principal
+        await self.assign_roles_to_app(self.service_principal_id, roles)
+
+
+    def _role_scope(self):
+        return f"/subscriptions/{self.subscription_id}/resourceGroups/{self.resource_group}"
+
+
+    def _roles_to_assign(self):
+        """Return (role definition id, role name) pairs for this app"""
         if self.aks_enabled and self.cluster_name:
             # Define the roles to assign
-            roles_to_assign = [
-                "b24988ac-6180-42a0-ab88-20f7382dd24c",  # Contributor
-                "b1ff04bb-8a4e-4dc4-8eb5-8693973ce19b",   # Azure Kubernetes Service RBAC Cluster Admin
-                 "7f951dda-4ed3-4680-a7ca-43fe172d538d"  # AcrPull
-            ]
-            
-            role_names = [
-                "Contributor",
-                "Azure Kubernetes Service RBAC Cluster Admin",
-                "AcrPull"
-            ]       
-   
-        else:
-            roles_to_assign = [
-                "b24988ac-6180-42a0-ab88-20f7382dd24c",  # Contributor
-                "7f951dda-4ed3-4680-a7ca-43fe172d538d"  # AcrPull
-            ]
-            
-            role_names = [
-                "Contributor",
-                "AcrPull"
+            return [
+                ("b24988ac-6180-42a0-ab88-20f7382dd24c", "Contributor"),
+                ("b1ff04bb-8a4e-4dc4-8eb5-8693973ce19b", "Azure Kubernetes Service RBAC Cluster Admin"),
+                ("7f951dda-4ed3-4680-a7ca-43fe172d538d", "AcrPull")
             ]
 
-        print(f"assigning roles to Scope: {scope}")
+        return [
+            ("b24988ac-6180-42a0-ab88-20f7382dd24c", "Contributor"),
+            ("7f951dda-4ed3-4680-a7ca-43fe172d538d", "AcrPull")
+        ]
 
-        for role_id, role_name in zip(roles_to_assign, role_names):
-            try:
-                # Create role assignment
-                role_assignment_params = {
-                    'role_definition_id': f"/subscriptions/{self.subscription_id}/providers/Microsoft.Authorization/roleDefinitions/{role_id}",
-                    'principal_id': service_principal_id,
-                    'principal_type': 'ServicePrincipal'
-                }
-                
-                assignment = self.auth_client.role_assignments.create(
-                    scope=scope,
-                    role_assignment_name=self._generate_guid(),
-                    parameters=role_assignment_params
-                )
-                
-                print(f"Assigned role: {role_name}")
-                
-            except Exception as e:
-                print(f"Failed to assign role {role_name}: {str(e)}")
+
+    async def get_service_principal_id(self, app_id):
+        """Return the object id of the service principal for an app id, or None"""
+        from msgraph.generated.service_principals.service_principals_request_builder import ServicePrincipalsRequestBuilder
+
+        request_configuration = ServicePrincipalsRequestBuilder.ServicePrincipalsRequestBuilderGetRequestConfiguration(
+            query_parameters=ServicePrincipalsRequestBuilder.ServicePrincipalsRequestBuilderGetQueryParameters(
+                filter=f"appId eq '{app_id}'"
+            )
+        )
+
+        service_principals = await self._graph(
+            'service_principals.get', self.graph_client.service_principals.get(request_configuration)
+        )
+
+        if service_principals and service_principals.value:
+            return service_principals.value[0].id
+
+        return None
+
+
+    async def _load_role_index(self, scope, service_principal_id):
+        """List the principal's assignments at a scope once and add them to the in-memory index"""
+        index_key = (scope.lower(), service_principal_id.lower())
+        if index_key in self._indexed_role_scopes:
+            return
+
+        assignments = await self._arm_list(
+            self.auth_client.role_assignments.list_for_scope,
+            scope,
+            filter=f"principalId eq '{service_principal_id}'"
+        )
+
+        for assignment in assignments:
+            self._role_index.add((
+                assignment.scope.lower(),
+                assignment.role_definition_id.rsplit('/', 1)[-1].lower(),
+                assignment.principal_id.lower()
+            ))
+
+        self._indexed_role_scopes.add(index_key)
+
+
+    async def _load_subscription_role_index(self, service_principal_id, managers):
+        """List the principal's assignments in the whole subscription once, covering every manager's scope"""
+        assignments = await self._arm_list(
+            self.auth_client.role_assignments.list_for_subscription,
+            filter=f"principalId eq '{service_principal_id}'"
+        )
+
+        entries = {
+            (
+                assignment.scope.lower(),
+                assignment.role_definition_id.rsplit('/', 1)[-1].lower(),
+                assignment.principal_id.lower()
+            )
+            for assignment in assignments
+        }
+
+        for manager in managers:
+            manager._role_index.update(entries)
+            manager._indexed_role_scopes.add((manager._role_scope().lower(), service_principal_id.lower()))
+
+
+    def _has_role(self, scope, role_id, service_principal_id):
+        """True if the index holds the role at this scope or at any parent scope"""
+        scope = scope.lower()
+        role_id = role_id.lower()
+        principal = service_principal_id.lower()
+
+        for indexed_scope, indexed_role, indexed_principal in self._role_index:
+            if indexed_role != role_id or indexed_principal != principal:
+                continue
+
+            if scope == indexed_scope or scope.startswith(indexed_scope.rstrip('/') + '/'):
+                return True
+
+        return False
+
+
+    async def _assign_role(self, service_principal_id, role_id, role_name):
+        """Create one role assignment at the resource group scope unless it exists, raising on failure"""
+        scope = self._role_scope()
+        await self._load_role_index(scope, service_principal_id)
+
+        if self._has_role(scope, role_id, service_principal_id):
+            print(f"Role already assigned: {role_name}")
+            return None
+
+        # Create role assignment
+        role_assignment_params = {
+            'role_definition_id': f"/subscriptions/{self.subscription_id}/providers/Microsoft.Authorization/roleDefinitions/{role_id}",
+            'principal_id': service_principal_id,
+            'principal_type': 'ServicePrincipal'
+        }
+
+        try:
+            assignment = await self._arm(
+                self.auth_client.role_assignments.create,
+                scope=scope,
+                role_assignment_name=self._generate_guid(scope, role_id, service_principal_id),
+                parameters=role_assignment_params
+            )
+
+        except Exception as e:
+            # the deterministic name makes a retried create collide with itself, which is fine
+            if getattr(getattr(e, 'error', None), 'code', None) != 'RoleAssignmentExists':
+                raise
+
+            assignment = None
+
+        self._role_index.add((scope.lower(), role_id.lower(), service_principal_id.lower()))
+        print(f"Assigned role: {role_name}")
+        return assignment
+
+
+    async def list_role_assignments(self, service_principal_id):
+        """The principal's role assignments made at this manager's resource group scope"""
+        scope = self._role_scope().lower()
+
+        assignments = await self._arm_list(
+            self.auth_client.role_assignments.list_for_scope,
+            self._role_scope(),
+            filter=f"principalId eq '{service_principal_id}'"
+        )
+
+        # the filter also returns inherited assignments, only the ones at this scope are ours
+        return [assignment for assignment in assignments if assignment.scope.lower() == scope]
+
+
+    async def can_assign_roles(self):
+        """True if the signed-in identity may create role assignments in the resource group"""
+        permissions = await self._arm_list(self.auth_client.permissions.list_for_resource_group, self.resource_group)
+        return action_allowed(permissions, ROLE_ASSIGNMENT_WRITE)
+
+
+    async def find_resource_groups(self, resource_type, name):
+        """Resource groups of the subscription holding a resource of this type and name"""
+        resources = await self._arm_list(
+            self.resource_client.resources.list,
+            filter=f"resourceType eq '{resource_type}'"
+        )
+
+        # /subscriptions/{id}/resourceGroups/{group}/providers/...
+        return [resource.id.split('/')[4] for resource in resources if resource.name.lower() == name.lower()]
+
+
+    async def delete_role_assignment(self, assignment_id):
+        await self._arm(self.auth_client.role_assignments.delete_by_id, assignment_id)
+
+
+    async def assign_roles_to_app(self, service_principal_id, roles=None):
+        """Assign missing Azure roles to the service principal"""
+        print(f"Assigning roles to service principal...")
+
+        if roles is None:
+            roles = self._roles_to_assign()
+
+        print(f"assigning roles to Scope: {self._role_scope()}")
+
+        # one list call for the scope, then only the missing assignments are created
+        await self._load_role_index(self._role_scope(), service_principal_id)
+
+        # roles are independent, issue the assignments concurrently
+        results = await asyncio.gather(*[
+            self._assign_role(service_principal_id, role_id, role_name) for role_id, role_name in roles
+        ], return_exceptions=True)
+
+        for (role_id, role_name), result in zip(roles, results):
+            if isinstance(result, Exception):
+                print(f"Failed to assign role {role_name}: {str(result)}")
                 # Continue with other roles even if one fails
-        pass
 
 
-    async def create_federated_credentials(self, gh_org_user, repo, credential_name=None, branches=None):
-        """Create federated credentials for GitHub Actions"""
-        
+    @staticmethod
+    def _federated_subject(gh_org_user, repo, branch):
+        return f"repo:{gh_org_user}/{repo}:ref:refs/heads/{branch}"
+
+
+    @staticmethod
+    def _federated_credential_name(gh_org_user, repo, branch, primary=True, hashed=False):
+        """Credential name for a repo/branch, the first branch keeps the original naming.
+
+        A branch suffix, sanitising or truncation could make two repo/branch pairs share a name
+        (web on release and web-release on main, my.repo and my-repo), so those names, and any
+        with hashed set, end in a short hash of the subject instead.
+        """
+        name = f"{gh_org_user}-{repo}" if primary else f"{gh_org_user}-{repo}-{branch}"
+        sanitised = re.sub(r'[^A-Za-z0-9_-]', '-', name)
+
+        if primary and not hashed and sanitised == name and len(name) + len('-federated') <= FEDERATED_NAME_MAX_LENGTH:
+            return f"{name}-federated"
+
+        subject = AzureAppRegManager._federated_subject(gh_org_user, repo, branch)
+        suffix = f"-{hashlib.sha256(subject.encode()).hexdigest()[:8]}-federated"
+        return sanitised[:FEDERATED_NAME_MAX_LENGTH - len(suffix)] + suffix
+
+
+    @staticmethod
+    def _federated_credential_names(gh_org_user, repo, branch, primary=True):
+        """Every name this tool gives a repo/branch credential.
+
+        The planned name, its hashed form used when another credential holds the planned name,
+        and the naming of earlier versions, which had no hash.
+        """
+        legacy = f"{gh_org_user}-{repo}-federated" if primary else f"{gh_org_user}-{repo}-{branch}-federated"
+
+        return {
+            AzureAppRegManager._federated_credential_name(gh_org_user, repo, branch, primary),
+            AzureAppRegManager._federated_credential_name(gh_org_user, repo, branch, primary, hashed=True),
+            re.sub(r'[^A-Za-z0-9_-]', '-', legacy)[:FEDERATED_NAME_MAX_LENGTH]
+        }
+
+
+    @staticmethod
+    def _federated_credential_entries(gh_org_user, repos, branches):
+        """Build the desired credentials for every repo and branch"""
+        entries = []
+        for repo in repos:
+            for position, branch in enumerate(branches):
+                entries.append({
+                    'name': AzureAppRegManager._federated_credential_name(gh_org_user, repo, branch, primary=position == 0),
+                    'subject': AzureAppRegManager._federated_subject(gh_org_user, repo, branch),
+                    'description': f"Federated credential for GitHub repo {repo}",
+                    'gh_org_user': gh_org_user,
+                    'repo': repo,
+                    'branch': branch,
+                    'primary': position == 0
+                })
+
+        return entries
+
+
+    async def list_federated_credentials(self):
+        """Fetch the app's federated identity credentials once"""
+        existing_credentials = await self._graph(
+            'federated_identity_credentials.get',
+            self.graph_client.applications.by_application_id(self.app_object_id).federated_identity_credentials.get()
+        )
+
+        if not existing_credentials or not existing_credentials.value:
+            return []
+
+        return existing_credentials.value
+
+
+    async def _create_federated_credentials(self, entries):
+        """Create credentials through Graph $batch, chained with dependsOn.
+
+        Entra rejects concurrent credential writes on one application, so each batch runs its
+        creates one after another on the server, still in a single round trip. A create that
+        fails for good makes Graph answer 424 for the rest of its chain, those are sent again
+        in a new chain without it.
+        """
+        results = {}
+
+        for start in range(0, len(entries), MAX_BATCH_SIZE):
+            pending = entries[start:start + MAX_BATCH_SIZE]
+
+            while pending:
+                requests = []
+
+                for position, entry in enumerate(pending):
+                    print(f"Creating federated credential: {entry['name']}")
+                    print(f"Subject: {entry['subject']}")
+                    requests.append(GraphBatchRequest(
+                        position,
+                        'POST',
+                        f"/applications/{self.app_object_id}/federatedIdentityCredentials",
+                        body={
+                            'name': entry['name'],
+                            'issuer': GITHUB_OIDC_ISSUER,
+                            'subject': entry['subject'],
+                            'description': entry['description'],
+                            'audiences': FEDERATED_AUDIENCES
+                        },
+                        depends_on=[position - 1] if position else None
+                    ))
+
+                batch_results = await self.graph_batcher.execute(requests)
+
+                # throttled dependencies were already retried by the batcher, a 424 left here
+                # waited on a create that failed for good
+                not_attempted = []
+                for position, entry in enumerate(pending):
+                    result = batch_results.get(str(position), {})
+
+                    if result.get('status') == 424:
+                        not_attempted.append(entry)
+                    else:
+                        results[entry['name']] = result
+
+                if len(not_attempted) == len(pending):
+                    # the chain's head has no dependency and cannot be 424, stop rather than loop
+                    for entry in not_attempted:
+                        results[entry['name']] = {'status': 424, 'body': {'error': {'message': "not attempted"}}}
+                    break
+
+                pending = not_attempted
+
+        return results
+
+
+    async def _ensure_federated_entries(self, entries):
+        """List existing credentials once and create the missing entries in batches"""
+
         if self.app_object_id is None:
             raise Exception("App object ID is not set. Create an app registration first.")
-            
-        if credential_name is None:
-            credential_name = f"{gh_org_user}-{repo}-federated"
 
+        existing = await self.list_federated_credentials()
+        existing_names = {cred.name for cred in existing}
+        existing_subjects = {(cred.issuer, cred.subject) for cred in existing}
+
+        # a credential exists when its subject does, whatever it is called
+        report = {}
+        missing = []
+        for entry in entries:
+            if (GITHUB_OIDC_ISSUER, entry['subject']) in existing_subjects:
+                print(f"Federated credential '{entry['name']}' already exists.")
+                report[entry['name']] = 'exists'
+
+            elif entry['name'] in existing_names:
+                # another subject holds the name, e.g. one named before names were hashed
+                hashed_name = self._federated_credential_name(
+                    entry['gh_org_user'], entry['repo'], entry['branch'], entry['primary'], hashed=True
+                )
+                missing.append({**entry, 'name': hashed_name, 'planned_name': entry['name']})
+
+            else:
+                missing.append(entry)
+
+        if not missing:
+            return report
+
+        results = await self._create_federated_credentials(missing)
+
+        # reported under the planned name, which is what callers know the credential by
+        for entry in missing:
+            result = results[entry['name']]
+            planned_name = entry.get('planned_name', entry['name'])
+
+            if result.get('status') == 201:
+                print(f"Federated credential created successfully! Credential ID: {result['body']['id']}")
+                report[planned_name] = 'created'
+
+            else:
+                error = (result.get('body') or {}).get('error', {}).get('message', "no response")
+                print(f"Error creating federated credential '{entry['name']}': {result.get('status')} - {error}")
+                report[planned_name] = Exception(f"{result.get('status')} - {error}")
+
+        return report
+
+
+    async def ensure_federated_credentials(self, gh_org_user, repos, branches=None):
+        """Create federated credentials for many repos and branches with one list call.
+
+        Returns a report keyed by credential name: 'exists', 'created' or the exception raised.
+        """
         if branches is None:
             branches = ["main"]
-        
 
-        try:                   
-            print(f"Checking if FedCredential name exists: '{credential_name}'")
-                        
-            existing_credentials = await self.graph_client.applications.by_application_id(
-                self.app_object_id).federated_identity_credentials.get()
-            
-            if not existing_credentials or not existing_credentials.value:
-                print(f"No federated credentials exist for this application")
-                
-            else:
-                matching_credentials = [
-                    cred for cred in existing_credentials.value 
-                    if cred.name == credential_name
-                ]
+        entries = self._federated_credential_entries(gh_org_user, repos, branches)
+        return await self._ensure_federated_entries(entries)
 
-                if matching_credentials:                
-                    print(f"Federated credential '{credential_name}' already exists.")
-                    return
 
-                else:
-                    print(f"Federated credential '{credential_name}' does not exist, creating it...")
-            
-            # If federated credential does not exist, create it
-            print(f"Creating new federated credential '{credential_name}'...")
-        
-            federated_credential = FederatedIdentityCredential()
-            federated_credential.name = credential_name
-            federated_credential.issuer = "https://token.actions.githubusercontent.com"
-            federated_credential.subject = f"repo:{gh_org_user}/{repo}:ref:refs/heads/{branches[0]}"
-            federated_credential.description = f"Federated credential for GitHub repo {repo}"
-            federated_credential.audiences = ["api://AzureADTokenExchange"]
-
-            full_repo_path = f"{gh_org_user}/{repo}"
-            print(f"Creating federated credential: {credential_name}")
-            print(f"GitHub Organization/Username: {gh_org_user}")
-            print(f"Repository: {repo}")
-            print(f"Subject: repo:{full_repo_path}:ref:refs/heads/{branches[0]}")
-            result = await self.graph_client.applications.by_application_id(self.app_object_id).federated_identity_credentials.post(federated_credential)
-
-            print(f"Federated credential created successfully!")
-            print(f"Credential ID: {result.id}")            
+    async def create_federated_credentials(self, gh_org_user, repo, credential_name=None, branches=None):
+        """Create federated credentials for GitHub Actions"""
 
-        except Exception as e:
-            print(f"Error creating federated credential: {str(e)}")
-            raise
+        if branches is None:
+            branches = ["main"]
+
+        entries = self._federated_credential_entries(gh_org_user, [repo], branches)
+
+        if credential_name is not None:
+            entries[0]['name'] = credential_name
+
+        report = await self._ensure_federated_entries(entries)
+
+        for result in report.values():
+            if isinstance(result, Exception):
+                raise result
+
+
+    async def rename_app_registration(self, display_name):
+        """Give the app registration and its service principal a new display name"""
+        from msgraph.generated.models.application import Application
+        from msgraph.generated.models.service_principal import ServicePrincipal
+
+        await self._graph(
+            'applications.patch',
+            self.graph_client.applications.by_application_id(self.app_object_id).patch(Application(display_name=display_name))
+        )
+
+        if self.service_principal_id:
+            await self._graph(
+                'service_principals.patch',
+                self.graph_client.service_principals.by_service_principal_id(self.service_principal_id).patch(
+                    ServicePrincipal(display_name=display_name)
+                )
+            )
+
+
+    async def delete_app_registration(self):
+        """Delete the app registration, Entra deletes its service principal and federated credentials with it"""
+        await self._graph(
+            'applications.delete',
+            self.graph_client.applications.by_application_id(self.app_object_id).delete()
+        )
+
+        self.app_object_id = None
+        self.app_id = None
+        self.service_principal_id = None
 
 
-    def _generate_guid(self):
-        """Generate a GUID for role assignment"""
-        import uuid
-        return str(uuid.uuid4())
\ No newline at end of file
+    def _generate_guid(self, *parts):
+        """Generate a deterministic GUID for role assignment so retries are idempotent"""
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, '|'.join(parts).lower()))
\ No newline at end of file
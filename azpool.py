@@ -0,0 +1,157 @@
+import asyncio
+import inspect
+import time
+import httpx
+from graphbatch import GraphBatcher
+from tokencache import token_cache, RememberingChainCredential
+
+
+# tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300
+
+
+class TenantCredential:
+    """Async credential pinned to one tenant, caching each scope's token until shortly before expiry.
+
+    Wraps a credential chain shared by every tenant, so the chain is probed once per run.
+    Without the cache the Azure CLI credential would start an az process for every token
+    request. With cache, the on-disk TokenCache of that chain, tokens also outlive the process.
+    """
+
+    def __init__(self, credential, tenant_id=None, cache=None):
+        self.credential = credential
+        self.tenant_id = tenant_id
+        self.cache = cache
+        self._tokens = {}
+        self._locks = {}
+
+    async def get_token(self, *scopes, **kwargs):
+        # a claims challenge or another tenant always needs a fresh token
+        tenant_id = kwargs.pop('tenant_id', None) or self.tenant_id
+        if kwargs.get('claims') or tenant_id != self.tenant_id:
+            return await self._fetch(scopes, tenant_id, **kwargs)
+
+        lock = self._locks.setdefault(scopes, asyncio.Lock())
+        async with lock:
+            token = self._tokens.get(scopes)
+            if token is None and self.cache is not None:
+                token = self.cache.get(self.tenant_id, scopes)
+
+            if token is None or token.expires_on - TOKEN_REFRESH_MARGIN < time.time():
+                token = await self._fetch(scopes, tenant_id, **kwargs)
+                if self.cache is not None:
+                    self.cache.put(self.tenant_id, scopes, token)
+
+            self._tokens[scopes] = token
+
+            return token
+
+    async def _fetch(self, scopes, tenant_id, **kwargs):
+        if tenant_id:
+            kwargs['tenant_id'] = tenant_id
+
+        return await self.credential.get_token(*scopes, **kwargs)
+
+    async def close(self):
+        # the wrapped credential is shared, AzureClientPool closes it
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class AzureClientPool:
+    """Credentials per tenant and clients per tenant and subscription, shared by many managers.
+
+    Pass one pool to AzureAppRegManager.create for every (tenant, subscription, resource group)
+    scope of a run. Managers built on a pool leave closing to the pool. limits caps the
+    concurrent calls per service across all of them, e.g. {'arm': 5, 'graph': 5}. credential,
+    transport (azure-core, for ARM) and http_transport (httpx, for Graph) replace the real
+    ones, e.g. with a fakeapi.FakeApi for offline runs.
+    """
+
+    def __init__(self, credential=None, transport=None, http_transport=None, limits=None):
+        self._base_credential = credential
+        self._limits = {service: asyncio.Semaphore(limit) for service, limit in (limits or {}).items()}
+        self._cache = None
+        self._credentials = {}
+        self._clients = {}
+        self._session = None
+        self._transport = transport
+        self._http_transport = http_transport
+
+    def credential(self, tenant_id=None):
+        """The cached credential for a tenant, None is the credential's default tenant"""
+        if tenant_id not in self._credentials:
+            if self._base_credential is None:
+                # one chain for every tenant, tokens for other tenants are requested by tenant_id
+                if token_cache.enabled:
+                    # the disk cache only serves the chain whose credential it remembers
+                    self._base_credential = RememberingChainCredential(token_cache)
+                    self._cache = token_cache
+
+                else:
+                    from azure.identity.aio import DefaultAzureCredential
+
+                    self._base_credential = DefaultAzureCredential(additionally_allowed_tenants=['*'])
+
+            self._credentials[tenant_id] = TenantCredential(self._base_credential, tenant_id, self._cache)
+
+        return self._credentials[tenant_id]
+
+    @property
+    def transport(self):
+        """One aiohttp session and transport shared by every ARM client"""
+        if self._transport is None:
+            import aiohttp
+            from azure.core.pipeline.transport import AioHttpTransport
+
+            self._session = aiohttp.ClientSession()
+            self._transport = AioHttpTransport(session=self._session, session_owner=False)
+
+        return self._transport
+
+    def http_client(self):
+        """A new httpx client for Graph calls on the pool's http_transport, None without one"""
+        if self._http_transport is None:
+            return None
+
+        return httpx.AsyncClient(transport=self._http_transport)
+
+    def limit(self, service):
+        """Semaphore every 'arm' or 'graph' call of the pool's managers holds, None when uncapped"""
+        return self._limits.get(service)
+
+    def graph_batcher(self, tenant_id=None):
+        """The Graph $batch client of a tenant, the same one its managers use"""
+        credential = self.credential(tenant_id)
+        return self.shared((credential, 'graph_batcher', None), lambda: GraphBatcher(
+            credential, client=self.http_client(), semaphore=self.limit('graph')
+        ))
+
+    def shared(self, key, build):
+        """Return the client stored under key, building it on first use"""
+        if key not in self._clients:
+            self._clients[key] = build()
+
+        return self._clients[key]
+
+    async def close(self):
+        for client in self._clients.values():
+            close = getattr(client, 'aclose', None) or getattr(client, 'close', None)
+
+            if close is not None:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+
+        self._clients = {}
+
+        if self._base_credential is not None:
+            await self._base_credential.close()
+
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+import githubsec
+from azpool import AzureClientPool
+from fakeapi import FakeApi, FakeCredential, FAKE_SUBSCRIPTION_ID, FAKE_TENANT_ID
+from instrumentation import tracer
+from main import run_onboarding
+from preflight import run_preflight
+from state import StateStore
+
+
+DEFAULT_SIZES = [1, 10, 100, 1000]
+
+
+def write_app_key(directory):
+    """Point the GitHub client at a throwaway app private key, FakeApi accepts any signed JWT"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    path = os.path.join(directory, 'fake-app.pem')
+
+    with open(path, 'wb') as key_file:
+        key_file.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ))
+
+    os.environ['GITHUB_APP_ID'] = '1'
+    os.environ['GITHUB_APP_PRIVATE_KEY_PATH'] = path
+    os.environ.pop('GITHUB_APP_INSTALL_ID', None)
+
+
+def benchmark_config(api, repositories, use_org_secrets=False):
+    return {
+        'repositories': repositories,
+        'gh_org_user': api.owner,
+        'app_name': 'bench-app',
+        'app_description': "App created by the benchmark",
+        'rgname': api.resource_group,
+        'container_registry': 'fakeacr',
+        'cluster_name': None,
+        'aks_enabled': False,
+        'use_org_secrets': use_org_secrets,
+        'branches': ["main"]
+    }
+
+
+async def onboard(api, config, github_rps):
+    """Preflight then onboarding, the same flow main() runs, against api"""
+    pool = AzureClientPool(FakeCredential(), api.azure_transport(), api.http_transport())
+    gh_secret_magic = githubsec.AsyncGitHubSecretMagic(
+        rate_limiter=githubsec.GitHubRateLimiter(requests_per_second=github_rps, burst=int(github_rps)),
+        transport=api.http_transport()
+    )
+
+    try:
+        preflight = await run_preflight(config, pool, gh_secret_magic, FAKE_SUBSCRIPTION_ID, FAKE_TENANT_ID)
+
+        if not preflight.ok:
+            failed = [f"{check['check']}: {check['message']}" for check in preflight.checks if check['ok'] is False]
+            raise Exception(f"Preflight failed against the fake API: {failed}")
+
+        await run_onboarding(
+            preflight.az_app_manager, config, StateStore(None, ttl=0), None, gh_secret_magic, preflight.repo_checks
+        )
+
+    finally:
+        await gh_secret_magic.aclose()
+        await pool.close()
+
+
+async def warm_up(args):
+    """One untimed run, the SDKs import lazily on first use and that would be billed to the first size"""
+    api = FakeApi(repositories=['warm-up'])
+
+    with redirect_stdout(io.StringIO()):
+        await onboard(api, benchmark_config(api, ['warm-up']), args.github_rps)
+
+
+async def measured_onboard(repositories, args, trace_memory=False):
+    """Onboard repositories against a fresh FakeApi, returns (api, seconds, peak bytes or None)"""
+    api = FakeApi(
+        repositories=repositories, latency=args.latency, rate_limit=args.rate_limit, propagation_delay=args.propagation_delay
+    )
+    config = benchmark_config(api, repositories, args.org_secrets)
+
+    tracer.spans.clear()
+    if trace_memory:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+
+    # the tool prints a few lines per repo, only shown with --verbose
+    with redirect_stdout(sys.stdout if args.verbose and not trace_memory else io.StringIO()):
+        await onboard(api, config, args.github_rps)
+
+    seconds = time.perf_counter() - started
+    peak = None
+
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return api, seconds, peak
+
+
+async def run_benchmark(size, args):
+    """Onboard size repos and measure the run.
+
+    Peak memory comes from a second run under tracemalloc, which slows Python down too much
+    for that run's time to mean anything.
+    """
+    repositories = [f"repo-{position:04d}" for position in range(size)]
+
+    api, seconds, _ = await measured_onboard(repositories, args)
+
+    peak = None
+    if not args.no_memory:
+        _, _, peak = await measured_onboard(repositories, args, trace_memory=True)
+
+    # the run only counts if every repo ended up with its secrets
+    missing = [repo for repo in repositories if not api.secrets[repo] and not api.org_secrets]
+
+    return {
+        'repositories': size,
+        'seconds': round(seconds, 3),
+        'calls': sum(count for label, count in api.calls.items() if not label.startswith('[batch]')),
+        'peak_mib': round(peak / 2 ** 20, 2) if peak is not None else None,
+        'apps': len(api.applications),
+        'missing_secrets': len(missing),
+        'per_endpoint': dict(sorted(api.calls.items()))
+    }
+
+
+def print_results(results, baseline=None):
+    baseline = {result['repositories']: result for result in baseline or []}
+
+    print(f"\n{'repos':>6} {'seconds':>9} {'calls':>7} {'peak MiB':>9} {'apps':>5}  baseline")
+    for result in results:
+        before = baseline.get(result['repositories'])
+        peak = f"{result['peak_mib']:.2f}" if result['peak_mib'] is not None else '-'
+
+        delta = ""
+        if before:
+            delta = f"{result['seconds'] - before['seconds']:+.2f}s, {result['calls'] - before['calls']:+d} calls"
+            if result['peak_mib'] is not None and before['peak_mib'] is not None:
+                delta += f", {result['peak_mib'] - before['peak_mib']:+.2f} MiB"
+
+        print(f"{result['repositories']:>6} {result['seconds']:>9.2f} {result['calls']:>7} {peak:>9} {result['apps']:>5}  {delta}")
+
+    endpoints = sorted({label for result in results for label in result['per_endpoint']})
+    sizes = "".join(f"{result['repositories']:>7}" for result in results)
+
+    print(f"\n{'calls per endpoint':<90}{sizes}")
+    for label in endpoints:
+        counts = "".join(f"{result['per_endpoint'].get(label, 0):>7}" for result in results)
+        print(f"{label:<90}{counts}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Time preflight and onboarding against the offline fake API")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="repo counts to benchmark")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every fake API call")
+    parser.add_argument('--rate-limit', type=int, default=None, help="calls per second each fake service accepts before 429")
+    parser.add_argument('--propagation-delay', type=float, default=0.0, help="seconds before a new service principal can get roles")
+    parser.add_argument('--github-rps', type=float, default=1000.0, help="client side GitHub pacing, the tool's default is 10")
+    parser.add_argument('--org-secrets', action='store_true', help="write shared values as org secrets")
+    parser.add_argument('--no-memory', action='store_true', help="skip the slower tracemalloc run that measures peak memory")
+    parser.add_argument('--json', metavar='PATH', help="write the results to this file, e.g. to keep as a baseline")
+    parser.add_argument('--baseline', metavar='PATH', help="compare against results written earlier with --json")
+    parser.add_argument('--verbose', action='store_true', help="show the tool's own output")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        write_app_key(directory)
+        await warm_up(args)
+
+        for size in args.sizes:
+            print(f"Onboarding {size} repositories against the fake API...")
+            results.append(await run_benchmark(size, args))
+
+            if results[-1]['missing_secrets']:
+                print(f"Warning: {results[-1]['missing_secrets']} repositories got no secrets")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
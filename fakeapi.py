@@ -0,0 +1,645 @@
+import asyncio
+import json
+import re
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import httpx
+from azure.core.pipeline.transport import AsyncHttpTransport
+from azure.core.rest._http_response_impl_async import AsyncHttpResponseImpl
+from azure.core.utils import CaseInsensitiveDict
+from nacl import encoding, public
+
+
+GITHUB_HOST = 'api.github.com'
+GRAPH_HOST = 'graph.microsoft.com'
+ARM_HOST = 'management.azure.com'
+
+FAKE_SUBSCRIPTION_ID = '00000000-0000-0000-0000-000000000001'
+FAKE_TENANT_ID = '00000000-0000-0000-0000-0000000000aa'
+
+PER_PAGE = 30
+
+
+def fake_response(status, body=None, headers=None):
+    """(status, headers, body) as the handlers return it"""
+    return status, dict(headers or {}), body
+
+
+def arm_error(status, code, message):
+    return fake_response(status, {'error': {'code': code, 'message': message}})
+
+
+def graph_error(status, code, message):
+    return fake_response(status, {'error': {'code': code, 'message': message}})
+
+
+class FakeCredential:
+    """Async token credential handing out a fake bearer token, for runs against FakeApi"""
+
+    async def get_token(self, *scopes, **kwargs):
+        from azure.core.credentials import AccessToken
+
+        return AccessToken('fake-azure-token', int(time.time()) + 3600)
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class FakeApi:
+    """Offline stand-in for the GitHub, Microsoft Graph and ARM endpoints this tool calls.
+
+    State lives in memory and requests never leave the process: http_transport() serves the
+    httpx clients (GitHub, Graph $batch and the Graph SDK) and azure_transport() the ARM clients.
+    latency is added to every HTTP call, rate_limit caps the calls per second each service
+    accepts before answering 429 with Retry-After, and propagation_delay keeps a new service
+    principal unknown to role assignments for that many seconds, as Entra replication does.
+    calls counts every call per endpoint, $batch sub-requests included.
+    """
+
+    def __init__(self, owner='fake-org', repositories=(), latency=0.0, rate_limit=None, propagation_delay=0.0,
+                 resource_group='fake-rg', container_registry='fakeacr', cluster_name='fake-aks'):
+        self.owner = owner
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.propagation_delay = propagation_delay
+        self.resource_group = resource_group
+
+        self.calls = Counter()
+        self._recent = {}
+
+        # github
+        self.installation_id = '4242'
+        self.repositories = {}
+        self.secrets = {}
+        self.org_secrets = {}
+        self._secret_key = public.PrivateKey.generate()
+        self._key_id = '5678'
+
+        for name in repositories:
+            self.add_repository(name)
+
+        # graph
+        self.applications = {}
+        self.service_principals = {}
+        self.federated_credentials = {}
+
+        # arm
+        self.resource_groups = {resource_group.lower(): resource_group}
+        self.resources = [
+            ('Microsoft.ContainerRegistry/registries', container_registry),
+            ('Microsoft.ContainerService/managedClusters', cluster_name)
+        ]
+        self.role_assignments = {}
+
+        self._routes = [
+            (GITHUB_HOST, 'GET', r'/app/installations', self._installations),
+            (GITHUB_HOST, 'POST', r'/app/installations/(?P<installation_id>[^/]+)/access_tokens', self._access_token),
+            (GITHUB_HOST, 'POST', r'/graphql', self._graphql),
+            (GITHUB_HOST, 'GET', r'/installation/repositories', self._installation_repositories),
+            (GITHUB_HOST, 'GET', r'/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)', self._repository),
+            (GITHUB_HOST, 'GET', r'/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/actions/secrets/public-key', self._public_key),
+            (GITHUB_HOST, 'GET', r'/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/actions/secrets', self._list_secrets),
+            (GITHUB_HOST, 'PUT', r'/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/actions/secrets/(?P<name>[^/]+)', self._put_secret),
+            (GITHUB_HOST, 'DELETE', r'/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/actions/secrets/(?P<name>[^/]+)', self._delete_secret),
+            (GITHUB_HOST, 'GET', r'/orgs/(?P<org>[^/]+)/actions/secrets/public-key', self._public_key),
+            (GITHUB_HOST, 'GET', r'/orgs/(?P<org>[^/]+)/actions/secrets', self._list_org_secrets),
+            (GITHUB_HOST, 'PUT', r'/orgs/(?P<org>[^/]+)/actions/secrets/(?P<name>[^/]+)', self._put_org_secret),
+            (GITHUB_HOST, 'DELETE', r'/orgs/(?P<org>[^/]+)/actions/secrets/(?P<name>[^/]+)', self._delete_org_secret),
+            (GITHUB_HOST, 'GET', r'/orgs/(?P<org>[^/]+)/actions/secrets/(?P<name>[^/]+)/repositories', self._org_secret_repositories),
+            (GITHUB_HOST, 'PUT', r'/orgs/(?P<org>[^/]+)/actions/secrets/(?P<name>[^/]+)/repositories', self._set_org_secret_repositories),
+
+            (GRAPH_HOST, 'POST', r'/v1.0/\$batch', self._batch),
+            (GRAPH_HOST, 'GET', r'/v1.0/applications', self._list_applications),
+            (GRAPH_HOST, 'POST', r'/v1.0/applications', self._create_application),
+            (GRAPH_HOST, 'PATCH', r'/v1.0/applications/(?P<object_id>[^/]+)', self._update_application),
+            (GRAPH_HOST, 'DELETE', r'/v1.0/applications/(?P<object_id>[^/]+)', self._delete_application),
+            (GRAPH_HOST, 'GET', r'/v1.0/applications/(?P<object_id>[^/]+)/federatedIdentityCredentials', self._list_federated),
+            (GRAPH_HOST, 'POST', r'/v1.0/applications/(?P<object_id>[^/]+)/federatedIdentityCredentials', self._create_federated),
+            (GRAPH_HOST, 'GET', r'/v1.0/servicePrincipals', self._list_service_principals),
+            (GRAPH_HOST, 'POST', r'/v1.0/servicePrincipals', self._create_service_principal),
+            (GRAPH_HOST, 'PATCH', r'/v1.0/servicePrincipals/(?P<object_id>[^/]+)', self._update_service_principal),
+
+            (ARM_HOST, 'GET', r'/subscriptions/(?P<sub>[^/]+)/resourcegroups/(?P<rg>[^/]+)', self._resource_group),
+            (ARM_HOST, 'GET', r'/subscriptions/(?P<sub>[^/]+)/resources', self._list_resources),
+            (ARM_HOST, 'GET', r'/subscriptions/(?P<sub>[^/]+)/resourcegroups/(?P<rg>[^/]+)/providers/microsoft\.authorization/permissions', self._permissions),
+            (ARM_HOST, 'GET', r'(?P<scope>/subscriptions/.*)/providers/microsoft\.authorization/roleassignments', self._list_role_assignments),
+            (ARM_HOST, 'PUT', r'(?P<scope>/subscriptions/.*)/providers/microsoft\.authorization/roleassignments/(?P<name>[^/]+)', self._create_role_assignment),
+            (ARM_HOST, 'DELETE', r'(?P<scope>/subscriptions/.*)/providers/microsoft\.authorization/roleassignments/(?P<name>[^/]+)', self._delete_role_assignment),
+        ]
+
+
+    def add_repository(self, name, private=True, topics=()):
+        self.repositories[name] = {'id': 100000 + len(self.repositories), 'private': private, 'topics': list(topics)}
+        self.secrets[name] = {}
+
+
+    def http_transport(self):
+        """httpx transport answering from this FakeApi"""
+        return httpx.MockTransport(self._handle_httpx)
+
+
+    def azure_transport(self):
+        """azure-core async transport answering from this FakeApi"""
+        return FakeAzureTransport(self)
+
+
+    async def handle(self, method, url, body=None):
+        """Answer one HTTP call, returns (status, headers, body)"""
+        await asyncio.sleep(self.latency)
+        return self._dispatch(method, url, body)
+
+
+    def _dispatch(self, method, url, body, batched=False):
+        parts = urlsplit(url)
+        host = parts.netloc
+        path = unquote(parts.path).rstrip('/')
+        query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+
+        for route_host, route_method, pattern, handler in self._routes:
+            if route_host != host or route_method != method:
+                continue
+
+            match = re.fullmatch(pattern, path, re.IGNORECASE if host == ARM_HOST else 0)
+            if match is None:
+                continue
+
+            label = f"{method} {host}{self._template(pattern)}"
+            self.calls[f"[batch] {label}" if batched else label] += 1
+
+            # the $batch envelope is never throttled, its requests are
+            if handler != self._batch and self._throttled(host):
+                return fake_response(429, {'message': "fake rate limit exceeded"}, {'Retry-After': '1'})
+
+            return handler(query=query, body=body, **match.groupdict())
+
+        self.calls[f"{method} {host} (unhandled)"] += 1
+        return fake_response(404, {'message': f"no fake for {method} {path}"})
+
+
+    def _template(self, pattern):
+        # r'/repos/(?P<owner>[^/]+)' -> '/repos/{owner}'
+        return re.sub(r'\(\?P<(\w+)>[^)]*\)', r'{\1}', pattern).replace('\\', '')
+
+
+    def _throttled(self, host):
+        if not self.rate_limit:
+            return False
+
+        now = time.monotonic()
+        recent = self._recent.setdefault(host, deque())
+
+        while recent and recent[0] <= now - 1.0:
+            recent.popleft()
+
+        if len(recent) >= self.rate_limit:
+            return True
+
+        recent.append(now)
+        return False
+
+
+    async def _handle_httpx(self, request):
+        body = json.loads(request.content) if request.content else None
+        status, headers, response_body = await self.handle(request.method, str(request.url), body)
+
+        if response_body is None:
+            return httpx.Response(status, headers=headers)
+
+        return httpx.Response(status, headers=headers, json=response_body)
+
+
+    # github
+
+    def _installations(self, query, body):
+        return fake_response(200, [{'id': int(self.installation_id), 'account': {'login': self.owner}}])
+
+
+    def _access_token(self, query, body, installation_id):
+        expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+
+        return fake_response(201, {
+            'token': f"ghs_fake{installation_id}",
+            'expires_at': expires_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'permissions': {'secrets': 'write', 'organization_secrets': 'write', 'metadata': 'read'}
+        })
+
+
+    def _graphql(self, query, body):
+        variables = body.get('variables', {})
+        data = {}
+        errors = []
+
+        for name, value in variables.items():
+            if not name.startswith('n'):
+                continue
+
+            alias = f"r{name[1:]}"
+            repo = self.repositories.get(value) if variables.get(f"o{name[1:]}") == self.owner else None
+
+            if repo:
+                data[alias] = {'databaseId': repo['id'], 'isPrivate': repo['private']}
+            else:
+                data[alias] = None
+                errors.append({'type': 'NOT_FOUND', 'path': [alias], 'message': f"Could not resolve to a Repository with the name '{value}'."})
+
+        return fake_response(200, {'data': data, 'errors': errors} if errors else {'data': data})
+
+
+    def _repository_object(self, name):
+        repo = self.repositories[name]
+
+        return {
+            'id': repo['id'],
+            'name': name,
+            'full_name': f"{self.owner}/{name}",
+            'owner': {'login': self.owner},
+            'private': repo['private'],
+            'archived': False,
+            'topics': repo['topics']
+        }
+
+
+    def _page(self, url, items, query):
+        """One page of items and the Link header pointing at the next"""
+        per_page = int(query.get('per_page', PER_PAGE))
+        page = int(query.get('page', 1))
+        headers = {}
+
+        if page * per_page < len(items):
+            headers['Link'] = f'<https://{GITHUB_HOST}{url}?per_page={per_page}&page={page + 1}>; rel="next"'
+
+        return items[(page - 1) * per_page:page * per_page], headers
+
+
+    def _installation_repositories(self, query, body):
+        items, headers = self._page(
+            '/installation/repositories', [self._repository_object(name) for name in self.repositories], query
+        )
+        return fake_response(200, {'total_count': len(self.repositories), 'repositories': items}, headers)
+
+
+    def _repository(self, query, body, owner, repo):
+        if owner != self.owner or repo not in self.repositories:
+            return fake_response(404, {'message': "Not Found"})
+
+        return fake_response(200, self._repository_object(repo))
+
+
+    def _public_key(self, query, body, owner=None, repo=None, org=None):
+        if repo is not None and (owner != self.owner or repo not in self.repositories):
+            return fake_response(404, {'message': "Not Found"})
+
+        return fake_response(200, {'key_id': self._key_id, 'key': self._secret_key.public_key.encode(encoding.Base64Encoder).decode()})
+
+
+    def _list_secrets(self, query, body, owner, repo):
+        if owner != self.owner or repo not in self.repositories:
+            return fake_response(404, {'message': "Not Found"})
+
+        names = sorted(self.secrets[repo])
+        items, headers = self._page(f'/repos/{owner}/{repo}/actions/secrets', [{'name': name} for name in names], query)
+        return fake_response(200, {'total_count': len(names), 'secrets': items}, headers)
+
+
+    def _decrypt(self, body):
+        if body.get('key_id') != self._key_id:
+            return None
+
+        box = public.SealedBox(self._secret_key)
+        return box.decrypt(body['encrypted_value'].encode(), encoder=encoding.Base64Encoder).decode()
+
+
+    def _put_secret(self, query, body, owner, repo, name):
+        if owner != self.owner or repo not in self.repositories:
+            return fake_response(404, {'message': "Not Found"})
+
+        value = self._decrypt(body)
+        if value is None:
+            return fake_response(422, {'message': "Bad key_id"})
+
+        created = name.upper() not in self.secrets[repo]
+        self.secrets[repo][name.upper()] = value
+
+        return fake_response(201 if created else 204)
+
+
+    def _delete_secret(self, query, body, owner, repo, name):
+        if self.secrets.get(repo, {}).pop(name.upper(), None) is None:
+            return fake_response(404, {'message': "Not Found"})
+
+        return fake_response(204)
+
+
+    def _list_org_secrets(self, query, body, org):
+        secrets = [
+            {'name': name, 'visibility': secret['visibility']} for name, secret in sorted(self.org_secrets.items())
+        ]
+        items, headers = self._page(f'/orgs/{org}/actions/secrets', secrets, query)
+        return fake_response(200, {'total_count': len(secrets), 'secrets': items}, headers)
+
+
+    def _put_org_secret(self, query, body, org, name):
+        value = self._decrypt(body)
+        if value is None:
+            return fake_response(422, {'message': "Bad key_id"})
+
+        created = name.upper() not in self.org_secrets
+        secret = self.org_secrets.setdefault(name.upper(), {'repositories': []})
+        secret.update(value=value, visibility=body.get('visibility', 'private'))
+
+        return fake_response(201 if created else 204)
+
+
+    def _delete_org_secret(self, query, body, org, name):
+        if self.org_secrets.pop(name.upper(), None) is None:
+            return fake_response(404, {'message': "Not Found"})
+
+        return fake_response(204)
+
+
+    def _org_secret_repositories(self, query, body, org, name):
+        secret = self.org_secrets.get(name.upper())
+        if secret is None:
+            return fake_response(404, {'message': "Not Found"})
+
+        items, headers = self._page(
+            f'/orgs/{org}/actions/secrets/{name}/repositories', [{'id': repo_id} for repo_id in secret['repositories']], query
+        )
+        return fake_response(200, {'total_count': len(secret['repositories']), 'repositories': items}, headers)
+
+
+    def _set_org_secret_repositories(self, query, body, org, name):
+        secret = self.org_secrets.get(name.upper())
+        if secret is None:
+            return fake_response(404, {'message': "Not Found"})
+
+        secret['repositories'] = list(body['selected_repository_ids'])
+        return fake_response(204)
+
+
+    # graph
+
+    def _batch(self, query, body):
+        """Run the sub-requests in order, a failed dependency fails its dependents with 424"""
+        responses = []
+        statuses = {}
+
+        for request in body['requests']:
+            if any(statuses.get(dep, 500) >= 400 for dep in request.get('dependsOn', [])):
+                status, headers, response_body = graph_error(424, 'FailedDependency', "A request it depends on failed")
+
+            else:
+                status, headers, response_body = self._dispatch(
+                    request['method'], f"https://{GRAPH_HOST}/v1.0{request['url']}", request.get('body'), batched=True
+                )
+
+            statuses[request['id']] = status
+            responses.append({'id': request['id'], 'status': status, 'headers': headers, 'body': response_body})
+
+        return fake_response(200, {'responses': responses})
+
+
+    def _filter_value(self, query, field):
+        # "displayName eq 'name'" -> 'name'
+        match = re.fullmatch(rf"{field} eq '(.*)'", query.get('$filter', ''))
+        return match.group(1).replace("''", "'") if match else None
+
+
+    def _list_applications(self, query, body):
+        name = self._filter_value(query, 'displayName')
+        apps = [app for app in self.applications.values() if name is None or app['displayName'] == name]
+
+        return fake_response(200, {'value': apps})
+
+
+    def _create_application(self, query, body):
+        app = {'id': str(uuid.uuid4()), 'appId': str(uuid.uuid4()), 'displayName': body['displayName']}
+        self.applications[app['id']] = app
+        self.federated_credentials[app['id']] = []
+
+        return fake_response(201, app)
+
+
+    def _update_application(self, query, body, object_id):
+        if object_id not in self.applications:
+            return graph_error(404, 'Request_ResourceNotFound', f"Resource '{object_id}' does not exist")
+
+        self.applications[object_id].update(body)
+        return fake_response(204)
+
+
+    def _delete_application(self, query, body, object_id):
+        app = self.applications.pop(object_id, None)
+        if app is None:
+            return graph_error(404, 'Request_ResourceNotFound', f"Resource '{object_id}' does not exist")
+
+        self.federated_credentials.pop(object_id, None)
+        for sp_id, sp in list(self.service_principals.items()):
+            if sp['appId'] == app['appId']:
+                del self.service_principals[sp_id]
+
+        return fake_response(204)
+
+
+    def _list_federated(self, query, body, object_id):
+        if object_id not in self.applications:
+            return graph_error(404, 'Request_ResourceNotFound', f"Resource '{object_id}' does not exist")
+
+        return fake_response(200, {'value': self.federated_credentials[object_id]})
+
+
+    def _create_federated(self, query, body, object_id):
+        if object_id not in self.applications:
+            return graph_error(404, 'Request_ResourceNotFound', f"Resource '{object_id}' does not exist")
+
+        if any(credential['name'] == body['name'] for credential in self.federated_credentials[object_id]):
+            return graph_error(409, 'Request_MultipleObjectsWithSameKeyValue', "FederatedIdentityCredential with name already exists")
+
+        if len(self.federated_credentials[object_id]) >= 20:
+            return graph_error(400, 'Request_BadRequest', "Maximum number of federated identity credentials reached")
+
+        credential = {'id': str(uuid.uuid4()), **body}
+        self.federated_credentials[object_id].append(credential)
+
+        return fake_response(201, credential)
+
+
+    def _list_service_principals(self, query, body):
+        app_id = self._filter_value(query, 'appId')
+        sps = [
+            {key: value for key, value in sp.items() if key != 'createdAt'}
+            for sp in self.service_principals.values() if app_id is None or sp['appId'] == app_id
+        ]
+
+        return fake_response(200, {'value': sps})
+
+
+    def _create_service_principal(self, query, body):
+        sp = {'id': str(uuid.uuid4()), 'appId': body['appId'], 'createdAt': time.monotonic()}
+        self.service_principals[sp['id']] = sp
+
+        return fake_response(201, {'id': sp['id'], 'appId': sp['appId']})
+
+
+    def _update_service_principal(self, query, body, object_id):
+        if object_id not in self.service_principals:
+            return graph_error(404, 'Request_ResourceNotFound', f"Resource '{object_id}' does not exist")
+
+        self.service_principals[object_id].update(body)
+        return fake_response(204)
+
+
+    # arm
+
+    def _resource_group(self, query, body, sub, rg):
+        if rg.lower() not in self.resource_groups:
+            return arm_error(404, 'ResourceGroupNotFound', f"Resource group '{rg}' could not be found.")
+
+        name = self.resource_groups[rg.lower()]
+        return fake_response(200, {
+            'id': f"/subscriptions/{sub}/resourceGroups/{name}",
+            'name': name,
+            'type': 'Microsoft.Resources/resourceGroups',
+            'location': 'westeurope',
+            'properties': {'provisioningState': 'Succeeded'}
+        })
+
+
+    def _list_resources(self, query, body, sub):
+        resource_type = re.fullmatch(r"resourceType eq '(.*)'", query.get('$filter', ''))
+        resources = [
+            {
+                'id': f"/subscriptions/{sub}/resourceGroups/{self.resource_group}/providers/{kind}/{name}",
+                'name': name,
+                'type': kind,
+                'location': 'westeurope'
+            }
+            for kind, name in self.resources
+            if name and (resource_type is None or resource_type.group(1).lower() == kind.lower())
+        ]
+
+        return fake_response(200, {'value': resources})
+
+
+    def _permissions(self, query, body, sub, rg):
+        return fake_response(200, {'value': [{'actions': ['*'], 'notActions': []}]})
+
+
+    def _role_assignment_object(self, name, assignment):
+        return {
+            'id': f"{assignment['scope']}/providers/Microsoft.Authorization/roleAssignments/{name}",
+            'name': name,
+            'type': 'Microsoft.Authorization/roleAssignments',
+            'properties': assignment
+        }
+
+
+    def _list_role_assignments(self, query, body, scope):
+        principal_id = self._filter_value(query, 'principalId')
+        scope = scope.lower()
+
+        assignments = [
+            self._role_assignment_object(name, assignment)
+            for name, assignment in self.role_assignments.items()
+            if (principal_id is None or assignment['principalId'] == principal_id)
+            and (assignment['scope'].lower().startswith(scope) or scope.startswith(assignment['scope'].lower()))
+        ]
+
+        return fake_response(200, {'value': assignments})
+
+
+    def _create_role_assignment(self, query, body, scope, name):
+        properties = body['properties']
+        principal_id = properties['principalId']
+        sp = self.service_principals.get(principal_id)
+
+        if sp is None or time.monotonic() - sp['createdAt'] < self.propagation_delay:
+            return arm_error(
+                400, 'PrincipalNotFound', f"Principal {principal_id} does not exist in the directory {FAKE_TENANT_ID}."
+            )
+
+        if name in self.role_assignments:
+            return arm_error(409, 'RoleAssignmentExists', "The role assignment already exists.")
+
+        self.role_assignments[name] = {
+            'scope': scope,
+            'roleDefinitionId': properties['roleDefinitionId'],
+            'principalId': principal_id,
+            'principalType': properties.get('principalType', 'ServicePrincipal')
+        }
+
+        return fake_response(201, self._role_assignment_object(name, self.role_assignments[name]))
+
+
+    def _delete_role_assignment(self, query, body, scope, name):
+        assignment = self.role_assignments.pop(name, None)
+        if assignment is None:
+            return fake_response(204)
+
+        return fake_response(200, self._role_assignment_object(name, assignment))
+
+
+class FakeAzureResponse(AsyncHttpResponseImpl):
+    """Response whose body is already in memory, so the sync body() azure-core still calls works"""
+
+    def body(self):
+        return self.content
+
+
+class FakeAzureTransport(AsyncHttpTransport):
+    """azure-core async transport that hands every request to a FakeApi"""
+
+    def __init__(self, api):
+        self.api = api
+
+
+    async def send(self, request, **kwargs):
+        content = getattr(request, 'content', None) or getattr(request, 'body', None)
+        if isinstance(content, bytes):
+            content = content.decode()
+
+        body = json.loads(content) if content else None
+        status, headers, response_body = await self.api.handle(request.method, request.url, body)
+
+        payload = json.dumps(response_body).encode() if response_body is not None else b''
+        headers = CaseInsensitiveDict({'Content-Type': 'application/json', 'Content-Length': str(len(payload)), **headers})
+
+        response = FakeAzureResponse(
+            request=request,
+            internal_response=None,
+            status_code=status,
+            reason='',
+            content_type=headers['Content-Type'],
+            headers=headers,
+            stream_download_generator=None
+        )
+        response._content = payload
+        response._is_closed = True
+
+        return response
+
+
+    async def open(self):
+        pass
+
+
+    async def close(self):
+        pass
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
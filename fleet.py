@@ -0,0 +1,508 @@
+import argparse
+import asyncio
+import json
+import sys
+from azapp import AzureAppRegManager, find_apps_by_display_names, ensure_roles_across_scopes
+from azpool import AzureClientPool
+import githubsec
+from main import create_repo_secrets
+from shards import provision_shards, shard_lookup_names
+from instrumentation import tracer
+from tokencache import token_cache
+from appindex import AppIndex, DEFAULT_INDEX_PATH
+
+
+if sys.platform == 'win32':
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+DEFAULT_CONCURRENCY = {
+    'global': 20,
+    'graph': 5,
+    'arm': 5,
+    'github': 10
+}
+
+
+def load_manifest(path):
+    """Load a fleet manifest from a .json or .yaml/.yml file.
+
+    The manifest holds optional 'defaults' and 'concurrency' sections and a list of
+    'bindings', each tying one app registration to a set of repos and to one resource group,
+    or to several (tenant, subscription, resource group) entries under 'scopes'.
+    """
+    with open(path, 'r', encoding='utf-8') as manifest_file:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise Exception("PyYAML is required for YAML manifests: pip install pyyaml")
+
+            manifest = yaml.safe_load(manifest_file)
+
+        else:
+            manifest = json.load(manifest_file)
+
+    if not manifest or not manifest.get('bindings'):
+        raise Exception(f"Manifest '{path}' has no bindings")
+
+    defaults = manifest.get('defaults', {})
+    bindings = []
+
+    for position, binding in enumerate(manifest['bindings']):
+        binding = {**defaults, **binding}
+
+        for field in ('app_name', 'gh_org_user'):
+            if not binding.get(field):
+                raise Exception(f"Binding {position} is missing '{field}'")
+
+        if not binding.get('repositories') and not binding.get('repository_selector'):
+            raise Exception(f"Binding {position} needs 'repositories' or a 'repository_selector'")
+
+        binding.setdefault('app_description', "App created via Python")
+        binding.setdefault('container_registry', None)
+        binding.setdefault('cluster_name', None)
+        binding.setdefault('aks_enabled', False)
+        binding.setdefault('branches', ["main"])
+        binding.setdefault('use_org_secrets', False)
+        binding.setdefault('repositories', [])
+        binding.setdefault('repo_checks', {})
+        binding['scopes'] = binding_scopes(binding, position)
+        # app names may repeat across bindings, task names use the position as well
+        binding['key'] = f"{position}:{binding['app_name']}"
+        bindings.append(binding)
+
+    concurrency = {**DEFAULT_CONCURRENCY, **manifest.get('concurrency', {})}
+
+    return bindings, concurrency
+
+
+def binding_scopes(binding, position):
+    """The binding's scopes, each filled in from the binding's own settings.
+
+    A scope's name suffixes its secrets (SUBSCRIPTION_ID_PROD), one scope may leave it out.
+    Scopes without tenant_id use the credential's default tenant.
+    """
+    scopes = []
+
+    for scope in binding.get('scopes') or [{}]:
+        scope = {
+            'name': None,
+            'tenant_id': binding.get('tenant_id'),
+            'subscription_id': binding.get('subscription_id'),
+            'resource_group': binding.get('resource_group'),
+            'container_registry': binding['container_registry'],
+            'cluster_name': binding['cluster_name'],
+            'aks_enabled': binding['aks_enabled'],
+            **scope
+        }
+
+        if not scope['resource_group']:
+            raise Exception(f"Binding {position} is missing 'resource_group'")
+
+        scopes.append(scope)
+
+    names = [scope['name'] for scope in scopes]
+    if len(set(names)) != len(names):
+        raise Exception(f"Binding {position} needs a distinct name for each scope")
+
+    return scopes
+
+
+def scope_secrets(app_info, scope):
+    """Secret values of one scope, named after the scope when it has a name"""
+    if not scope['name']:
+        return app_info
+
+    return {f"{key}_{scope['name']}": value for key, value in app_info.items()}
+
+
+class DagScheduler:
+    """Run async tasks in dependency order under a global cap plus per-pool caps.
+
+    A failed task only skips the tasks that depend on it, everything else keeps running.
+    """
+
+    def __init__(self, concurrency):
+        self._global = asyncio.Semaphore(concurrency['global'])
+        self._pools = {
+            name: asyncio.Semaphore(limit) for name, limit in concurrency.items() if name != 'global'
+        }
+        self._tasks = {}
+        self.results = {}
+
+    def add(self, name, factory, deps=(), pool=None, phase=None):
+        """Register a task; factory is called with the results of deps once they succeed.
+
+        phase names the step the task's calls are counted under in the run summary.
+        """
+        if name in self._tasks:
+            raise Exception(f"Duplicate task '{name}'")
+
+        for dep in deps:
+            if dep not in self._tasks:
+                raise Exception(f"Task '{name}' depends on unknown task '{dep}'")
+
+        self._tasks[name] = (factory, tuple(deps), pool, phase)
+
+    async def _run(self, name, futures):
+        factory, deps, pool, phase = self._tasks[name]
+
+        dep_results = []
+        for dep in deps:
+            status, value = await futures[dep]
+            if status != 'ok':
+                result = ('skipped', f"dependency '{dep}' {status}")
+                self.results[name] = result
+                return result
+
+            dep_results.append(value)
+
+        try:
+            async with self._global:
+                if pool:
+                    async with self._pools[pool]:
+                        with tracer.span(name, 'task', phase=phase, pool=pool):
+                            value = await factory(*dep_results)
+                else:
+                    with tracer.span(name, 'task', phase=phase):
+                        value = await factory(*dep_results)
+
+            result = ('ok', value)
+
+        except Exception as e:
+            print(f"Task '{name}' failed: {str(e)}")
+            result = ('failed', e)
+
+        self.results[name] = result
+        return result
+
+    async def run(self):
+        """Run every registered task and return {name: (status, value)}"""
+        loop = asyncio.get_running_loop()
+        futures = {name: loop.create_future() for name in self._tasks}
+
+        async def run_and_publish(name):
+            futures[name].set_result(await self._run(name, futures))
+
+        await asyncio.gather(*[run_and_publish(name) for name in self._tasks])
+
+        return self.results
+
+
+async def resolve_repository_selectors(bindings, gh_secret_magic):
+    """Fill in the repositories of bindings that select them by glob, regex or topic.
+
+    Each owner's installation repositories are streamed once and matched against every
+    selector of that owner, the listing doubles as the repo check of the selected repos.
+    A selector that matches nothing or whose listing fails sets 'selector_error' on its
+    binding, the other bindings are unaffected.
+    """
+    selecting = {}
+    for binding in bindings:
+        if binding.get('repository_selector'):
+            selector = binding['repository_selector']
+            matcher = githubsec.repository_matcher(
+                selector.get('patterns'), selector.get('regex'), selector.get('topics'), selector.get('include_archived', False)
+            )
+            selecting.setdefault(binding['gh_org_user'], []).append((binding, matcher))
+
+    async def resolve_owner(owner, owner_bindings):
+        try:
+            async for repo in gh_secret_magic.iter_installation_repositories(owner):
+                for binding, matches in owner_bindings:
+                    if matches(repo) and repo['name'] not in binding['repo_checks']:
+                        binding['repositories'].append(repo['name'])
+                        binding['repo_checks'][repo['name']] = githubsec.listed_repository_check(owner, repo)
+
+        except Exception as e:
+            print(f"Listing the repositories of {owner} failed: {str(e)}")
+
+            for binding, _ in owner_bindings:
+                binding['selector_error'] = f"Listing the repositories of {owner} failed: {str(e)}"
+            return
+
+        for binding, _ in owner_bindings:
+            print(f"Binding '{binding['app_name']}' selected {len(binding['repositories'])} repositories")
+
+            if not binding['repositories']:
+                binding['selector_error'] = f"No repositories of {owner} match the selector of '{binding['app_name']}'"
+
+    await asyncio.gather(*[resolve_owner(owner, owner_bindings) for owner, owner_bindings in selecting.items()])
+
+
+def app_index_path(base_path, tenant_id):
+    """One index file per tenant, the default tenant uses base_path itself"""
+    return base_path if tenant_id is None else f"{base_path}.{tenant_id}"
+
+
+def add_lookup_tasks(scheduler, bindings, pool, index_path=None):
+    """Resolve every binding's app and shard display names, one Graph $batch lookup per tenant.
+
+    With index_path each tenant's lookups come from an AppIndex refreshed by one delta call instead.
+    """
+    names_per_tenant = {}
+    for binding in bindings:
+        if binding.get('selector_error'):
+            continue
+
+        names = shard_lookup_names(binding['app_name'], binding['repositories'], binding['branches'])
+        for scope in binding['scopes']:
+            names_per_tenant.setdefault(scope['tenant_id'], []).extend(names)
+
+    for tenant_id, names in names_per_tenant.items():
+        async def lookup_apps(tenant_id=tenant_id, names=names):
+            try:
+                if index_path:
+                    app_index = AppIndex(app_index_path(index_path, tenant_id))
+                    await app_index.refresh(pool.graph_batcher(tenant_id))
+
+                    for name, apps in app_index.duplicates(names).items():
+                        print(f"Warning: {len(apps)} app registrations are named '{name}': {[app['appId'] for app in apps]}")
+
+                    return app_index.find_many(names)
+
+                return await find_apps_by_display_names(pool.graph_batcher(tenant_id), names)
+
+            except Exception as e:
+                # app tasks fall back to their own lookup
+                print(f"Batched app lookup failed: {str(e)}")
+                return {}
+
+        scheduler.add(f"apps:lookup:{tenant_id or 'default'}", lookup_apps, pool='graph', phase='lookup')
+
+
+def add_binding_tasks(scheduler, binding, gh_secret_magic, pool, app_locks):
+    """Add the repo check -> app -> roles / federated credentials / secrets graph for one binding.
+
+    Scopes are provisioned concurrently. Each tenant gets one app registration (or one set of
+    shards), scopes in the same tenant assign roles to it in their own resource group.
+    app_locks is shared by all bindings so that two of them never create the same app at once.
+    """
+    key = binding['key']
+
+    # a selector that resolved to nothing fails this binding alone
+    if binding.get('selector_error'):
+        async def selector_failed():
+            raise Exception(binding['selector_error'])
+
+        scheduler.add(f"{key}:repo", selector_failed, pool='github', phase='repo')
+        return
+
+    gh_org_user = binding['gh_org_user']
+    repositories = binding['repositories']
+    scopes = binding['scopes']
+    tenants = list(dict.fromkeys(scope['tenant_id'] for scope in scopes))
+
+    manager_tasks = []
+    for scope in scopes:
+        async def create_manager(scope=scope):
+            return await AzureAppRegManager.create(
+                scope['resource_group'],
+                scope['cluster_name'],
+                scope['container_registry'],
+                scope['aks_enabled'],
+                subscription_id=scope['subscription_id'],
+                tenant_id=scope['tenant_id'],
+                pool=pool
+            )
+
+        manager_tasks.append(f"{key}:manager:{scope['name'] or 'default'}")
+        scheduler.add(manager_tasks[-1], create_manager, pool='arm', phase='manager')
+
+    repo_check_tasks = []
+    for repo in repositories:
+        async def check_repo(repo=repo):
+            # repos picked by a selector were already seen in the installation listing
+            repo_check = binding['repo_checks'].get(repo) or await gh_secret_magic.check_repository_exists(gh_org_user, repo)
+
+            if not repo_check['exists'] or not repo_check['accessible']:
+                raise Exception(f"Repository {gh_org_user}/{repo} does not exist or is not accessible")
+
+            return repo_check
+
+        scheduler.add(f"{key}:repo:{repo}", check_repo, pool='github', phase='repo')
+        repo_check_tasks.append(f"{key}:repo:{repo}")
+
+    async def create_apps(*results):
+        lookups = dict(zip(tenants, results[:len(tenants)]))
+        managers = results[len(tenants):len(tenants) + len(scopes)]
+        repo_checks = results[len(tenants) + len(scopes):]
+
+        # scope name -> [(repos, manager of the app holding their credentials)]
+        placements = {}
+
+        # group by the tenant each manager resolved, a scope naming the default tenant
+        # explicitly and one leaving it out share the app
+        tenant_groups = {}
+        for scope, manager in zip(scopes, managers):
+            tenant_groups.setdefault(manager.tenant_id, []).append((scope, manager))
+
+        async def create_tenant_apps(tenant_scopes):
+            _, primary = tenant_scopes[0]
+
+            # the group's scopes may have been looked up under more than one tenant key
+            lookup = {}
+            for scope, _ in tenant_scopes:
+                lookup.update(lookups[scope['tenant_id']])
+
+            # another binding of the same app may have created it since the lookup ran, look again
+            lock_key = (primary.tenant_id, binding['app_name'])
+            found = None if lock_key in app_locks else lookup
+
+            async with app_locks.setdefault(lock_key, asyncio.Lock()):
+                # the app, or as many shards as the repos' federated credentials need
+                shards = await provision_shards(
+                    primary, binding['app_name'], binding['app_description'], gh_org_user, repositories, binding['branches'], found
+                )
+                apps = [(shard['repos'], shard_manager) for shard, shard_manager in shards]
+
+            for scope, manager in tenant_scopes:
+                if manager is primary:
+                    placements[scope['name']] = apps
+                else:
+                    placements[scope['name']] = [(repos, manager.for_app(app_manager)) for repos, app_manager in apps]
+
+        await asyncio.gather(*[create_tenant_apps(tenant_scopes) for tenant_scopes in tenant_groups.values()])
+
+        return placements, repo_checks
+
+    lookup_tasks = [f"apps:lookup:{tenant_id or 'default'}" for tenant_id in tenants]
+    scheduler.add(
+        f"{key}:app", create_apps, deps=[*lookup_tasks, *manager_tasks, *repo_check_tasks], pool='graph', phase='app'
+    )
+
+    async def assign_roles(app_result):
+        placements, _ = app_result
+        await ensure_roles_across_scopes([manager for apps in placements.values() for _, manager in apps])
+
+    scheduler.add(f"{key}:roles", assign_roles, deps=[f"{key}:app"], pool='arm', phase='roles')
+
+    async def federated_credentials(app_result):
+        placements, _ = app_result
+
+        # scopes in one tenant share the app, its credentials are written once
+        apps = {}
+        for scope_apps in placements.values():
+            for repos, manager in scope_apps:
+                apps.setdefault(manager.app_object_id, (repos, manager))
+
+        reports = await asyncio.gather(*[
+            manager.ensure_federated_credentials(gh_org_user, repos, binding['branches']) for repos, manager in apps.values()
+        ])
+
+        report = {}
+        for app_report in reports:
+            report.update(app_report)
+
+        failed = [name for name, result in report.items() if isinstance(result, Exception)]
+        if failed:
+            raise Exception(f"Failed to create federated credentials: {failed}")
+
+        return report
+
+    scheduler.add(f"{key}:federated", federated_credentials, deps=[f"{key}:app"], pool='graph', phase='federated')
+
+    async def secrets(app_result):
+        placements, repo_checks = app_result
+
+        per_repo_secrets = {repo: {} for repo in repositories}
+        appreg_created = {repo: False for repo in repositories}
+
+        for scope in scopes:
+            for repos, manager in placements[scope['name']]:
+                for repo in repos:
+                    per_repo_secrets[repo].update(scope_secrets(manager.app_info(), scope))
+                    appreg_created[repo] = appreg_created[repo] or manager.appreg_created
+
+        # without a journal, existing repo secrets are only rewritten for a new app
+        overwrite = {repo: set(per_repo_secrets[repo]) if appreg_created[repo] else set() for repo in repositories}
+        report = {}
+
+        if binding['use_org_secrets']:
+            # without a journal to compare against, shared values are always written
+            shared_secrets, per_repo_secrets = githubsec.split_shared_secrets(per_repo_secrets)
+            report['org'] = await gh_secret_magic.upsert_org_secrets(
+                gh_org_user,
+                shared_secrets,
+                [repo_check.get('id') for repo_check in repo_checks]
+            )
+
+            # org secrets of another binding keep their value, these repos get repo secrets instead
+            for name, result in report['org'].items():
+                if result['action'] == "conflict":
+                    for repo in repositories:
+                        per_repo_secrets[repo][name] = shared_secrets[name]
+                        overwrite[repo].add(name)
+
+        results = await asyncio.gather(*[
+            create_repo_secrets(gh_secret_magic, gh_org_user, repo, per_repo_secrets[repo], overwrite[repo])
+            for repo in repositories
+        ])
+        report.update(zip(repositories, results))
+
+        return report
+
+    scheduler.add(f"{key}:secrets", secrets, deps=[f"{key}:app"], pool='github', phase='secrets')
+
+
+def print_summary(results):
+    print("\nFleet run summary:")
+
+    for name, (status, value) in sorted(results.items()):
+        detail = f" - {value}" if status != 'ok' else ""
+        print(f"  [{status}] {name}{detail}")
+
+
+async def run_fleet(manifest_path, index_path=None):
+    """Provision every binding in the manifest, independent bindings in parallel"""
+    bindings, concurrency = load_manifest(manifest_path)
+
+    scheduler = DagScheduler(concurrency)
+
+    # one credential per tenant and one client set per subscription for every binding, the
+    # graph and arm caps hold for every call while the github one is the client's own
+    pool = AzureClientPool(limits={'arm': concurrency['arm'], 'graph': concurrency['graph']})
+
+    async with githubsec.AsyncGitHubSecretMagic(max_concurrency=concurrency['github']) as gh_secret_magic:
+        try:
+            await resolve_repository_selectors(bindings, gh_secret_magic)
+            add_lookup_tasks(scheduler, bindings, pool, index_path)
+
+            app_locks = {}
+            for binding in bindings:
+                add_binding_tasks(scheduler, binding, gh_secret_magic, pool, app_locks)
+
+            results = await scheduler.run()
+
+        finally:
+            await pool.close()
+
+    print_summary(results)
+    tracer.print_summary()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Onboard many app / resource group / repo bindings from a manifest")
+    parser.add_argument('manifest', help="path to a .json or .yaml fleet manifest")
+    parser.add_argument('--trace', help="append a JSONL span per API call to this file")
+    parser.add_argument('--otel', action='store_true', help="also emit spans through opentelemetry-api")
+    parser.add_argument('--app-index', nargs='?', const=DEFAULT_INDEX_PATH, metavar='PATH', help="answer app lookups from local per-tenant indexes kept current with Graph delta queries")
+    parser.add_argument('--token-cache', nargs='?', const='', metavar='PATH', help="keep Azure tokens in an encrypted cache file between runs")
+    args = parser.parse_args()
+
+    tracer.configure(args.trace, args.otel)
+
+    if args.token_cache is not None:
+        token_cache.configure(args.token_cache or None)
+
+    results = asyncio.run(run_fleet(args.manifest, args.app_index))
+
+    if any(status != 'ok' for status, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,207 @@
 import os
+import asyncio
+import fnmatch
+import random
+import re
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlsplit
 import requests
+import httpx
 from cryptography.hazmat.primitives import serialization
 from nacl import encoding, public
 import jwt
 import time
+from instrumentation import tracer
+
+
+GITHUB_API_URL = 'https://api.github.com'
+
+# seconds before expiry at which installation tokens and app JWTs are renewed
+TOKEN_REFRESH_MARGIN = 300
+JWT_LIFETIME = 600
+
+# methods that are safe to resend after a rate limit response
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+# largest page GitHub list endpoints return
+PER_PAGE = 100
+
+# actions reported for the statuses a secret write or delete succeeds with
+WRITE_ACTIONS = {201: "created", 204: "updated"}
+DELETE_ACTIONS = {204: "deleted", 404: "absent"}
+
+# the ETag cache keeps the most recent entries and skips large bodies, e.g. listings
+ETAG_CACHE_MAX_ENTRIES = 1000
+ETAG_CACHE_MAX_BODY_BYTES = 64 * 1024
+
+
+def parse_expires_at(value):
+    """Convert the ISO 8601 expires_at returned with an installation token to epoch seconds"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def owner_from_path(url):
+    """Return the owner in a /repos/{owner}/... or /orgs/{org}/... path or url, or None"""
+    parts = urlsplit(url).path.lstrip('/').split('/')
+
+    if len(parts) >= 2 and parts[0] in ('repos', 'orgs'):
+        return parts[1]
+
+    return None
+
+
+def split_shared_secrets(per_repo_values):
+    """Split {repo: {name: value}} into values identical for every repo and per-repo leftovers.
+
+    Returns (shared, per_repo) where shared is {name: value} and per_repo keeps only
+    the names whose value differs between repos or is missing from some of them.
+    """
+    if not per_repo_values:
+        return {}, {}
+
+    mappings = list(per_repo_values.values())
+    shared = {
+        name: value for name, value in mappings[0].items()
+        if all(name in mapping and mapping[name] == value for mapping in mappings[1:])
+    }
+
+    per_repo = {
+        repo: {name: value for name, value in mapping.items() if name not in shared}
+        for repo, mapping in per_repo_values.items()
+    }
+
+    return shared, per_repo
+
+
+def repository_matcher(patterns=None, regex=None, topics=None, include_archived=False):
+    """Build a predicate over GitHub repository objects for repo selection.
+
+    A repo matches when its name matches any of the glob patterns, the regex matches
+    somewhere in its name and it carries every topic; criteria left out always match.
+    Archived repos, whose secrets cannot be written, are skipped unless include_archived is set.
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+
+    patterns = [pattern.lower() for pattern in patterns or []]
+    compiled = re.compile(regex) if regex else None
+    topics = {topic.lower() for topic in ([topics] if isinstance(topics, str) else topics or [])}
+
+    def matches(repo):
+        name = repo['name']
+
+        if repo.get('archived') and not include_archived:
+            return False
+
+        if patterns and not any(fnmatch.fnmatchcase(name.lower(), pattern) for pattern in patterns):
+            return False
+
+        if compiled and not compiled.search(name):
+            return False
+
+        return topics <= {topic.lower() for topic in repo.get('topics', [])}
+
+    return matches
+
+
+def listed_repository_check(owner, repo):
+    """Repo check result for a repository object from a listing, which proves it is accessible"""
+    return {
+        'exists': True,
+        'accessible': True,
+        'private': repo.get('private', False),
+        'id': repo.get('id'),
+        'message': f"Repository {owner}/{repo['name']} exists and is accessible"
+    }
+
+
+class TokenBucket:
+    """Async token bucket pacing requests to rate per second with bursts up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class GitHubRateLimiter:
+    """Paces GitHub calls and tracks the primary rate limit budget of each installation token.
+
+    Budgets come from the X-RateLimit-Remaining / X-RateLimit-Reset headers of every response,
+    and callers wait for the reset once a token's budget drops to the reserve.
+    """
+
+    def __init__(self, requests_per_second=10.0, burst=20, reserve=10, secondary_backoff=60.0, max_backoff=300.0):
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.reserve = reserve
+        self.secondary_backoff = secondary_backoff
+        self.max_backoff = max_backoff
+
+        #remaining budget per token as {token: (remaining, reset epoch seconds)}
+        self._budgets = {}
+
+
+    async def acquire(self, token):
+        """Wait until the token has budget left and the bucket allows another request"""
+        remaining, reset_at = self._budgets.get(token, (None, 0))
+
+        if remaining is not None and remaining <= self.reserve:
+            wait = reset_at - time.time()
+            if wait > 0:
+                print(f"GitHub rate limit budget low ({remaining} left), waiting {wait:.0f}s for reset...")
+                await asyncio.sleep(wait)
+
+            self._budgets.pop(token, None)
+
+        await self.bucket.acquire()
+
+
+    def update(self, token, response):
+        """Record the budget reported by a response"""
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset_at = response.headers.get('X-RateLimit-Reset')
+
+        if remaining is not None and reset_at is not None:
+            self._budgets[token] = (int(remaining), int(reset_at))
+
+
+    def retry_delay(self, response, attempt):
+        """Seconds to wait before retrying a rate limited response, or None if it was not limited"""
+        if response.status_code not in (403, 429):
+            return None
+
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None:
+            return float(retry_after)
+
+        # primary limit exhausted, wait for the window to reset
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            reset_at = int(response.headers.get('X-RateLimit-Reset', 0))
+            return max(reset_at - time.time(), 1.0)
+
+        # secondary limit without Retry-After, back off exponentially from a minute
+        if response.status_code == 429 or 'secondary rate limit' in response.text.lower():
+            return min(self.secondary_backoff * (2 ** attempt), self.max_backoff)
+
+        # plain permission error
+        return None
 
 
 class GitHubSecretMagic:
@@ -17,15 +215,62 @@ class GitHubSecretMagic:
         self.access_token = None
         self.token_expires_at = 0
 
+        #parsed private key and the signed app JWT, reused until shortly before it expires
+        self._private_key = None
+        self._jwt = None
+        self._jwt_expires_at = 0
+
+        #sealed boxes keyed by public key id, built once per key
+        self._sealed_boxes = {}
+
+
+    def _encrypt_secret(self, public_key, secret_value, key_id=None):        
+        sealed_box = self._sealed_boxes.get(key_id) if key_id else None
+
+        if sealed_box is None:
+            public_key_bytes = encoding.Base64Encoder.decode(public_key.encode())
+            sealed_box = public.SealedBox(public.PublicKey(public_key_bytes))
+
+            if key_id:
+                self._sealed_boxes[key_id] = sealed_box
 
-    def _encrypt_secret(self, public_key, secret_value):        
-        public_key_bytes = encoding.Base64Encoder.decode(public_key.encode())
-        sealed_box = public.SealedBox(public.PublicKey(public_key_bytes))
         encrypted = sealed_box.encrypt(secret_value.encode())
         
         return encoding.Base64Encoder.encode(encrypted).decode()
 
 
+    def _load_private_key(self):
+        """Read and parse the app private key once"""
+        if self._private_key is None:
+            try:
+                with open(self.private_key_path, 'rb') as key_file:
+                    self._private_key = serialization.load_pem_private_key(key_file.read(), password=None)
+
+            except Exception as e:
+                raise Exception(f"Error loading private key: {str(e)}")
+
+        return self._private_key
+
+
+    def _build_jwt(self, private_key=None):
+        """Sign the short-lived app JWT used to request installation tokens, reusing a valid one"""
+        now = int(time.time())
+
+        if self._jwt and now < self._jwt_expires_at - 60:
+            return self._jwt
+
+        payload = {
+            'iat': now - 60,  # Issued 60 seconds in the past
+            'exp': now + JWT_LIFETIME,  # Expires in 10 minutes
+            'iss': self.app_id
+        }
+
+        self._jwt = jwt.encode(payload, private_key or self._load_private_key(), algorithm='RS256')
+        self._jwt_expires_at = payload['exp']
+
+        return self._jwt
+
+
     def get_headers(self):
         
         token = self.get_installation_token()
@@ -37,34 +282,17 @@ class GitHubSecretMagic:
 
     def get_installation_token(self):
 
-        try:       
-            if self.access_token and time.time() < self.token_expires_at - 60:
-                return self.access_token
-        
-            # Generate JWT
-            with open(self.private_key_path, 'rb') as key_file:
-                private_key = serialization.load_pem_private_key(key_file.read(), password=None)
-
-        except Exception as e:
-            raise Exception(f"Error loading private key: {str(e)}")
-
+        if self.access_token and time.time() < self.token_expires_at - 60:
+            return self.access_token
 
-        payload = {
-            'iat': int(time.time()) - 60,  # Issued 60 seconds in the past
-            'exp': int(time.time()) + 600,  # Expires in 10 minutes
-            'iss': self.app_id
-        }
-        
-        jwt_token = jwt.encode(payload, private_key, algorithm='RS256')
-        
         # Get installation access token
         headers = {
-            'Authorization': f'Bearer {jwt_token}',
+            'Authorization': f'Bearer {self._build_jwt()}',
             'Accept': 'application/vnd.github.v3+json'
         }
         
         response = requests.post(
-            f'https://api.github.com/app/installations/{self.installation_id}/access_tokens',
+            f'{GITHUB_API_URL}/app/installations/{self.installation_id}/access_tokens',
             headers=headers
         )
         
@@ -73,19 +301,34 @@ class GitHubSecretMagic:
         
         token_data = response.json()
         self.access_token = token_data['token']
-        
-        # Tokens expire in 1 hour
-        self.token_expires_at = time.time() + 3600
+        self.token_expires_at = parse_expires_at(token_data['expires_at'])
         
         return self.access_token
 
 
+    def _paginate(self, url, key):
+        """Yield the items of a GitHub list endpoint, 100 per page, following the Link header"""
+        params = {'per_page': PER_PAGE}
+
+        while url:
+            response = requests.get(url, params=params, headers=self.get_headers())
+
+            if response.status_code != 200:
+                raise Exception(f"Failed to list {key}: {response.status_code} - {response.text}")
+
+            yield from response.json()[key]
+
+            # the next link already carries per_page and page
+            url = response.links.get('next', {}).get('url')
+            params = None
+
+
     def get_repository_public_key(self, owner, repo):
         # Get the repository's public key for encrypting secrets
         headers = self.get_headers()
         
         response = requests.get(
-            f'https://api.github.com/repos/{owner}/{repo}/actions/secrets/public-key',
+            f'{GITHUB_API_URL}/repos/{owner}/{repo}/actions/secrets/public-key',
             headers=headers
         )
         
@@ -98,20 +341,10 @@ class GitHubSecretMagic:
     def get_existing_secrets(self, owner, repo):
         # Get list of existing secret names
         try:
-            headers = self.get_headers()
-            response = requests.get(
-                f'https://api.github.com/repos/{owner}/{repo}/actions/secrets',
-                headers=headers
-            )
-                
-            if response.status_code == 200:
-                secrets_data = response.json()
-                return [secret['name'] for secret in secrets_data.get('secrets', [])]
-            
-            else:
-                print(f"Error getting secrets list: {response.status_code}")
-                return []
-            
+            return [
+                secret['name'] for secret in self._paginate(f'{GITHUB_API_URL}/repos/{owner}/{repo}/actions/secrets', 'secrets')
+            ]
+
         except Exception as e:
             print(f"Error getting existing secrets: {str(e)}")
             return []
@@ -135,7 +368,7 @@ class GitHubSecretMagic:
             # Create/update the secret
             headers = self.get_headers()
             response = requests.put(
-                f'https://api.github.com/repos/{owner}/{repo}/actions/secrets/{secret_name}',
+                f'{GITHUB_API_URL}/repos/{owner}/{repo}/actions/secrets/{secret_name}',
                 json=secret_data,
                 headers=headers
             )
@@ -156,68 +389,810 @@ class GitHubSecretMagic:
 
     def list_repository_secrets(self, owner, repo):
         """List all secrets in a repository (names only, not values)"""
-        headers = self.get_headers()
-        
-        response = requests.get(
-            f'https://api.github.com/repos/{owner}/{repo}/actions/secrets',
-            headers=headers
-        )
-        
-        if response.status_code == 200:
-            secrets_data = response.json()
-            secrets = [secret['name'] for secret in secrets_data['secrets']]
-            print(f"Secrets in {owner}/{repo}: {secrets}")
-            return secrets
-        
-        else:
-            raise Exception(f"Failed to list secrets: {response.status_code} - {response.text}")
+        secrets = [secret['name'] for secret in self._paginate(f'{GITHUB_API_URL}/repos/{owner}/{repo}/actions/secrets', 'secrets')]
+        print(f"Secrets in {owner}/{repo}: {secrets}")
+        return secrets
     
 
     def check_repository_exists(self, owner, repo):                
         try:
             headers = self.get_headers()
             response = requests.get(
-                f'https://api.github.com/repos/{owner}/{repo}',
+                f'{GITHUB_API_URL}/repos/{owner}/{repo}',
                 headers=headers
             )
 
-            if response.status_code == 200:
-                repo_data = response.json()
-                return {
+            return self._repository_check_result(owner, repo, response)
+
+        except Exception as e:
+            return {
+                'exists': None,
+                'accessible': False,
+                'private': None,
+                'message': f"Error checking repository: {str(e)}"
+            }
+
+
+    def _repository_check_result(self, owner, repo, response):
+        """Translate a GET /repos/{owner}/{repo} response into the repo check dict"""
+        if response.status_code == 200:
+            repo_data = response.json()
+            return {
+                'exists': True,
+                'accessible': True,
+                'private': repo_data.get('private', False),
+                'id': repo_data.get('id'),
+                'message': f"Repository {owner}/{repo} exists and is accessible"
+            }
+
+        elif response.status_code == 404:
+            return {
+                'exists': False,
+                'accessible': False,
+                'private': None,
+                'message': f"Repository {owner}/{repo} does not exist or is not accessible"
+            }
+
+        elif response.status_code == 403:
+            return {
+                'exists': True,  # Likely exists but no access
+                'accessible': False,
+                'private': True,  # Probably private
+                'message': f"Repository {owner}/{repo} exists but access is forbidden"
+            }
+
+        else:
+            return {
+                'exists': None,
+                'accessible': False,
+                'private': None,
+                'message': f"Unexpected response: {response.status_code} - {response.text}"
+            }
+
+
+class InstallationTokenPool:
+    """Installation access tokens for every installation of the GitHub App.
+
+    Installations are discovered from /app/installations and mapped by account login, so
+    repos across several orgs each get a token of the installation that owns them. Tokens
+    are renewed in the background before they expire, and concurrent callers waiting on
+    the same installation share one in-flight request.
+    """
+
+    def __init__(self, app, client, default_installation_id=None, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self._app = app
+        self._client = client
+        self.default_installation_id = default_installation_id
+        self.refresh_margin = refresh_margin
+
+        #{installation id: (token, expires at epoch seconds)}
+        self._tokens = {}
+
+        #{installation id: {permission: level}} as granted with the last token
+        self.permissions = {}
+        self._inflight = {}
+        self._refresh_tasks = {}
+
+        #{lower-cased account login: installation id}
+        self._owners = None
+        self._discover_task = None
+
+
+    async def discover(self):
+        """Map each account that installed the app to its installation id"""
+        owners = {}
+        url = '/app/installations'
+        params = {'per_page': 100}
+
+        while url:
+            with tracer.span('GET /app/installations', 'github', endpoint='/app/installations') as span:
+                response = await self._client.get(
+                    url, params=params, headers={'Authorization': f'Bearer {self._app._build_jwt()}'}
+                )
+                span.set(status=response.status_code, bytes=len(response.content))
+
+            if response.status_code != 200:
+                raise Exception(f"Failed to list app installations: {response.status_code} - {response.text}")
+
+            for installation in response.json():
+                owners[installation['account']['login'].lower()] = str(installation['id'])
+
+            url = response.links.get('next', {}).get('url')
+            params = None
+
+        self._owners = owners
+        return owners
+
+
+    async def _discover_once(self):
+        """Discover installations once, concurrent callers share the same listing"""
+        if self._discover_task is None or (self._discover_task.done() and self._discover_task.exception()):
+            self._discover_task = asyncio.ensure_future(self.discover())
+
+        await asyncio.shield(self._discover_task)
+
+
+    async def installation_for(self, owner=None):
+        """Return the installation id serving an owner, discovering installations on first use"""
+        if owner is not None:
+            try:
+                await self._discover_once()
+
+            except Exception as e:
+                if not self.default_installation_id:
+                    raise
+
+                print(f"Installation discovery failed, using the default installation: {str(e)}")
+
+            if self._owners and owner.lower() in self._owners:
+                return self._owners[owner.lower()]
+
+        if self.default_installation_id:
+            return self.default_installation_id
+
+        await self._discover_once()
+
+        if len(set(self._owners.values())) == 1:
+            return next(iter(self._owners.values()))
+
+        raise Exception(f"No GitHub App installation found for '{owner}', set GITHUB_APP_INSTALL_ID")
+
+
+    async def get_token(self, installation_id):
+        """Return a valid token for the installation, sharing any refresh already in flight"""
+        token, expires_at = self._tokens.get(installation_id, (None, 0))
+
+        if token and time.time() < expires_at - 60:
+            return token
+
+        return await self._refresh(installation_id)
+
+
+    async def _refresh(self, installation_id):
+        task = self._inflight.get(installation_id)
+
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(installation_id))
+            self._inflight[installation_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(installation_id, None))
+
+        return await asyncio.shield(task)
+
+
+    async def _fetch(self, installation_id):
+        endpoint = f'/app/installations/{installation_id}/access_tokens'
+
+        with tracer.span(f'POST {endpoint}', 'github', endpoint=endpoint) as span:
+            response = await self._client.post(
+                endpoint, headers={'Authorization': f'Bearer {self._app._build_jwt()}'}
+            )
+            span.set(status=response.status_code, bytes=len(response.content))
+
+        if response.status_code != 201:
+            raise Exception(f"Failed to get access token: {response.status_code} - {response.text}")
+
+        token_data = response.json()
+        expires_at = parse_expires_at(token_data['expires_at'])
+        self._tokens[installation_id] = (token_data['token'], expires_at)
+        self.permissions[installation_id] = token_data.get('permissions', {})
+        self._schedule_refresh(installation_id, expires_at)
+
+        return token_data['token']
+
+
+    def _schedule_refresh(self, installation_id, expires_at):
+        previous = self._refresh_tasks.get(installation_id)
+        if previous and not previous.done() and previous is not asyncio.current_task():
+            previous.cancel()
+
+        # jitter keeps many installations from renewing at the same moment
+        delay = max(expires_at - self.refresh_margin - time.time() - random.uniform(0, 30), 0)
+
+        async def refresh_later():
+            await asyncio.sleep(delay)
+            try:
+                await self._refresh(installation_id)
+            except Exception as e:
+                print(f"Background token refresh failed for installation {installation_id}: {str(e)}")
+
+        self._refresh_tasks[installation_id] = asyncio.ensure_future(refresh_later())
+
+
+    async def aclose(self):
+        """Stop the background refreshes"""
+        for task in self._refresh_tasks.values():
+            task.cancel()
+
+        await asyncio.gather(*self._refresh_tasks.values(), return_exceptions=True)
+        self._refresh_tasks.clear()
+
+
+class AsyncGitHubSecretMagic(GitHubSecretMagic):
+    """Async variant of GitHubSecretMagic that reuses one keep-alive connection pool"""
+
+    def __init__(self, max_concurrency=10, http2=True, timeout=30.0, rate_limiter=None, max_retries=3, transport=None):
+
+        super().__init__()
+
+        # cap on in-flight requests, also used to size the connection pool
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        # every request is paced and retried through the rate limiter
+        self.rate_limiter = rate_limiter or GitHubRateLimiter()
+        self.max_retries = max_retries
+
+        #last ETag, parsed body and Link header per GET url, replayed on 304 Not Modified
+        self._etag_cache = OrderedDict()
+
+        #repository public keys keyed by (owner, repo), org public keys keyed by org
+        self._public_keys = {}
+        self._org_public_keys = {}
+
+        #one org secret writer per org
+        self._org_locks = {}
+
+        # HTTP/2 needs the optional h2 package, fall back to HTTP/1.1 keep-alive without it
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                http2 = False
+
+        self._client = httpx.AsyncClient(
+            base_url=GITHUB_API_URL,
+            http2=http2,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency
+            ),
+            headers={'Accept': 'application/vnd.github.v3+json'},
+            transport=transport
+        )
+
+        # tokens for every installation, GITHUB_APP_INSTALL_ID is the default when set
+        self.token_pool = InstallationTokenPool(self, self._client, default_installation_id=self.installation_id)
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+    async def aclose(self):
+        """Close the shared connection pool"""
+        await self.token_pool.aclose()
+        await self._client.aclose()
+
+
+    async def get_installation_token(self, owner=None):
+        """Return the token of the installation that serves owner, or of the default installation"""
+        installation_id = await self.token_pool.installation_for(owner)
+        self.access_token = await self.token_pool.get_token(installation_id)
+
+        return self.access_token
+
+
+    async def get_headers(self, owner=None):
+
+        token = await self.get_installation_token(owner)
+        return {
+            'Authorization': f'token {token}',
+            'Accept': 'application/vnd.github.v3+json'
+        }
+
+
+    async def _request(self, method, url, retry=None, owner=None, use_etag=True, **kwargs):
+        """Send an authenticated request through the shared pool and the rate limiter.
+
+        GETs are conditional on the last ETag seen for the url, so unchanged reads come back
+        as 304 and do not spend quota; use_etag=False keeps a read out of that cache.
+        Rate limited idempotent calls are retried, pass retry to override that for read-only
+        POSTs such as GraphQL queries.
+        """
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS
+
+        if owner is None:
+            owner = owner_from_path(url)
+
+        with tracer.span(f"{method} {url}", 'github', method=method, endpoint=url, owner=owner) as span:
+            response, attempts = await self._send(method, url, retry, owner, use_etag, **kwargs)
+            span.set(status=response.status_code, retries=attempts, bytes=len(response.content))
+
+            if response.status_code >= 400:
+                span.status = 'ERROR'
+
+            return response
+
+
+    async def _send(self, method, url, retry, owner, use_etag, **kwargs):
+        cache_key = (url, tuple(sorted((kwargs.get('params') or {}).items()))) if method == 'GET' and use_etag else None
+        cached = self._etag_cache.get(cache_key) if cache_key else None
+        attempt = 0
+
+        while True:
+            headers = await self.get_headers(owner)
+            token = headers['Authorization']
+
+            if cached:
+                headers['If-None-Match'] = cached[0]
+
+            async with self._semaphore:
+                await self.rate_limiter.acquire(token)
+                response = await self._client.request(method, url, headers=headers, **kwargs)
+
+            self.rate_limiter.update(token, response)
+
+            if response.status_code == 304 and cached:
+                self._etag_cache.move_to_end(cache_key)
+                return self._replay(cached, response), attempt
+
+            delay = self.rate_limiter.retry_delay(response, attempt)
+            if delay is None or not retry or attempt >= self.max_retries:
+                break
+
+            attempt += 1
+            print(f"GitHub rate limited on {method} {url}, retry {attempt} in {delay:.0f}s...")
+            await asyncio.sleep(delay)
+
+        if (cache_key and response.status_code == 200 and response.headers.get('ETag')
+                and len(response.content) <= ETAG_CACHE_MAX_BODY_BYTES):
+            self._etag_cache[cache_key] = (response.headers['ETag'], response.json(), response.headers.get('Link'))
+            self._etag_cache.move_to_end(cache_key)
+
+            while len(self._etag_cache) > ETAG_CACHE_MAX_ENTRIES:
+                self._etag_cache.popitem(last=False)
+
+        return response, attempt
+
+
+    def _replay(self, cached, not_modified):
+        """A 200 response rebuilt from a cache entry, for a 304 on its url"""
+        etag, body, link = cached
+        headers = {'ETag': etag, **({'Link': link} if link else {})}
+
+        return httpx.Response(200, headers=headers, json=body, request=not_modified.request)
+
+
+    async def paginate(self, url, key=None, owner=None, params=None, use_etag=False):
+        """Stream the items of a GitHub list endpoint, 100 per page, following the Link header.
+
+        key names the list inside the page object, None for endpoints that return a bare list.
+        Only the current page is held in memory, pages stay out of the ETag cache unless use_etag is set.
+        """
+        params = {'per_page': PER_PAGE, **(params or {})}
+
+        # next links may point at /repositories/{id}/..., keep the owner of the first url
+        owner = owner or owner_from_path(url)
+
+        while url:
+            response = await self._request('GET', url, owner=owner, params=params, use_etag=use_etag)
+
+            if response.status_code != 200:
+                raise Exception(f"Failed to list {url}: {response.status_code} - {response.text}")
+
+            page = response.json()
+            for item in (page[key] if key else page):
+                yield item
+
+            # the next link already carries per_page and page
+            url = response.links.get('next', {}).get('url')
+            params = None
+
+
+    async def iter_installation_repositories(self, owner):
+        """Stream the repositories of owner that the app installation can access"""
+        async for repo in self.paginate('/installation/repositories', 'repositories', owner=owner):
+            if repo['owner']['login'].lower() == owner.lower():
+                yield repo
+
+
+    async def select_repositories(self, owner, patterns=None, regex=None, topics=None, include_archived=False):
+        """Stream the repo check results of owner's repos matching a glob, regex or topic selection.
+
+        The listing already carries what check_repository_exists would fetch, so selected
+        repos need no further check. Yields (name, repo check) pairs.
+        """
+        matches = repository_matcher(patterns, regex, topics, include_archived)
+
+        async for repo in self.iter_installation_repositories(owner):
+            if matches(repo):
+                yield repo['name'], listed_repository_check(owner, repo)
+
+
+    async def get_repository_public_key(self, owner, repo):
+        # Get the repository's public key for encrypting secrets
+        response = await self._request('GET', f'/repos/{owner}/{repo}/actions/secrets/public-key')
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to get public key: {response.status_code} - {response.text}")
+
+        return response.json()
+
+
+    async def get_existing_secrets(self, owner, repo):
+        # Get list of existing secret names
+        try:
+            return [secret['name'] async for secret in self.paginate(f'/repos/{owner}/{repo}/actions/secrets', 'secrets')]
+
+        except Exception as e:
+            print(f"Error getting existing secrets: {str(e)}")
+            return []
+
+
+    async def get_cached_public_key(self, owner, repo, refresh=False):
+        """Return the repo public key, fetching it only once per repo unless refresh is set"""
+        cache_key = (owner, repo)
+
+        if refresh or cache_key not in self._public_keys:
+            pub_key_data = await self.get_repository_public_key(owner, repo)
+            previous = self._public_keys.get(cache_key)
+
+            # drop the sealed box of a rotated key
+            if previous and previous['key_id'] != pub_key_data['key_id']:
+                self._sealed_boxes.pop(previous['key_id'], None)
+
+            self._public_keys[cache_key] = pub_key_data
+
+        return self._public_keys[cache_key]
+
+
+    async def _put_secret(self, owner, repo, secret_name, secret_value, pub_key_data):
+        encrypted_value = self._encrypt_secret(pub_key_data['key'], secret_value, pub_key_data['key_id'])
+
+        return await self._request(
+            'PUT',
+            f'/repos/{owner}/{repo}/actions/secrets/{secret_name}',
+            json={
+                'encrypted_value': encrypted_value,
+                'key_id': pub_key_data['key_id']
+            }
+        )
+
+
+    def _result(self, response, ok_statuses, verb):
+        """Report dict for a secret call, ok_statuses maps each successful status to its action"""
+        if response.status_code in ok_statuses:
+            return {'ok': True, 'action': ok_statuses[response.status_code], 'status': response.status_code, 'error': None}
+
+        return {
+            'ok': False,
+            'action': "failed",
+            'status': response.status_code,
+            'error': f"Failed to {verb}: {response.status_code} - {response.text}"
+        }
+
+
+    async def _upsert_secret(self, owner, repo, secret_name, secret_value, pub_key_data):
+        response = await self._put_secret(owner, repo, secret_name, secret_value, pub_key_data)
+
+        # a rejected key_id means the repo key rotated since it was cached, refetch once and retry
+        if response.status_code in [400, 422]:
+            fresh_key = await self.get_cached_public_key(owner, repo, refresh=True)
+
+            if fresh_key['key_id'] != pub_key_data['key_id']:
+                response = await self._put_secret(owner, repo, secret_name, secret_value, fresh_key)
+
+        return self._result(response, WRITE_ACTIONS, "create secret")
+
+
+    async def upsert_secrets(self, owner, repo, mapping):
+        """Create or update several secrets in one repo, fetching the public key once.
+
+        Returns a report keyed by secret name with ok, action, status and error fields.
+        """
+        if not mapping:
+            return {}
+
+        try:
+            pub_key_data = await self.get_cached_public_key(owner, repo)
+
+        except Exception as e:
+            return {
+                name: {'ok': False, 'action': "failed", 'status': None, 'error': str(e)}
+                for name in mapping
+            }
+
+        names = list(mapping)
+        results = await asyncio.gather(*[
+            self._upsert_secret(owner, repo, name, mapping[name], pub_key_data) for name in names
+        ], return_exceptions=True)
+
+        report = {}
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                result = {'ok': False, 'action': "failed", 'status': None, 'error': str(result)}
+
+            report[name] = result
+
+        return report
+
+
+    async def createrepoSecret(self, owner, repo, secret_name, secret_value):
+
+        result = (await self.upsert_secrets(owner, repo, {secret_name: secret_value}))[secret_name]
+
+        if result['ok']:
+            print(f"Secret '{secret_name}' {result['action']} successfully in {owner}/{repo}")
+            return True
+
+        print(f"Error creating secret '{secret_name}': {result['error']}")
+        return False
+
+
+    async def list_repository_secrets(self, owner, repo):
+        """List all secrets in a repository (names only, not values)"""
+        secrets = [secret['name'] async for secret in self.paginate(f'/repos/{owner}/{repo}/actions/secrets', 'secrets')]
+        print(f"Secrets in {owner}/{repo}: {secrets}")
+        return secrets
+
+
+    async def delete_secret(self, owner, repo, secret_name):
+        """Delete one repo secret, a secret that is already gone counts as deleted"""
+        response = await self._request('DELETE', f'/repos/{owner}/{repo}/actions/secrets/{secret_name}')
+
+        return self._result(response, DELETE_ACTIONS, "delete secret")
+
+
+    async def delete_org_secret(self, org, secret_name):
+        """Delete one organization secret, in the same report shape as delete_secret"""
+        response = await self._request('DELETE', f'/orgs/{org}/actions/secrets/{secret_name}')
+
+        return self._result(response, DELETE_ACTIONS, "delete org secret")
+
+
+    async def check_repository_exists(self, owner, repo):
+        try:
+            response = await self._request('GET', f'/repos/{owner}/{repo}')
+            return self._repository_check_result(owner, repo, response)
+
+        except Exception as e:
+            return {
+                'exists': None,
+                'accessible': False,
+                'private': None,
+                'message': f"Error checking repository: {str(e)}"
+            }
+
+
+    async def _check_repositories_chunk(self, owner, repos):
+        """Resolve up to 100 (owner, name) pairs of one owner with one aliased GraphQL query"""
+        variables = {}
+        params = []
+        fields = []
+        for position, (owner, name) in enumerate(repos):
+            variables[f'o{position}'] = owner
+            variables[f'n{position}'] = name
+            params.append(f'$o{position}: String!, $n{position}: String!')
+            fields.append(f'r{position}: repository(owner: $o{position}, name: $n{position}) {{ databaseId isPrivate }}')
+
+        query = f"query({', '.join(params)}) {{ {' '.join(fields)} }}"
+
+        response = await self._request(
+            'POST', '/graphql', retry=True, owner=owner, json={'query': query, 'variables': variables}
+        )
+
+        if response.status_code != 200:
+            raise Exception(f"GraphQL repository check failed: {response.status_code} - {response.text}")
+
+        body = response.json()
+        data = body.get('data') or {}
+
+        # errors carry the alias they belong to in their path
+        errors = {}
+        for error in body.get('errors', []):
+            if error.get('path'):
+                errors[error['path'][0]] = error
+
+        results = {}
+        for position, (owner, name) in enumerate(repos):
+            alias = f'r{position}'
+            repo_data = data.get(alias)
+
+            if repo_data:
+                results[(owner, name)] = {
                     'exists': True,
                     'accessible': True,
-                    'private': repo_data.get('private', False),
-                    'message': f"Repository {owner}/{repo} exists and is accessible"
+                    'private': repo_data.get('isPrivate', False),
+                    'id': repo_data.get('databaseId'),
+                    'message': f"Repository {owner}/{name} exists and is accessible"
                 }
 
-            elif response.status_code == 404:
-                return {
+            elif errors.get(alias, {}).get('type') == 'NOT_FOUND':
+                results[(owner, name)] = {
                     'exists': False,
                     'accessible': False,
                     'private': None,
-                    'message': f"Repository {owner}/{repo} does not exist or is not accessible"
-                }
-
-            elif response.status_code == 403:
-                return {
-                    'exists': True,  # Likely exists but no access
-                    'accessible': False,
-                    'private': True,  # Probably private
-                    'message': f"Repository {owner}/{repo} exists but access is forbidden"
+                    'message': f"Repository {owner}/{name} does not exist or is not accessible"
                 }
 
             else:
-                return {
+                message = errors.get(alias, {}).get('message', "no data returned")
+                results[(owner, name)] = {
                     'exists': None,
                     'accessible': False,
                     'private': None,
-                    'message': f"Unexpected response: {response.status_code} - {response.text}"
+                    'message': f"Unexpected response for {owner}/{name}: {message}"
                 }
 
-        except Exception as e:
-            return {
-                'exists': None,
-                'accessible': False,
-                'private': None,
-                'message': f"Error checking repository: {str(e)}"
-            }
\ No newline at end of file
+        return results
+
+
+    async def check_repositories_exist(self, repos, chunk_size=100):
+        """Check many (owner, name) pairs with batched GraphQL queries.
+
+        Returns {(owner, name): check dict} in the same shape as check_repository_exists.
+        Repos are grouped by owner, since each owner may use a different installation
+        token, and chunks of chunk_size run concurrently.
+        """
+        by_owner = {}
+        for owner, name in dict.fromkeys(repos):
+            by_owner.setdefault(owner, []).append((owner, name))
+
+        chunks = [
+            (owner, owner_repos[start:start + chunk_size])
+            for owner, owner_repos in by_owner.items()
+            for start in range(0, len(owner_repos), chunk_size)
+        ]
+
+        results = {}
+        chunk_results = await asyncio.gather(*[
+            self._check_repositories_chunk(owner, chunk) for owner, chunk in chunks
+        ], return_exceptions=True)
+
+        for (_, chunk), chunk_result in zip(chunks, chunk_results):
+            if isinstance(chunk_result, Exception):
+                for owner, name in chunk:
+                    results[(owner, name)] = {
+                        'exists': None,
+                        'accessible': False,
+                        'private': None,
+                        'message': f"Error checking repository: {str(chunk_result)}"
+                    }
+
+            else:
+                results.update(chunk_result)
+
+        return results
+
+
+    async def get_org_public_key(self, org, refresh=False):
+        """Return the organization public key, fetched once per org unless refresh is set"""
+        if refresh or org not in self._org_public_keys:
+            response = await self._request('GET', f'/orgs/{org}/actions/secrets/public-key')
+
+            if response.status_code != 200:
+                raise Exception(f"Failed to get org public key: {response.status_code} - {response.text}")
+
+            self._org_public_keys[org] = response.json()
+
+        return self._org_public_keys[org]
+
+
+    async def get_existing_org_secrets(self, org):
+        """Get list of existing organization secret names"""
+        return [secret['name'] async for secret in self.paginate(f'/orgs/{org}/actions/secrets', 'secrets')]
+
+
+    async def get_org_secret_repositories(self, org, secret_name):
+        """Return the ids of the repositories selected for an org secret"""
+        return [
+            repo['id'] async for repo in self.paginate(f'/orgs/{org}/actions/secrets/{secret_name}/repositories', 'repositories')
+        ]
+
+
+    async def add_org_secret_repositories(self, org, secret_name, repository_ids):
+        """Add repositories to an org secret's selected list with one bulk PUT"""
+        current_ids = await self.get_org_secret_repositories(org, secret_name)
+        selected_ids = sorted(set(current_ids) | set(repository_ids))
+
+        if selected_ids == sorted(current_ids):
+            return
+
+        response = await self._request(
+            'PUT',
+            f'/orgs/{org}/actions/secrets/{secret_name}/repositories',
+            json={'selected_repository_ids': selected_ids}
+        )
+
+        if response.status_code != 204:
+            raise Exception(f"Failed to set repos for org secret: {response.status_code} - {response.text}")
+
+
+    async def _upsert_org_secret(self, org, secret_name, secret_value, repository_ids, write_value):
+
+        if write_value:
+            pub_key_data = await self.get_org_public_key(org)
+            encrypted_value = self._encrypt_secret(pub_key_data['key'], secret_value, pub_key_data['key_id'])
+
+            response = await self._request(
+                'PUT',
+                f'/orgs/{org}/actions/secrets/{secret_name}',
+                json={
+                    'encrypted_value': encrypted_value,
+                    'key_id': pub_key_data['key_id'],
+                    'visibility': 'selected'
+                }
+            )
+
+            result = self._result(response, WRITE_ACTIONS, "create org secret")
+            if not result['ok']:
+                return result
+
+        else:
+            result = {'ok': True, 'action': "verified", 'status': None, 'error': None}
+
+        await self.add_org_secret_repositories(org, secret_name, repository_ids)
+
+        return result
+
+
+    async def org_secret_owned(self, org, secret, repository_ids):
+        """True if an existing org secret is visible only to repositories in repository_ids"""
+        if secret.get('visibility') != 'selected':
+            return False
+
+        selected = await self.get_org_secret_repositories(org, secret['name'])
+        return set(selected) <= set(repository_ids)
+
+
+    async def upsert_org_secrets(self, org, mapping, repository_ids, skip_existing=False, overwrite=()):
+        """Write shared values once as org secrets visible to the selected repositories.
+
+        With skip_existing, secrets that already exist keep their value and only gain the repos,
+        except the names in overwrite, whose value is known to have changed. An existing secret
+        also visible to other repositories belongs to someone else and is left untouched,
+        reported with action "conflict" so the caller can write that value per repo instead.
+        Returns a report keyed by secret name in the same shape as upsert_secrets.
+        """
+        if not mapping:
+            return {}
+
+        # one writer per org, so a concurrent run for other repos sees these secrets as taken
+        lock = self._org_locks.setdefault(org, asyncio.Lock())
+        async with lock:
+            return await self._upsert_org_secrets(org, mapping, repository_ids, skip_existing, overwrite)
+
+
+    async def _upsert_org_secrets(self, org, mapping, repository_ids, skip_existing, overwrite):
+        existing = {
+            secret['name']: secret async for secret in self.paginate(f'/orgs/{org}/actions/secrets', 'secrets')
+        }
+
+        names = [name for name in mapping if name.upper() in existing]
+        owned = await asyncio.gather(*[
+            self.org_secret_owned(org, existing[name.upper()], repository_ids) for name in names
+        ])
+        foreign = {name for name, is_owned in zip(names, owned) if not is_owned}
+
+        report = {
+            name: {
+                'ok': False,
+                'action': "conflict",
+                'status': None,
+                'error': f"Org secret {name.upper()} is also visible to repositories outside this run, not adopted"
+            }
+            for name in foreign
+        }
+
+        names = [name for name in mapping if name not in foreign]
+        results = await asyncio.gather(*[
+            self._upsert_org_secret(
+                org, name, mapping[name], repository_ids,
+                not skip_existing or name.upper() not in existing or name in overwrite
+            )
+            for name in names
+        ], return_exceptions=True)
+
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                result = {'ok': False, 'action': "failed", 'status': None, 'error': str(result)}
+
+            report[name] = result
+
+        return report
@@ -0,0 +1,218 @@
+import asyncio
+import inspect
+import time
+import httpx
+from instrumentation import tracer
+
+
+GRAPH_URL = 'https://graph.microsoft.com/v1.0'
+GRAPH_SCOPE = 'https://graph.microsoft.com/.default'
+
+# Graph accepts at most 20 requests per $batch call
+MAX_BATCH_SIZE = 20
+
+# per-request statuses worth sending again in a later batch
+RETRYABLE_STATUSES = (429, 503, 504)
+
+
+class GraphBatchRequest:
+    """One request inside a Graph JSON $batch, url is relative to the API version root"""
+
+    def __init__(self, request_id, method, url, body=None, depends_on=None, headers=None):
+        self.id = str(request_id)
+        self.method = method
+        self.url = url
+        self.body = body
+        self.depends_on = [str(dep) for dep in depends_on or []]
+        self.headers = headers or {}
+
+    def to_dict(self):
+        request = {'id': self.id, 'method': self.method, 'url': self.url}
+
+        if self.body is not None:
+            request['body'] = self.body
+            request['headers'] = {'Content-Type': 'application/json', **self.headers}
+
+        elif self.headers:
+            request['headers'] = self.headers
+
+        if self.depends_on:
+            request['dependsOn'] = self.depends_on
+
+        return request
+
+
+class GraphBatcher:
+    """Packs independent Graph requests into /$batch calls of up to 20 and demultiplexes the replies.
+
+    Requests linked by depends_on always travel in the same batch. Requests throttled on
+    their own (429/503/504) are resent after their Retry-After, together with any request
+    that only failed because it depended on them.
+    """
+
+    def __init__(self, credential, max_concurrency=4, max_retries=3, timeout=30.0, client=None, semaphore=None):
+        self.credential = credential
+        self.max_retries = max_retries
+        # a semaphore shared with other Graph callers replaces max_concurrency
+        self._semaphore = semaphore or asyncio.Semaphore(max_concurrency)
+        self._client = client or httpx.AsyncClient(timeout=timeout)
+        self._token = None
+        self._token_lock = asyncio.Lock()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def _get_token(self):
+        async with self._token_lock:
+            if self._token is None or time.time() > self._token.expires_on - 60:
+                if inspect.iscoroutinefunction(self.credential.get_token):
+                    self._token = await self.credential.get_token(GRAPH_SCOPE)
+                else:
+                    self._token = await asyncio.to_thread(self.credential.get_token, GRAPH_SCOPE)
+
+            return self._token.token
+
+    def _pack(self, requests):
+        """Group requests into batches without splitting a dependsOn chain"""
+        group_of = {}
+        groups = []
+
+        for request in requests:
+            linked = []
+            for dep in request.depends_on:
+                if dep not in group_of:
+                    raise Exception(f"Batch request '{request.id}' depends on '{dep}', which must be listed before it")
+
+                if all(group_of[dep] is not group for group in linked):
+                    linked.append(group_of[dep])
+
+            if linked:
+                # requests chained through dependsOn merge into one group
+                group = linked[0]
+                for other in linked[1:]:
+                    group.extend(other)
+                    for member in other:
+                        group_of[member.id] = group
+                    other.clear()
+
+            else:
+                group = []
+                groups.append(group)
+
+            group.append(request)
+            group_of[request.id] = group
+
+        batches = []
+        current = []
+        for group in (group for group in groups if group):
+            if len(group) > MAX_BATCH_SIZE:
+                raise Exception(f"A dependsOn chain of {len(group)} requests does not fit in one batch")
+
+            if len(current) + len(group) > MAX_BATCH_SIZE:
+                batches.append(current)
+                current = []
+
+            current.extend(group)
+
+        if current:
+            batches.append(current)
+
+        return batches
+
+    async def _send_batch(self, batch):
+        headers = {'Authorization': f'Bearer {await self._get_token()}'}
+
+        async with self._semaphore:
+            with tracer.span('POST /$batch', 'graph', endpoint='/$batch', requests=len(batch)) as span:
+                response = await self._client.post(
+                    f'{GRAPH_URL}/$batch',
+                    json={'requests': [request.to_dict() for request in batch]},
+                    headers=headers
+                )
+                span.set(status=response.status_code, bytes=len(response.content))
+
+        if response.status_code != 200:
+            raise Exception(f"Graph batch failed: {response.status_code} - {response.text}")
+
+        return {item['id']: item for item in response.json().get('responses', [])}
+
+    async def get(self, url):
+        """Single GET outside a batch, e.g. to follow @odata.nextLink or deltaLink urls.
+
+        url is relative to the API version root or absolute. Throttled calls are retried after
+        their Retry-After. Returns the response, whatever its final status.
+        """
+        if not url.startswith('https://'):
+            url = f'{GRAPH_URL}{url}'
+
+        attempt = 0
+        while True:
+            headers = {'Authorization': f'Bearer {await self._get_token()}'}
+
+            async with self._semaphore:
+                with tracer.span(f"GET {url.split('?', 1)[0].replace(GRAPH_URL, '')}", 'graph', retries=attempt) as span:
+                    response = await self._client.get(url, headers=headers)
+                    span.set(status=response.status_code, bytes=len(response.content))
+
+            if response.status_code not in RETRYABLE_STATUSES or attempt >= self.max_retries:
+                return response
+
+            attempt += 1
+            delay = self._retry_after({'headers': response.headers}, attempt)
+            print(f"Graph throttled GET, retry {attempt} in {delay:.0f}s...")
+            await asyncio.sleep(delay)
+
+    def _retry_after(self, result, attempt):
+        """Per-request Retry-After in seconds, exponential backoff when Graph sent none"""
+        for name, value in (result.get('headers') or {}).items():
+            if name.lower() == 'retry-after':
+                return float(value)
+
+        return float(2 ** attempt)
+
+    async def execute(self, requests):
+        """Run the requests and return {request id: {'status', 'headers', 'body'}}"""
+        results = {}
+        pending = list(requests)
+        attempt = 0
+
+        while pending:
+            batch_results = await asyncio.gather(*[self._send_batch(batch) for batch in self._pack(pending)])
+
+            for batch_result in batch_results:
+                results.update(batch_result)
+
+            retry_ids = {
+                request.id for request in pending if results.get(request.id, {}).get('status') in RETRYABLE_STATUSES
+            }
+
+            # 424 Failed Dependency is retried when the request it waited on is retried
+            changed = True
+            while changed:
+                changed = False
+                for request in pending:
+                    if (request.id not in retry_ids and results.get(request.id, {}).get('status') == 424
+                            and any(dep in retry_ids for dep in request.depends_on)):
+                        retry_ids.add(request.id)
+                        changed = True
+
+            if not retry_ids or attempt >= self.max_retries:
+                break
+
+            attempt += 1
+            delay = max(
+                self._retry_after(results[request_id], attempt)
+                for request_id in retry_ids if results[request_id]['status'] in RETRYABLE_STATUSES
+            )
+            print(f"Graph throttled {len(retry_ids)} batched requests, retry {attempt} in {delay:.0f}s...")
+            await asyncio.sleep(delay)
+
+            pending = [
+                GraphBatchRequest(
+                    request.id, request.method, request.url, request.body,
+                    [dep for dep in request.depends_on if dep in retry_ids], request.headers
+                )
+                for request in pending if request.id in retry_ids
+            ]
+
+        return results
@@ -0,0 +1,201 @@
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+
+# span kinds that are API calls, everything else is a grouping span such as a binding or repo
+CALL_KINDS = ('graph', 'arm', 'github')
+
+# statuses the Azure SDK pipelines retry
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """One timed operation, recorded with OpenTelemetry-style ids and attributes.
+
+    phase is the step of the run the span belongs to (repo, app, roles, federated, secrets,
+    ...), inherited from the parent unless given.
+    """
+
+    def __init__(self, name, kind, parent, attributes, phase=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.phase = phase or (parent.phase if parent else None)
+        self.attributes = dict(attributes)
+        self.status = 'OK'
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.otel_span = None
+
+    @property
+    def duration(self):
+        """Seconds between start and end"""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        """OTLP-like JSON shape, one object per line in the trace file"""
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'phase': self.phase,
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'attributes': self.attributes,
+            'status': {'code': self.status, 'message': self.error}
+        }
+
+
+class Tracer:
+    """Records spans for every Graph, ARM and GitHub call and summarizes them at the end of a run.
+
+    Spans nest through a context variable, so calls made inside a binding or repo span become
+    its children across awaits. Finished spans are optionally appended to a JSONL file and,
+    when the opentelemetry package is installed and enabled, mirrored as real OTel spans
+    under the same parents.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.jsonl_path = None
+        self._otel_trace = None
+        self._otel_tracer = None
+        self._lock = threading.Lock()
+        self._started_at = time.perf_counter()
+
+    def configure(self, jsonl_path=None, use_otel=False):
+        """Set where finished spans go; call once at startup"""
+        self.jsonl_path = jsonl_path or os.getenv('ONBOARD_TRACE_FILE')
+
+        if use_otel:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                raise Exception("opentelemetry-api is required for OpenTelemetry export: pip install opentelemetry-api")
+
+            self._otel_trace = trace
+            self._otel_tracer = trace.get_tracer('automate-connect-gh-azure')
+
+    @contextmanager
+    def span(self, name, kind='internal', phase=None, **attributes):
+        """Time the enclosed block as a child of the current span"""
+        parent = _current_span.get()
+        current = Span(name, kind, parent, attributes, phase)
+        token = _current_span.set(current)
+
+        if self._otel_tracer is not None:
+            # explicit parent, the OTel context is not the one our spans nest through
+            context = None
+            if parent is not None and parent.otel_span is not None:
+                context = self._otel_trace.set_span_in_context(parent.otel_span)
+
+            current.otel_span = self._otel_tracer.start_span(
+                name, context=context, attributes={'kind': kind, 'phase': current.phase or '', **attributes}
+            )
+
+        try:
+            yield current
+
+        except BaseException as e:
+            current.status = 'ERROR'
+            current.error = str(e)
+            raise
+
+        finally:
+            current.end_ns = time.time_ns()
+            _current_span.reset(token)
+            self._finish(current)
+
+            if current.otel_span is not None:
+                current.otel_span.set_attributes({k: v for k, v in current.attributes.items() if v is not None})
+
+                if current.status == 'ERROR':
+                    current.otel_span.set_status(self._otel_trace.Status(self._otel_trace.StatusCode.ERROR, current.error))
+
+                current.otel_span.end()
+
+    def phase(self, name):
+        """Span grouping the calls of one step of the run, the summary counts calls per phase"""
+        return self.span(name, 'phase', phase=name)
+
+    def record_response(self, status, size, retries=None):
+        """Add one HTTP response to the current call span.
+
+        Pipelines that report every attempt leave retries out, an attempt following a
+        retryable status then counts as a retry.
+        """
+        current = _current_span.get()
+        if current is None or current.kind not in CALL_KINDS:
+            return
+
+        if retries is None:
+            retries = current.attributes.get('retries', 0) + (current.attributes.get('status') in RETRY_STATUSES)
+
+        current.set(status=status, retries=retries, bytes=current.attributes.get('bytes', 0) + size)
+
+    def _finish(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a', encoding='utf-8') as trace_file:
+                    trace_file.write(json.dumps(span.to_dict(), default=str) + '\n')
+
+    def summary(self, slowest=10):
+        """Aggregate the recorded spans into the numbers print_summary shows"""
+        calls = [span for span in self.spans if span.kind in CALL_KINDS]
+
+        # (phase, api) -> totals
+        per_phase = {}
+        for span in calls:
+            stats = per_phase.setdefault(
+                (span.phase or 'other', span.kind), {'calls': 0, 'errors': 0, 'retries': 0, 'seconds': 0.0, 'bytes': 0}
+            )
+            stats['calls'] += 1
+            stats['errors'] += span.status != 'OK'
+            stats['retries'] += span.attributes.get('retries', 0)
+            stats['seconds'] += span.duration
+            stats['bytes'] += span.attributes.get('bytes', 0)
+
+        return {
+            'total_seconds': time.perf_counter() - self._started_at,
+            'per_phase': per_phase,
+            'propagation_seconds': sum(span.duration for span in self.spans if span.kind == 'propagation'),
+            'slowest': sorted(calls, key=lambda span: span.duration, reverse=True)[:slowest]
+        }
+
+    def print_summary(self, slowest=10):
+        summary = self.summary(slowest)
+
+        print(f"\nRun summary: {summary['total_seconds']:.1f}s total, "
+              f"{summary['propagation_seconds']:.1f}s waiting on propagation")
+
+        print(f"  {'phase':<10} {'api':<6} {'calls':>6} {'errors':>6} {'retries':>7} {'seconds':>9} {'bytes':>10}")
+        for (phase, kind), stats in sorted(summary['per_phase'].items()):
+            print(f"  {phase:<10} {kind:<6} {stats['calls']:>6} {stats['errors']:>6} {stats['retries']:>7} "
+                  f"{stats['seconds']:>9.2f} {stats['bytes']:>10}")
+
+        if summary['slowest']:
+            print("  slowest calls:")
+            for span in summary['slowest']:
+                status = span.attributes.get('status', span.status)
+                print(f"    {span.duration:>7.2f}s  {span.kind:<6} {span.name} [{status}]")
+
+
+# process-wide tracer used by azapp, githubsec, main and fleet
+tracer = Tracer()
@@ -1,81 +1,429 @@
+import argparse
 import asyncio
 import sys
+from contextlib import AsyncExitStack
 from azapp import AzureAppRegManager
+from azpool import AzureClientPool
 import githubsec
+from shards import provision_shards, shard_lookup_names
+from state import StateStore, print_plan, DEFAULT_STATE_PATH, DEFAULT_TTL_SECONDS
+from instrumentation import tracer
+from tokencache import token_cache
+from appindex import AppIndex, DEFAULT_INDEX_PATH
+from preflight import run_preflight
+from teardown import run_teardown
 
 
 if sys.platform == 'win32':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 
-async def main():    
+async def create_repo_secrets(gh_secret_magic, gh_org_user, repo, app_info, overwrite):
+    """Write the app_info secrets into one repo.
+
+    Keys in overwrite are written even when the secret exists, the others only when missing.
+    """
+    if not app_info:
+        return {}
+
+    with tracer.span(repo, 'repo', repo=f"{gh_org_user}/{repo}"):
+        return await _create_repo_secrets(gh_secret_magic, gh_org_user, repo, app_info, overwrite)
+
+
+async def _create_repo_secrets(gh_secret_magic, gh_org_user, repo, app_info, overwrite):
     try:
-        # # Fill the following 5 variables with your details below and uncomment them       
+        #get existing secrets
+        existing_secrets = await gh_secret_magic.get_existing_secrets(gh_org_user, repo)
+
+        pending = {}
+        skipped = {}
+        for key, value in app_info.items():
+            #an existing secret whose value is unchanged since it was written is left alone
+            if key.upper() in existing_secrets and key not in overwrite:
+                print(f"Secret '{key}' already exists in {repo}, skipping creation.")
+                skipped[key] = {'ok': True, 'action': "verified", 'status': None, 'error': None}
+                continue
+
+            print(f"{key}: {value}")
+            print(f"Creating secret '{key}' in {repo}...")
+            pending[key] = value
+
+        #one public key fetch per repo, then all PUTs together
+        report = await gh_secret_magic.upsert_secrets(gh_org_user, repo, pending)
+
+        for key, result in report.items():
+            if result['ok']:
+                print(f"Secret '{key}' {result['action']} successfully in {gh_org_user}/{repo}")
+
+            else:
+                print(f"Error creating secret '{key}': {result['error']}")
+
+        return {**skipped, **report}
+
+    except Exception as e:
+        print(f"Error: {e}")
+        return {}
+
+
+def planned_app_info(app_record, rgname, container_registry, cluster_name, aks_enabled):
+    """Secret values the app would get, rebuilt from the local state record"""
+    app_info = {
+        'subscription_id': app_record['subscription_id'],
+        'tenant_id': app_record['tenant_id'],
+        'client_id': app_record['app_id'],
+        'resource_group': rgname,
+        'container_registry': container_registry
+    }
+
+    if aks_enabled:
+        app_info['cluster_name'] = cluster_name
+
+    return app_info
+
+
+def build_desired_items(state, config):
+    """Every item this run should end up with, as [(kind, key, data)] for StateStore.plan"""
+    gh_org_user = config['gh_org_user']
+    app_name = config['app_name']
+
+    desired = [('repo', f"{gh_org_user}/{repo}", None) for repo in config['repositories']]
+
+    # repos spread over several app registrations by an earlier run are planned against their shard
+    repo_apps = {}
+    for repo in config['repositories']:
+        shard = state.get('shard', f"{gh_org_user}/{repo}")
+        repo_apps[repo] = shard['app_name'] if shard else app_name
+
+    for shard_app_name in sorted(set(repo_apps.values())):
+        desired.append(('app', shard_app_name, None))
+        desired.append(('roles', shard_app_name, {
+            'resource_group': config['rgname'],
+            'aks_enabled': config['aks_enabled']
+        }))
+
+    for entry in AzureAppRegManager._federated_credential_entries(gh_org_user, config['repositories'], config['branches']):
+        desired.append(('federated', f"{repo_apps[entry['repo']]}|{entry['name']}", {'subject': entry['subject']}))
+
+    for repo in config['repositories']:
+        # secret values are only known once the app is recorded, until then they plan as creates
+        app_record = state.get('app', repo_apps[repo])
+        app_info = {}
+        if app_record:
+            app_info = planned_app_info(
+                app_record, config['rgname'], config['container_registry'], config['cluster_name'], config['aks_enabled']
+            )
+
+        for key in app_info or ['subscription_id', 'tenant_id', 'client_id', 'resource_group', 'container_registry']:
+            value_hash = state.hash_value(app_info[key]) if app_info else None
+            desired.append(('secret', f"{gh_org_user}/{repo}|{key.upper()}", {'hash': value_hash}))
+
+    return desired
+
+
+async def select_repositories(gh_org_user, selector, state):
+    """Resolve a repository selector against the github app installation.
+
+    Selected repos are recorded as checked, the listing already proved they are accessible.
+    """
+    async with githubsec.AsyncGitHubSecretMagic() as gh_secret_magic:
+        repositories = []
+
+        async for repo, repo_check in gh_secret_magic.select_repositories(gh_org_user, **selector):
+            repositories.append(repo)
+            state.record('repo', f"{gh_org_user}/{repo}", {'id': repo_check['id'], 'private': repo_check['private']})
+
+    print(f"Selected {len(repositories)} repositories: {repositories}")
+
+    if not repositories:
+        raise Exception(f"No repositories of {gh_org_user} match {selector}")
+
+    return repositories
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Connect GitHub repos to Azure with an app registration")
+    parser.add_argument('--plan', action='store_true', help="print what would change from local state and exit without calling any API")
+    parser.add_argument('--state', default=DEFAULT_STATE_PATH, help="path of the local state journal")
+    parser.add_argument('--ttl', type=int, default=DEFAULT_TTL_SECONDS, help="seconds before a recorded item is checked again")
+    parser.add_argument('--no-state', action='store_true', help="ignore local state and check every item")
+    parser.add_argument('--trace', help="append a JSONL span per API call to this file")
+    parser.add_argument('--otel', action='store_true', help="also emit spans through opentelemetry-api")
+    parser.add_argument('--destroy', action='store_true', help="delete the app registrations, role assignments and secrets this tool created")
+    parser.add_argument('--rotate', action='store_true', help="replace the app registrations with new ones and rewrite every secret")
+    parser.add_argument('--preflight', action='store_true', help="only run the GitHub and Azure checks and print their report")
+    parser.add_argument('--dry-run', action='store_true', help="with --destroy or --rotate, only list what would change")
+    parser.add_argument('--app-index', nargs='?', const=DEFAULT_INDEX_PATH, metavar='PATH', help="answer app lookups from a local index kept current with Graph delta queries")
+    parser.add_argument('--token-cache', nargs='?', const='', metavar='PATH', help="keep Azure tokens in an encrypted cache file between runs")
+    args = parser.parse_args()
+
+    tracer.configure(args.trace, args.otel)
+
+    if args.token_cache is not None:
+        token_cache.configure(args.token_cache or None)
+
+    try:
+        # # Fill the following 5 variables with your details below and uncomment them
         repositories = ['repo1', 'repo2']  # add all repositories that need access
         gh_org_user = 'github user/org that owns the repo'
         app_name = "app-name" #name of app registration in Azure
         app_description = "Description of the app registration"
-        rgname = "resource group" #resource group name that host azure resources         
+        rgname = "resource group" #resource group name that host azure resources
         container_registry = 'acrregistry' #azure container registry name
-        aks_enabled = False #set to True if you want to assign AKS role to app registration       
-        
+        aks_enabled = False #set to True if you want to assign AKS role to app registration
+        use_org_secrets = False #set to True to write shared values once as org secrets (gh_org_user must be an org)
+        branches = ["main"] #branches that get a federated credential
+        repository_selector = None #or pick repos the github app can see, e.g. {'patterns': ['svc-*'], 'regex': None, 'topics': ['azure']}
+
         if aks_enabled:
             cluster_name = input("Enter AKS Cluster Name: ")
-        
+
         else:
             cluster_name = None
 
-        # Initialize Azure App Manager
-        az_app_manager = AzureAppRegManager(rgname, cluster_name, container_registry, aks_enabled)
+        config = {
+            'repositories': repositories,
+            'gh_org_user': gh_org_user,
+            'app_name': app_name,
+            'app_description': app_description,
+            'rgname': rgname,
+            'container_registry': container_registry,
+            'cluster_name': cluster_name,
+            'aks_enabled': aks_enabled,
+            'use_org_secrets': use_org_secrets,
+            'branches': branches
+        }
 
-        #auth to github
-        gh_secret_magic = githubsec.GitHubSecretMagic()
+        state = StateStore(None, ttl=0) if args.no_state else StateStore(args.state, args.ttl)
 
-        #ensure all repos exists and accessible
-        for repo in repositories:
-            print(f'Checking if Repo exists: {repo}')
-            repo_check = gh_secret_magic.check_repository_exists(gh_org_user, repo)
-            
-            if not repo_check['exists'] or not repo_check['accessible']:
-                print(f"Repository {gh_org_user}/{repo} does not exist or is not accessible. Exiting.")
+        if repository_selector:
+            config['repositories'] = await select_repositories(gh_org_user, repository_selector, state)
+
+        if args.destroy or args.rotate:
+            pool = AzureClientPool()
+
+            try:
+                az_app_manager = await AzureAppRegManager.create(rgname, cluster_name, container_registry, aks_enabled, pool=pool)
+                await run_teardown(az_app_manager, config, state, 'destroy' if args.destroy else 'rotate', args.dry_run)
+
+            finally:
+                if not args.dry_run:
+                    state.save()
+
+                await pool.close()
+                tracer.print_summary()
+
+            return
+
+        plan = state.plan(build_desired_items(state, config))
+
+        if args.plan:
+            print_plan(plan)
+            return
+
+        if all(action == 'skip' for action, _, _ in plan) and not args.preflight:
+            print("Local state is current, nothing to do. Use --no-state or a lower --ttl to force a check.")
+            return
+
+        # Initialize Azure App Manager on the async clients, one credential and token cache for every client
+        pool = AzureClientPool()
+        gh_secret_magic = githubsec.AsyncGitHubSecretMagic()
+
+        try:
+            #validate github and azure side by side, every problem is reported before anything is created
+            preflight = await run_preflight(config, pool, gh_secret_magic)
+            preflight.print()
+
+            if not preflight.ok:
+                print("Preflight failed, nothing was changed. Exiting.")
                 return
-            
-            else:
-                print(f"Repository {gh_org_user}/{repo} exists and accessible. Proceeding...")
 
-        #create app registration and assign roles
-        app_info = await az_app_manager.create_app_registration(app_name, app_description)
-
-        for repo in repositories:
-            #create federated credentials
-            await az_app_manager.create_federated_credentials(gh_org_user, repo)
-           
-            #get existing secrets
-            existing_secrets = gh_secret_magic.get_existing_secrets(gh_org_user, repo)                                    
-            
-            #create github secrets
-            try:                
-                for key, value in app_info.items():                    
-                    try:
-                        #if it's existing secret and app registration not created, skip creating secret
-                        if key.upper() in existing_secrets and not az_app_manager.appreg_created:
-                            print(f"Secret '{key}' already exists in {repo}, skipping creation.")
-                            continue
-                        else: 
-                            print(f"{key}: {value}")
-                            print(f"Creating secret '{key}' in {repo}...")
-                            gh_secret_magic.createrepoSecret(gh_org_user, repo, key, value)
-
-                    except Exception as inner_e:
-                        print(f"Error creating secret: {inner_e}")
-
-            except Exception as e:
-             print(f"Error: {e}")
+            if args.preflight:
+                return
+
+            az_app_manager = preflight.az_app_manager
+
+            app_index = None
+            if args.app_index:
+                app_index = AppIndex(args.app_index)
+                await app_index.refresh(az_app_manager.graph_batcher)
+
+            with tracer.span(app_name, 'binding', app_name=app_name, resource_group=rgname):
+                await run_onboarding(az_app_manager, config, state, app_index, gh_secret_magic, preflight.repo_checks)
 
+        finally:
+            state.save()
+            await gh_secret_magic.aclose()
+            await pool.close()
+            tracer.print_summary()
 
     except Exception as outer_e:
         print(f"Outer Error: {outer_e} Exiting Program.")
 
 
+async def run_onboarding(az_app_manager, config, state, app_index=None, gh_secret_magic=None, repo_checks=None):
+    """Check repos, create the app registration and wire up credentials and secrets.
+
+    Items the local state journal holds as fresh are not checked again, apps are looked up
+    in app_index when one is given. A GitHub client and repo checks handed over by preflight
+    are reused instead of authenticating and checking again.
+    """
+    gh_org_user = config['gh_org_user']
+    repositories = config['repositories']
+
+    async with AsyncExitStack() as stack:
+
+        #auth to github, one pooled async client shared by every repo, unless preflight already did
+        if gh_secret_magic is None:
+            gh_secret_magic = await stack.enter_async_context(githubsec.AsyncGitHubSecretMagic())
+
+        #ensure all repos exists and accessible, batched into GraphQL queries
+        to_check = [repo for repo in repositories if not state.is_fresh('repo', f"{gh_org_user}/{repo}")]
+        repo_checks = dict(repo_checks or {})
+
+        unchecked = [repo for repo in to_check if (gh_org_user, repo) not in repo_checks]
+        if unchecked:
+            print(f'Checking if Repos exist: {unchecked}')
+            with tracer.phase('repo'):
+                repo_checks.update(await gh_secret_magic.check_repositories_exist([(gh_org_user, repo) for repo in unchecked]))
+
+        missing = []
+        for repo in to_check:
+            repo_check = repo_checks[(gh_org_user, repo)]
+
+            if not repo_check['exists'] or not repo_check['accessible']:
+                print(f"Repository {gh_org_user}/{repo} does not exist or is not accessible: {repo_check['message']}")
+                missing.append(repo)
+
+            else:
+                print(f"Repository {gh_org_user}/{repo} exists and accessible. Proceeding...")
+                state.record('repo', f"{gh_org_user}/{repo}", {'id': repo_check.get('id'), 'private': repo_check['private']})
+
+        #report every missing repo at once
+        if missing:
+            print(f"{len(missing)} repositories are missing or not accessible: {missing}. Exiting.")
+            return
+
+        #repos go to the app registration, or over several once their credentials outgrow one app
+        repo_managers = await onboard_shards(az_app_manager, config, state, app_index)
+
+        #only secrets whose recorded value hash is missing, changed or stale are written
+        statuses = {
+            repo: {
+                key: state.status('secret', f"{gh_org_user}/{repo}|{key.upper()}", {'hash': state.hash_value(value)})
+                for key, value in repo_managers[repo].app_info().items()
+            }
+            for repo in repositories
+        }
+        per_repo_secrets = {
+            repo: {
+                key: value for key, value in repo_managers[repo].app_info().items() if statuses[repo][key] != 'skip'
+            }
+            for repo in repositories
+        }
+
+        #a value never written or changed since is written even when the secret name exists,
+        #only stale items whose recorded value still matches are merely checked for existence
+        overwrite = {
+            repo: {
+                key for key in per_repo_secrets[repo]
+                if repo_managers[repo].appreg_created or statuses[repo][key] in ('create', 'update')
+            }
+            for repo in repositories
+        }
+
+        if config['use_org_secrets']:
+            #values identical across repos become one org secret each, only the rest stay repo scoped
+            shared_secrets, per_repo_secrets = githubsec.split_shared_secrets(per_repo_secrets)
+            repository_ids = [state.get('repo', f"{gh_org_user}/{repo}")['id'] for repo in repositories]
+
+            with tracer.phase('secrets'):
+                report = await gh_secret_magic.upsert_org_secrets(
+                    gh_org_user, shared_secrets, repository_ids, skip_existing=True,
+                    overwrite={key for key in shared_secrets if any(key in overwrite[repo] for repo in repositories)}
+                )
+
+            for key, result in report.items():
+                if result['ok']:
+                    print(f"Org secret '{key}' {result['action']} for {len(repository_ids)} repositories")
+
+                #created, updated or verified; only 'check' items are left unwritten, so a verified
+                #value is the one the journal already holds
+                if result['ok']:
+                    for repo in repositories:
+                        state.record('secret', f"{gh_org_user}/{repo}|{key.upper()}", {'hash': state.hash_value(shared_secrets[key])})
+
+                elif result['action'] == "conflict":
+                    #another app's org secret keeps its value, repo secrets of the same name take precedence
+                    print(f"{result['error']}, writing '{key}' per repository instead")
+
+                    for repo in repositories:
+                        per_repo_secrets[repo][key] = shared_secrets[key]
+                        overwrite[repo].add(key)
+
+                elif not result['ok']:
+                    print(f"Error creating org secret '{key}': {result['error']}")
+
+        #create remaining github secrets for every repo concurrently
+        with tracer.phase('secrets'):
+            reports = await asyncio.gather(*[
+                create_repo_secrets(gh_secret_magic, gh_org_user, repo, per_repo_secrets[repo], overwrite[repo])
+                for repo in repositories
+            ])
+
+        #every ok result is journaled: written values, and 'verified' ones, which only 'check'
+        #items planned with their recorded hash can be
+        for repo, report in zip(repositories, reports):
+            for key, result in report.items():
+                if result['ok']:
+                    state.record('secret', f"{gh_org_user}/{repo}|{key.upper()}", {'hash': state.hash_value(per_repo_secrets[repo][key])})
+
+
+async def onboard_shards(az_app_manager, config, state, app_index=None):
+    """Create or adopt the app registration, spread over as many as the federated credentials need.
+
+    The shards are planned from the credentials the apps already hold on every run, then
+    each gets its roles and missing credentials. Returns {repo: manager of the app
+    registration holding its credentials}.
+    """
+    gh_org_user = config['gh_org_user']
+    app_name = config['app_name']
+    repositories = config['repositories']
+    branches = config['branches']
+
+    found = app_index.find_many(shard_lookup_names(app_name, repositories, branches)) if app_index else None
+
+    with tracer.phase('app'):
+        shard_managers = await provision_shards(
+            az_app_manager, app_name, config['app_description'], gh_org_user, repositories, branches, found
+        )
+
+    async def finish_shard(shard, shard_manager):
+        shard_app_name = shard['app_name']
+
+        roles_data = {'resource_group': config['rgname'], 'aks_enabled': config['aks_enabled']}
+        if shard_manager.appreg_created or not state.is_fresh('roles', shard_app_name, roles_data):
+            with tracer.phase('roles'):
+                await shard_manager.ensure_app_roles()
+            state.record('roles', shard_app_name, roles_data)
+
+        state.record('app', shard_app_name, shard_manager.app_record())
+
+        entries = AzureAppRegManager._federated_credential_entries(gh_org_user, shard['repos'], branches)
+        if any(not state.is_fresh('federated', f"{shard_app_name}|{entry['name']}", {'subject': entry['subject']}) for entry in entries):
+            with tracer.phase('federated'):
+                report = await shard_manager.ensure_federated_credentials(gh_org_user, shard['repos'], branches)
+
+            for entry in entries:
+                if entry['name'] in report and not isinstance(report[entry['name']], Exception):
+                    state.record('federated', f"{shard_app_name}|{entry['name']}", {'subject': entry['subject']})
+
+        for repo in shard['repos']:
+            state.record('shard', f"{gh_org_user}/{repo}", {'app_name': shard_app_name})
+
+    await asyncio.gather(*[finish_shard(shard, shard_manager) for shard, shard_manager in shard_managers])
+
+    return {repo: shard_manager for shard, shard_manager in shard_managers for repo in shard['repos']}
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,232 @@
+import asyncio
+from azapp import AzureAppRegManager, ACR_RESOURCE_TYPE, AKS_RESOURCE_TYPE, ROLE_ASSIGNMENT_WRITE
+from instrumentation import tracer
+
+
+ARM_SCOPE = 'https://management.azure.com/.default'
+
+# installation permission levels that allow writing secrets
+WRITE_LEVELS = ('write', 'admin')
+
+
+class PreflightWarning(Exception):
+    """Raised by a check whose finding is worth reporting but does not block provisioning"""
+
+
+class PreflightReport:
+    """Outcome of every preflight check, plus the handles the checks validated.
+
+    Each check is recorded as {'check', 'target', 'ok', 'warning', 'message', 'seconds'}
+    where ok is None for checks skipped because one they depend on failed. az_app_manager,
+    repo_checks and the GitHub client's tokens and public keys are reused by provisioning.
+    """
+
+    def __init__(self):
+        self.checks = []
+        self.az_app_manager = None
+        self.repo_checks = {}
+
+
+    @property
+    def ok(self):
+        return all(check['ok'] for check in self.checks)
+
+
+    def record(self, check, target, ok, message, seconds=0.0, warning=False):
+        self.checks.append({
+            'check': check, 'target': target, 'ok': ok, 'warning': warning, 'message': message, 'seconds': seconds
+        })
+
+
+    def skip(self, checks, targets, reason):
+        """Record checks that could not run, targets is one target or one per check"""
+        if isinstance(targets, str):
+            targets = [targets] * len(checks)
+
+        for check, target in zip(checks, targets):
+            self.record(check, target, None, f"skipped, {reason} failed")
+
+
+    async def run(self, check, target, request):
+        """Await one check inside a span and record it.
+
+        request returns (value, message) and raises with the failure message, or raises
+        PreflightWarning to pass with a warning. Returns value, True after a warning, or None
+        when the check failed.
+        """
+        with tracer.span(check, 'preflight', target=target) as span:
+            try:
+                value, message = await request
+
+            except PreflightWarning as e:
+                self.record(check, target, True, str(e), span.duration, warning=True)
+                return True
+
+            except Exception as e:
+                span.status = 'ERROR'
+                span.error = str(e)
+                self.record(check, target, False, str(e), span.duration)
+                return None
+
+            self.record(check, target, True, message, span.duration)
+            return value
+
+
+    def print(self):
+        failed = [check for check in self.checks if check['ok'] is False]
+        skipped = [check for check in self.checks if check['ok'] is None]
+        warnings = [check for check in self.checks if check['warning']]
+
+        print(f"\nPreflight: {len(self.checks) - len(failed) - len(skipped)} passed "
+              f"({len(warnings)} with warnings), {len(failed)} failed, {len(skipped)} skipped")
+
+        # checks finish interleaved, list them grouped by side
+        for check in sorted(self.checks, key=lambda check: check['check'].split(' ', 1)[0]):
+            status = 'warn' if check['warning'] else {True: 'ok', False: 'FAIL', None: 'skip'}[check['ok']]
+            print(f"  [{status:<4}] {check['check']} ({check['target']}): {check['message']} [{check['seconds']:.2f}s]")
+
+
+async def check_github(report, gh_secret_magic, config):
+    """Private key, installation token and its secrets permission, then every repo concurrently"""
+    owner = config['gh_org_user']
+    repositories = config['repositories']
+
+    async def private_key():
+        if not gh_secret_magic.app_id or not gh_secret_magic.private_key_path:
+            raise Exception("GITHUB_APP_ID and GITHUB_APP_PRIVATE_KEY_PATH must be set")
+
+        gh_secret_magic._load_private_key()
+        return True, f"loaded {gh_secret_magic.private_key_path}"
+
+    async def installation_token():
+        installation_id = await gh_secret_magic.token_pool.installation_for(owner)
+        await gh_secret_magic.token_pool.get_token(installation_id)
+
+        return gh_secret_magic.token_pool.permissions.get(installation_id, {}), f"installation {installation_id}"
+
+    async def secrets_permission(permissions):
+        needed = ['secrets'] + (['organization_secrets'] if config['use_org_secrets'] else [])
+        missing = [name for name in needed if permissions.get(name) not in WRITE_LEVELS]
+
+        if missing:
+            raise Exception(f"the app installation lacks write access to {', '.join(missing)}")
+
+        return True, f"{', '.join(needed)}: write"
+
+    # what the token gates, one check for the permission and one per repo
+    dependents = ['github secrets permission'] + ['github repository'] * len(repositories)
+    targets = [owner] + [f"{owner}/{repo}" for repo in repositories]
+
+    if await report.run('github private key', owner, private_key()) is None:
+        report.skip(['github installation token'] + dependents, [owner] + targets, "github private key")
+        return
+
+    permissions = await report.run('github installation token', owner, installation_token())
+    if permissions is None:
+        report.skip(dependents, targets, "github installation token")
+        return
+
+    # public keys are fetched alongside the repo checks, the secrets calls then reuse them
+    with tracer.span('repositories', 'preflight', target=owner) as span:
+        _, repo_checks, public_keys = await asyncio.gather(
+            report.run('github secrets permission', owner, secrets_permission(permissions)),
+            gh_secret_magic.check_repositories_exist([(owner, repo) for repo in repositories]),
+            asyncio.gather(*[
+                gh_secret_magic.get_cached_public_key(owner, repo) for repo in repositories
+            ], return_exceptions=True)
+        )
+
+    for repo, public_key in zip(repositories, public_keys):
+        repo_check = repo_checks[(owner, repo)]
+
+        if not repo_check['exists'] or not repo_check['accessible']:
+            report.record('github repository', f"{owner}/{repo}", False, repo_check['message'], span.duration)
+
+        elif isinstance(public_key, Exception):
+            report.record('github repository', f"{owner}/{repo}", False, f"secrets not accessible: {str(public_key)}", span.duration)
+
+        else:
+            report.repo_checks[(owner, repo)] = repo_check
+            report.record('github repository', f"{owner}/{repo}", True, "accessible, secrets public key fetched", span.duration)
+
+
+async def check_azure(report, pool, config, subscription_id=None, tenant_id=None):
+    """Credential, subscription and resource group, then the ACR, AKS and role assignment checks concurrently"""
+    rgname = config['rgname']
+    credential = pool.credential(tenant_id)
+
+    async def token():
+        # the token stays in the pool's credential cache for every later client
+        await credential.get_token(ARM_SCOPE)
+        return True, "token acquired"
+
+    async def scope():
+        manager = await AzureAppRegManager.create(
+            rgname, config['cluster_name'], config['container_registry'], config['aks_enabled'],
+            subscription_id, tenant_id, pool=pool
+        )
+
+        return manager, f"subscription {manager.subscription_id}, tenant {manager.tenant_id}"
+
+    async def resource(resource_type, name):
+        if not name:
+            raise Exception("no name configured")
+
+        # the registry or cluster may live elsewhere, roles only reach it in the app's resource group
+        resource_groups = await report.az_app_manager.find_resource_groups(resource_type, name)
+
+        if not resource_groups:
+            raise PreflightWarning(f"'{name}' not found in subscription {report.az_app_manager.subscription_id}, "
+                                   "it may live in another subscription")
+
+        if not any(group.lower() == rgname.lower() for group in resource_groups):
+            raise PreflightWarning(f"'{name}' is in resource group '{resource_groups[0]}', "
+                                   f"roles assigned on '{rgname}' do not reach it")
+
+        return True, f"exists in resource group '{rgname}'"
+
+    async def role_assignment_permission():
+        if not await report.az_app_manager.can_assign_roles():
+            raise Exception(f"the signed-in identity lacks {ROLE_ASSIGNMENT_WRITE} (e.g. Owner or User Access Administrator)")
+
+        return True, f"{ROLE_ASSIGNMENT_WRITE} allowed"
+
+    dependents = ['azure container registry', 'azure role assignment permission']
+    if config['aks_enabled']:
+        dependents.append('azure aks cluster')
+
+    if await report.run('azure credential', tenant_id or 'default tenant', token()) is None:
+        report.skip(['azure subscription and resource group'] + dependents, rgname, "azure credential")
+        return
+
+    report.az_app_manager = await report.run('azure subscription and resource group', rgname, scope())
+    if report.az_app_manager is None:
+        report.skip(dependents, rgname, "azure subscription and resource group")
+        return
+
+    checks = [
+        report.run('azure container registry', config['container_registry'], resource(ACR_RESOURCE_TYPE, config['container_registry'])),
+        report.run('azure role assignment permission', rgname, role_assignment_permission())
+    ]
+
+    if config['aks_enabled']:
+        checks.append(report.run('azure aks cluster', config['cluster_name'], resource(AKS_RESOURCE_TYPE, config['cluster_name'])))
+
+    await asyncio.gather(*checks)
+
+
+async def run_preflight(config, pool, gh_secret_magic, subscription_id=None, tenant_id=None):
+    """Run the GitHub and Azure checks side by side and return one PreflightReport.
+
+    Nothing is created. Every failure is reported at once instead of the run stopping at
+    the first one, and the validated manager, tokens and public keys are kept for provisioning.
+    """
+    report = PreflightReport()
+
+    with tracer.span('preflight', 'preflight', phase='preflight'):
+        await asyncio.gather(
+            check_github(report, gh_secret_magic, config),
+            check_azure(report, pool, config, subscription_id, tenant_id)
+        )
+
+    return report
@@ -0,0 +1,163 @@
+import asyncio
+from azapp import GITHUB_OIDC_ISSUER, single_app
+from graphbatch import GraphBatchRequest
+
+
+# Entra allows at most 20 federated identity credentials per application
+MAX_FEDERATED_CREDENTIALS = 20
+
+# extra shard names looked up beyond the ones needed, so repos placed on a later shard by an
+# earlier, larger run are found and left where they are
+SHARD_LOOKAHEAD = 4
+
+
+def shard_app_name(app_name, index):
+    """Display name of a shard, the first shard is the app registration itself"""
+    return app_name if index == 0 else f"{app_name}-{index + 1}"
+
+
+def shard_lookup_names(app_name, repos, branches):
+    """Display names provision_shards looks up, the shards repos need plus SHARD_LOOKAHEAD"""
+    needed = -(-len(repos) * len(branches) // MAX_FEDERATED_CREDENTIALS)
+    return [shard_app_name(app_name, index) for index in range(needed + SHARD_LOOKAHEAD)]
+
+
+def repo_from_subject(gh_org_user, subject):
+    """Repo name of a GitHub branch subject for gh_org_user, None for anything else"""
+    prefix = f"repo:{gh_org_user}/"
+
+    if not subject or not subject.startswith(prefix) or ':ref:refs/heads/' not in subject:
+        return None
+
+    return subject[len(prefix):].split(':', 1)[0]
+
+
+def plan_shards(app_name, repos, branches, placements=None, used=None, capacity=MAX_FEDERATED_CREDENTIALS):
+    """Spread repos over as few app registrations as fit their federated credentials.
+
+    placements maps repos to the shard index already holding their credentials, those stay put
+    while they fit. used maps shard indexes to slots taken by credentials this run does not
+    manage. The remaining repos fill the lowest shard with room, in name order, so the same
+    input always gives the same plan. Returns [{'index', 'app_name', 'repos'}] in index order.
+    """
+    placements = placements or {}
+    cost = len(branches)
+
+    if cost > capacity:
+        raise Exception(f"{cost} branches need more than the {capacity} federated credentials one app allows")
+
+    load = dict(used or {})
+    assigned = {}
+
+    for repo in sorted(repos):
+        index = placements.get(repo)
+
+        if index is not None and load.get(index, 0) + cost <= capacity:
+            assigned[repo] = index
+            load[index] = load.get(index, 0) + cost
+
+    for repo in sorted(repos):
+        if repo in assigned:
+            continue
+
+        index = 0
+        while load.get(index, 0) + cost > capacity:
+            index += 1
+
+        assigned[repo] = index
+        load[index] = load.get(index, 0) + cost
+
+    shards = {}
+    for repo in repos:
+        index = assigned[repo]
+        shards.setdefault(index, {'index': index, 'app_name': shard_app_name(app_name, index), 'repos': []})
+        shards[index]['repos'].append(repo)
+
+    return [shards[index] for index in sorted(shards)]
+
+
+async def discover_shards(manager, gh_org_user, repos, names, found=None):
+    """Find the shard apps that already exist and which repos their credentials cover.
+
+    names are the shard display names to look for, found may answer some of them beforehand
+    ({name: [apps]}, e.g. from an AppIndex). Takes one Graph $batch round trip for the names
+    found does not answer and one for the credentials. Returns ({index: existing app},
+    placements, used) for plan_shards.
+    """
+    found = dict(found or {})
+
+    unknown = [name for name in names if name not in found]
+    if unknown:
+        found.update(await manager.find_apps_by_display_names(unknown))
+
+    # a name that could not be looked up might exist, creating it again would duplicate the app
+    failed = [name for name in names if name not in found]
+    if failed:
+        raise Exception(f"Could not look up app registrations {failed}")
+
+    apps = {index: single_app(name, found[name]) for index, name in enumerate(names) if found.get(name)}
+
+    results = await manager.graph_batcher.execute([
+        GraphBatchRequest(index, 'GET', f"/applications/{app['id']}/federatedIdentityCredentials?$select=name,issuer,subject")
+        for index, app in apps.items()
+    ])
+
+    wanted = set(repos)
+    held = []
+
+    for index in sorted(apps):
+        result = results.get(str(index), {})
+
+        if result.get('status') != 200:
+            raise Exception(f"Failed to list federated credentials of '{names[index]}': {result.get('status')}")
+
+        for credential in result['body'].get('value', []):
+            repo = None
+            if credential.get('issuer') == GITHUB_OIDC_ISSUER:
+                repo = repo_from_subject(gh_org_user, credential.get('subject'))
+
+            held.append((index, repo if repo in wanted else None))
+
+    # a repo found on several shards stays on the lowest one
+    placements = {}
+    for index, repo in held:
+        if repo is not None:
+            placements.setdefault(repo, index)
+
+    # everything else, including leftovers of a repo placed elsewhere, takes a slot
+    used = {}
+    for index, repo in held:
+        if repo is None or placements[repo] != index:
+            used[index] = used.get(index, 0) + 1
+
+    return apps, placements, used
+
+
+async def provision_shards(manager, app_name, app_description, gh_org_user, repos, branches, found=None):
+    """Plan the shards for repos and create or adopt their app registrations concurrently.
+
+    Every run plans this way, even when the repos fit one app, so credentials an earlier
+    run placed on a later shard and slots held by other credentials are always counted.
+    found answers shard name lookups beforehand, as for discover_shards. The first shard
+    uses manager itself, the others get a manager from manager.for_app(). Roles and
+    federated credentials are left to the caller. Returns [(shard, shard manager)].
+    """
+    apps, placements, used = await discover_shards(
+        manager, gh_org_user, repos, shard_lookup_names(app_name, repos, branches), found
+    )
+
+    shards = plan_shards(app_name, repos, branches, placements, used)
+    if len(shards) > 1:
+        print(f"Spreading {len(repos)} repositories over {len(shards)} app registrations")
+
+    async def create_shard(shard):
+        shard_manager = manager if shard['index'] == 0 else manager.for_app()
+
+        existing = [apps[shard['index']]] if shard['index'] in apps else []
+        await shard_manager.create_app_registration(
+            shard['app_name'], app_description, assign_roles=False, existing=existing
+        )
+
+        return shard, shard_manager
+
+    return await asyncio.gather(*[create_shard(shard) for shard in shards])
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import secrets
+import time
+
+
+DEFAULT_STATE_PATH = '.onboard_state.json'
+DEFAULT_TTL_SECONDS = 24 * 3600
+
+
+class StateStore:
+    """On-disk JSON journal of what previous runs created.
+
+    Items are keyed by (kind, key) and hold the data written plus when it was last confirmed
+    against Azure or GitHub. Items confirmed within the TTL with unchanged data are skipped on
+    the next run; anything else is checked again. With path=None nothing is persisted.
+    """
+
+    def __init__(self, path=DEFAULT_STATE_PATH, ttl=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._items = {}
+        self._salt = None
+        self.load()
+
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            self._salt = secrets.token_hex(16)
+            return
+
+        with open(self.path, 'r', encoding='utf-8') as state_file:
+            state = json.load(state_file)
+
+        self._items = state.get('items', {})
+        self._salt = state.get('salt') or secrets.token_hex(16)
+
+
+    def save(self):
+        """Write the journal atomically so an interrupted run never leaves a half-written file"""
+        if self.path is None:
+            return
+
+        temp_path = f"{self.path}.tmp"
+
+        with open(temp_path, 'w', encoding='utf-8') as state_file:
+            json.dump({'version': 1, 'salt': self._salt, 'items': self._items}, state_file, indent=2, sort_keys=True)
+
+        os.replace(temp_path, self.path)
+
+
+    def hash_value(self, value):
+        """Salted hash of a secret value, so the journal never holds the value itself"""
+        return hashlib.sha256(f"{self._salt}:{value}".encode()).hexdigest()
+
+
+    def get(self, kind, key):
+        item = self._items.get(f"{kind}:{key}")
+        return item['data'] if item else None
+
+
+    def record(self, kind, key, data=None):
+        self._items[f"{kind}:{key}"] = {'data': data, 'checked_at': time.time()}
+
+
+    def forget(self, kind, key):
+        self._items.pop(f"{kind}:{key}", None)
+
+
+    def items(self, kind):
+        """Yield (key, data) for every recorded item of a kind"""
+        prefix = f"{kind}:"
+        for item_key, item in self._items.items():
+            if item_key.startswith(prefix):
+                yield item_key[len(prefix):], item['data']
+
+
+    def status(self, kind, key, data=None):
+        """Return 'create', 'update', 'check' or 'skip' for a desired item.
+
+        create - never recorded, update - recorded with different data,
+        check - recorded but older than the TTL, skip - recorded recently with the same data.
+        """
+        item = self._items.get(f"{kind}:{key}")
+
+        if item is None:
+            return 'create'
+
+        if data is not None and item['data'] != data:
+            return 'update'
+
+        if time.time() - item['checked_at'] > self.ttl:
+            return 'check'
+
+        return 'skip'
+
+
+    def is_fresh(self, kind, key, data=None):
+        return self.status(kind, key, data) == 'skip'
+
+
+    def plan(self, desired):
+        """Compute [(action, kind, key)] for desired [(kind, key, data)] items"""
+        return [(self.status(kind, key, data), kind, key) for kind, key, data in desired]
+
+
+def print_plan(plan):
+    """Print a plan as a diff, one line per item, and a count per action"""
+    symbols = {'create': '+', 'update': '~', 'check': '?', 'skip': ' '}
+
+    for action, kind, key in plan:
+        print(f"{symbols[action]} {kind:<10} {key} ({action})")
+
+    counts = {}
+    for action, _, _ in plan:
+        counts[action] = counts.get(action, 0) + 1
+
+    print("Plan: " + ", ".join(f"{counts.get(action, 0)} to {action}" for action in symbols))
@@ -0,0 +1,382 @@
+import asyncio
+import githubsec
+from azapp import AzureAppRegManager
+from graphbatch import GraphBatchRequest
+from instrumentation import tracer
+from shards import MAX_FEDERATED_CREDENTIALS, SHARD_LOOKAHEAD, shard_app_name, repo_from_subject
+
+
+# app_info keys, written to GitHub as upper-case secret names
+SECRET_KEYS = ('subscription_id', 'tenant_id', 'client_id', 'resource_group', 'container_registry', 'cluster_name')
+
+# cap on concurrent ARM deletes, GitHub and Graph calls are bounded by their own clients
+DEFAULT_MAX_CONCURRENCY = 10
+
+# replacement apps carry this suffix until the apps they replace are gone
+ROTATION_SUFFIX = '-rotating'
+
+
+def rotation_base_name(name):
+    """The display name a replacement app takes once its rotation completes"""
+    return name[:-len(ROTATION_SUFFIX)] if name.endswith(ROTATION_SUFFIX) else name
+
+
+async def discover_owned(az_app_manager, gh_secret_magic, config, state=None):
+    """Find what the tool created for config by the names it gives things.
+
+    Candidate apps are the app registration, its shards and replacements left by an unfinished
+    rotation. Only apps holding credentials for config's repos under a name the tool gives them
+    ({gh_org_user}-{repo}-federated and its branch and hashed variants), or recorded in the state
+    journal, count as owned. Secrets are the app_info keys, org secrets only when no repository
+    outside config can see them.
+    Takes one Graph $batch call per kind of lookup and one secrets listing per repo.
+    """
+    gh_org_user = config['gh_org_user']
+    repositories = config['repositories']
+
+    shard_count = -(-len(repositories) * len(config['branches']) // MAX_FEDERATED_CREDENTIALS) + SHARD_LOOKAHEAD
+    names = [shard_app_name(config['app_name'], index) for index in range(shard_count)]
+    names += [f"{name}{ROTATION_SUFFIX}" for name in names]
+    found = await az_app_manager.find_apps_by_display_names(names)
+
+    candidates = []
+    for name in names:
+        for app in found.get(name, []):
+            manager = az_app_manager.for_app()
+            manager.restore_app({'app_object_id': app['id'], 'app_id': app['appId']})
+            candidates.append((name, manager))
+
+    # credentials of every candidate in one batch
+    results = await az_app_manager.graph_batcher.execute([
+        GraphBatchRequest(position, 'GET', f"/applications/{manager.app_object_id}/federatedIdentityCredentials?$select=id,name,subject")
+        for position, (_, manager) in enumerate(candidates)
+    ])
+
+    # a credential is the tool's when its subject is one of config's and it carries a name the tool gives that subject
+    owned = {
+        (name, entry['subject'])
+        for entry in AzureAppRegManager._federated_credential_entries(gh_org_user, repositories, config['branches'])
+        for name in AzureAppRegManager._federated_credential_names(gh_org_user, entry['repo'], entry['branch'], entry['primary'])
+    }
+
+    apps = []
+    federated = []
+    for position, (name, manager) in enumerate(candidates):
+        result = results.get(str(position), {})
+
+        if result.get('status') != 200:
+            raise Exception(f"Failed to list federated credentials of '{name}': {result.get('status')}")
+
+        credentials = [
+            {
+                'app': name,
+                'manager': manager,
+                'id': credential['id'],
+                'name': credential['name'],
+                'repo': repo_from_subject(gh_org_user, credential.get('subject'))
+            }
+            for credential in result['body'].get('value', []) if (credential['name'], credential.get('subject')) in owned
+        ]
+
+        # a matching name alone does not prove the tool created the app
+        record = state.get('app', rotation_base_name(name)) if state is not None else None
+        if not credentials and not (record and record.get('app_id') == manager.app_id):
+            print(f"Skipping '{name}' ({manager.app_id}): it holds none of this tool's credentials and is not in the state journal.")
+            continue
+
+        apps.append((name, manager))
+        federated.extend(credentials)
+
+    # the principals' role assignments at the resource group, every app concurrently
+    async def app_roles(name, manager):
+        manager.service_principal_id = await manager.get_service_principal_id(manager.app_id)
+
+        if manager.service_principal_id is None:
+            return []
+
+        assignments = await manager.list_role_assignments(manager.service_principal_id)
+        return [{'app': name, 'manager': manager, 'id': assignment.id, 'role': assignment.role_definition_id.rsplit('/', 1)[-1]}
+                for assignment in assignments]
+
+    async def repo_secrets(repo):
+        existing = await gh_secret_magic.get_existing_secrets(gh_org_user, repo)
+        return [{'repo': repo, 'name': name} for name in existing if name.lower() in SECRET_KEYS]
+
+    role_results, secret_results = await asyncio.gather(
+        asyncio.gather(*[app_roles(name, manager) for name, manager in apps]),
+        asyncio.gather(*[repo_secrets(repo) for repo in repositories])
+    )
+
+    org_secrets = []
+    if config['use_org_secrets']:
+        repo_checks = await gh_secret_magic.check_repositories_exist([(gh_org_user, repo) for repo in repositories])
+        repository_ids = [repo_check.get('id') for repo_check in repo_checks.values() if repo_check.get('id')]
+
+        existing = [
+            secret async for secret in gh_secret_magic.paginate(f'/orgs/{gh_org_user}/actions/secrets', 'secrets')
+            if secret['name'].lower() in SECRET_KEYS
+        ]
+
+        # org secrets that other repositories can see belong to another app
+        owned = await asyncio.gather(*[
+            gh_secret_magic.org_secret_owned(gh_org_user, secret, repository_ids) for secret in existing
+        ])
+        org_secrets = [{'name': secret['name']} for secret, is_owned in zip(existing, owned) if is_owned]
+
+    return {
+        'apps': apps,
+        'federated': federated,
+        'roles': [role for roles in role_results for role in roles],
+        'secrets': [secret for secrets in secret_results for secret in secrets],
+        'org_secrets': org_secrets
+    }
+
+
+def print_owned(owned, mode):
+    """Dry-run listing of what destroy or rotate would touch"""
+    verb = "delete" if mode == 'destroy' else "replace"
+    gh_verb = "delete" if mode == 'destroy' else "rewrite"
+
+    for name, manager in owned['apps']:
+        print(f"- {verb} app registration '{name}' ({manager.app_id}) and its service principal")
+
+    for credential in owned['federated']:
+        print(f"- {verb} federated credential '{credential['name']}' on '{credential['app']}' (goes with the app)")
+
+    for role in owned['roles']:
+        print(f"- delete role assignment {role['role']} of '{role['app']}'")
+
+    for secret in owned['secrets']:
+        print(f"- {gh_verb} secret {secret['name']} in {secret['repo']}")
+
+    for secret in owned['org_secrets']:
+        print(f"- {gh_verb} org secret {secret['name']}")
+
+    print(f"{mode.capitalize()}: {len(owned['apps'])} apps, {len(owned['federated'])} federated credentials, "
+          f"{len(owned['roles'])} role assignments, {len(owned['secrets']) + len(owned['org_secrets'])} secrets")
+
+
+async def _bounded(semaphore, request):
+    async with semaphore:
+        return await request
+
+
+async def _delete_roles_and_apps(roles, apps, max_concurrency):
+    """Delete role assignments concurrently, then the apps, so no assignment is left orphaned.
+
+    Returns (failures, display names with no app left).
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    role_results = await asyncio.gather(*[
+        _bounded(semaphore, role['manager'].delete_role_assignment(role['id'])) for role in roles
+    ], return_exceptions=True)
+
+    app_results = await asyncio.gather(*[
+        _bounded(semaphore, manager.delete_app_registration()) for _, manager in apps
+    ], return_exceptions=True)
+
+    failures = []
+    for role, result in zip(roles, role_results):
+        if isinstance(result, Exception):
+            failures.append(f"role assignment {role['role']} of '{role['app']}': {str(result)}")
+
+    kept = set()
+    for (name, _), result in zip(apps, app_results):
+        if isinstance(result, Exception):
+            failures.append(f"app registration '{name}': {str(result)}")
+            kept.add(name)
+
+    # a name counts as deleted only when no app of that name is left
+    return failures, {name for name, _ in apps} - kept
+
+
+async def destroy(gh_secret_magic, config, owned, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Delete every owned object: secrets and role assignments concurrently, then the apps.
+
+    Federated credentials and service principals go with their app registration.
+    Returns a list of failures.
+    """
+    gh_org_user = config['gh_org_user']
+
+    secret_results, org_results, (failures, _) = await asyncio.gather(
+        asyncio.gather(*[
+            gh_secret_magic.delete_secret(gh_org_user, secret['repo'], secret['name']) for secret in owned['secrets']
+        ]),
+        asyncio.gather(*[
+            gh_secret_magic.delete_org_secret(gh_org_user, secret['name']) for secret in owned['org_secrets']
+        ]),
+        _delete_roles_and_apps(owned['roles'], owned['apps'], max_concurrency)
+    )
+
+    for secret, result in zip(owned['secrets'] + owned['org_secrets'], secret_results + org_results):
+        if not result['ok']:
+            failures.append(f"secret {secret['name']} in {secret.get('repo', gh_org_user)}: {result['error']}")
+
+    return failures
+
+
+async def rotate(az_app_manager, gh_secret_magic, config, owned, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Replace every owned app registration with a new one, then delete the old ones.
+
+    Each new app is created as {name}-rotating with the roles and the federated credentials
+    of the repos its predecessor served, every secret is rewritten with the new client id, and
+    only then are the old role assignments and apps deleted and the new apps renamed, so
+    workflows keep working and no two apps ever share a name. A replacement left by an
+    unfinished rotation is adopted instead of created again. Returns a list of failures.
+    """
+    gh_org_user = config['gh_org_user']
+    branches = config['branches']
+
+    old_apps = [(name, manager) for name, manager in owned['apps'] if not name.endswith(ROTATION_SUFFIX)]
+    pending = {rotation_base_name(name): manager for name, manager in owned['apps'] if name.endswith(ROTATION_SUFFIX)}
+
+    if not old_apps and not pending:
+        raise Exception(f"No app registration named '{config['app_name']}' found to rotate")
+
+    # repos follow the app holding their credential, the rest go to the first app
+    repos_of = {name: set() for name, _ in old_apps}
+    repos_of.update({name: set() for name in pending})
+    for credential in owned['federated']:
+        if credential['repo']:
+            repos_of[rotation_base_name(credential['app'])].add(credential['repo'])
+
+    placed = set().union(*repos_of.values())
+    first_name = old_apps[0][0] if old_apps else sorted(pending)[0]
+    repos_of[first_name].update(repo for repo in config['repositories'] if repo not in placed)
+
+    async def replace_app(name):
+        repos = sorted(repos_of[name])
+        new_manager = pending.get(name) or az_app_manager.for_app()
+
+        if name not in pending:
+            await new_manager.create_app_registration(
+                f"{name}{ROTATION_SUFFIX}", config['app_description'], assign_roles=False, existing=[]
+            )
+
+        try:
+            await asyncio.gather(
+                new_manager.ensure_app_roles(),
+                new_manager.ensure_federated_credentials(gh_org_user, repos, branches) if repos else asyncio.sleep(0)
+            )
+
+        except Exception:
+            # nothing points at a replacement yet, so a half-built one is removed rather than left behind
+            if name not in pending:
+                await new_manager.delete_app_registration()
+            raise
+
+        return repos, new_manager
+
+    names = sorted(repos_of)
+    results = await asyncio.gather(*[replace_app(name) for name in names], return_exceptions=True)
+
+    failures = [f"replacement for '{name}': {str(result)}" for name, result in zip(names, results) if isinstance(result, Exception)]
+    if failures:
+        # the replacements already built are not in use either, remove them so a retry starts clean
+        await asyncio.gather(*[
+            result[1].delete_app_registration() for name, result in zip(names, results)
+            if not isinstance(result, Exception) and name not in pending
+        ], return_exceptions=True)
+
+        failures.append("old app registrations were kept because not every replacement could be built")
+        return failures
+
+    replacements = dict(zip(names, results))
+
+    per_repo_secrets = {
+        repo: new_manager.app_info() for repos, new_manager in replacements.values() for repo in repos
+    }
+    report = {}
+
+    if config['use_org_secrets']:
+        shared_secrets, per_repo_secrets = githubsec.split_shared_secrets(per_repo_secrets)
+        repo_checks = await gh_secret_magic.check_repositories_exist([(gh_org_user, repo) for repo in config['repositories']])
+
+        report['org'] = await gh_secret_magic.upsert_org_secrets(
+            gh_org_user, shared_secrets, [repo_checks[(gh_org_user, repo)].get('id') for repo in config['repositories']]
+        )
+
+    repos = list(per_repo_secrets)
+    results = await asyncio.gather(*[
+        gh_secret_magic.upsert_secrets(gh_org_user, repo, per_repo_secrets[repo]) for repo in repos
+    ])
+    report.update(zip(repos, results))
+
+    failures = [
+        f"secret {name} in {target}: {result['error']}"
+        for target, secret_report in report.items()
+        for name, result in secret_report.items() if not result['ok']
+    ]
+
+    # old apps stay in place while any new secret failed to land, so nothing is left without access;
+    # the replacements keep their temporary names and the next --rotate adopts them
+    if failures:
+        failures.append(f"old app registrations were kept because some secrets were not rewritten, "
+                        f"the replacements stay as *{ROTATION_SUFFIX} until --rotate is run again")
+        return failures
+
+    old_roles = [role for role in owned['roles'] if not role['app'].endswith(ROTATION_SUFFIX)]
+    failures, deleted = await _delete_roles_and_apps(old_roles, old_apps, max_concurrency)
+
+    # a replacement takes its final name only once the app it replaces is gone
+    old_names = {name for name, _ in old_apps}
+    renames = [
+        (name, new_manager) for name, (_, new_manager) in replacements.items()
+        if name in deleted or name not in old_names
+    ]
+    rename_results = await asyncio.gather(*[
+        new_manager.rename_app_registration(name) for name, new_manager in renames
+    ], return_exceptions=True)
+
+    for (name, _), result in zip(renames, rename_results):
+        if isinstance(result, Exception):
+            failures.append(f"renaming '{name}{ROTATION_SUFFIX}' to '{name}': {str(result)}")
+
+    return failures
+
+
+def forget_state(state, config, app_names):
+    """Drop the journal entries of torn down or replaced objects so the next run checks them again"""
+    gh_org_user = config['gh_org_user']
+    repo_keys = {f"{gh_org_user}/{repo}" for repo in config['repositories']}
+
+    for name in app_names:
+        state.forget('app', name)
+        state.forget('roles', name)
+
+    for key, _ in list(state.items('federated')):
+        if key.split('|', 1)[0] in app_names:
+            state.forget('federated', key)
+
+    for key, _ in list(state.items('secret')):
+        if key.split('|', 1)[0] in repo_keys:
+            state.forget('secret', key)
+
+    for repo_key in repo_keys:
+        state.forget('shard', repo_key)
+
+
+async def run_teardown(az_app_manager, config, state, mode, dry_run=False, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Discover the owned objects for config, then list, destroy or rotate them"""
+    async with githubsec.AsyncGitHubSecretMagic() as gh_secret_magic:
+        with tracer.phase('discover'):
+            owned = await discover_owned(az_app_manager, gh_secret_magic, config, state)
+        print_owned(owned, mode)
+
+        if dry_run:
+            return []
+
+        with tracer.phase(mode):
+            if mode == 'destroy':
+                failures = await destroy(gh_secret_magic, config, owned, max_concurrency)
+            else:
+                failures = await rotate(az_app_manager, gh_secret_magic, config, owned, max_concurrency)
+
+    forget_state(state, config, {name for name, _ in owned['apps']} | {config['app_name']})
+
+    for failure in failures:
+        print(f"Failed: {failure}")
+
+    print(f"{mode.capitalize()} finished with {len(failures)} failures.")
+    return failures
@@ -0,0 +1,45 @@
+import asyncio
+import os
+import sys
+import pytest
+
+# the modules live flat at the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from azapp import AzureAppRegManager
+from azpool import AzureClientPool
+from benchmark import write_app_key
+from fakeapi import FakeCredential, FAKE_SUBSCRIPTION_ID, FAKE_TENANT_ID
+
+
+@pytest.fixture
+def app_key(monkeypatch, tmp_path):
+    # registered first so monkeypatch puts the environment back afterwards
+    for name in ('GITHUB_APP_ID', 'GITHUB_APP_PRIVATE_KEY_PATH', 'GITHUB_APP_INSTALL_ID'):
+        monkeypatch.setenv(name, '')
+
+    write_app_key(str(tmp_path))
+
+
+@pytest.fixture
+def run_with_manager():
+    """run(api, work) awaits work(manager) on a manager for api's resource group and returns its result.
+
+    Keyword arguments go to the AzureClientPool, e.g. limits.
+    """
+
+    def run(api, work, **pool_options):
+        async def main():
+            pool = AzureClientPool(FakeCredential(), api.azure_transport(), api.http_transport(), **pool_options)
+            try:
+                manager = await AzureAppRegManager.create(
+                    api.resource_group, None, 'fakeacr', False, FAKE_SUBSCRIPTION_ID, FAKE_TENANT_ID, pool=pool
+                )
+                return await work(manager)
+
+            finally:
+                await pool.close()
+
+        return asyncio.run(main())
+
+    return run
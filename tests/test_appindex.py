@@ -0,0 +1,81 @@
+import asyncio
+import httpx
+from appindex import AppIndex
+
+
+class DeltaBatcher:
+    """Answers AppIndex's delta GETs from a {url: (status, page)} map and records the urls"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.urls = []
+
+    async def get(self, url):
+        self.urls.append(url)
+        status, page = self.pages[url]
+        return httpx.Response(status, json=page)
+
+
+FULL_URL = '/applications/delta?$select=id,appId,displayName'
+
+
+def test_full_sync_follows_next_links():
+    index = AppIndex(path=None)
+    batcher = DeltaBatcher({
+        FULL_URL: (200, {'value': [{'id': '1', 'appId': 'a1', 'displayName': 'one'}], '@odata.nextLink': 'page-2'}),
+        'page-2': (200, {'value': [{'id': '2', 'appId': 'a2', 'displayName': 'two'}], '@odata.deltaLink': 'delta-1'})
+    })
+
+    changes = asyncio.run(index._sync(batcher, 'applications'))
+
+    assert changes == 2
+    assert set(index._objects['applications']) == {'1', '2'}
+    assert index._delta_links['applications'] == 'delta-1'
+
+
+def test_incremental_sync_applies_changes_and_removals():
+    index = AppIndex(path=None)
+    index._objects['applications'] = {
+        '1': {'id': '1', 'appId': 'a1', 'displayName': 'one'},
+        '2': {'id': '2', 'appId': 'a2', 'displayName': 'two'}
+    }
+    index._delta_links['applications'] = 'delta-1'
+    batcher = DeltaBatcher({
+        'delta-1': (200, {'value': [
+            {'id': '1', 'displayName': 'renamed'},
+            {'id': '2', '@removed': {'reason': 'deleted'}}
+        ], '@odata.deltaLink': 'delta-2'})
+    })
+
+    asyncio.run(index._sync(batcher, 'applications'))
+
+    # fields left out of a delta item keep their earlier value
+    assert index._objects['applications'] == {'1': {'id': '1', 'appId': 'a1', 'displayName': 'renamed'}}
+    assert index._delta_links['applications'] == 'delta-2'
+
+
+def test_expired_delta_link_rebuilds():
+    index = AppIndex(path=None)
+    index._objects['applications'] = {'stale': {'id': 'stale', 'appId': 'x', 'displayName': 'gone'}}
+    index._delta_links['applications'] = 'delta-old'
+    batcher = DeltaBatcher({
+        'delta-old': (410, {'error': {'code': 'syncStateNotFound'}}),
+        FULL_URL: (200, {'value': [{'id': '1', 'appId': 'a1', 'displayName': 'one'}], '@odata.deltaLink': 'delta-new'})
+    })
+
+    asyncio.run(index._sync(batcher, 'applications'))
+
+    assert batcher.urls == ['delta-old', FULL_URL]
+    assert set(index._objects['applications']) == {'1'}
+    assert index._delta_links['applications'] == 'delta-new'
+
+
+def test_find_many_answers_unknown_names():
+    index = AppIndex(path=None)
+    index._objects['applications'] = {'1': {'id': '1', 'appId': 'a1', 'displayName': 'One'}}
+    index._rebuild()
+
+    found = index.find_many(['one', 'unknown'])
+
+    assert [app['id'] for app in found['one']] == ['1']
+    assert found['unknown'] == []
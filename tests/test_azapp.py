@@ -0,0 +1,188 @@
+import asyncio
+import pytest
+from azapp import AzureAppRegManager, GITHUB_OIDC_ISSUER, wait_until_ready
+from fakeapi import FakeApi
+
+
+@pytest.fixture
+def run_with_app(run_with_manager):
+    """Like run_with_manager, with an app registration created first"""
+
+    def run(api, work):
+        async def with_app(manager):
+            await manager.create_app_registration('app', "test app", assign_roles=False)
+            return await work(manager)
+
+        return run_with_manager(api, with_app)
+
+    return run
+
+
+def test_credential_names_never_collide():
+    entries = AzureAppRegManager._federated_credential_entries(
+        'org', ['web', 'web-release', 'my.repo', 'my-repo', 'x' * 200, 'x' * 201], ['main', 'release']
+    )
+    names = [entry['name'] for entry in entries]
+
+    assert len(set(names)) == len(names)
+    assert 'org-web-federated' in names
+    assert all(len(name) <= 120 for name in names)
+
+
+def test_colliding_repos_both_get_credentials(run_with_app):
+    api = FakeApi()
+
+    report = run_with_app(api, lambda manager: manager.ensure_federated_credentials(
+        'org', ['web', 'web-release'], ['main', 'release']
+    ))
+
+    assert list(report.values()) == ['created'] * 4
+    subjects = {credential['subject'] for credential in api.federated_credentials[next(iter(api.applications))]}
+    assert subjects == {
+        'repo:org/web:ref:refs/heads/main', 'repo:org/web:ref:refs/heads/release',
+        'repo:org/web-release:ref:refs/heads/main', 'repo:org/web-release:ref:refs/heads/release'
+    }
+
+
+def test_existence_is_decided_by_subject(run_with_app):
+    api = FakeApi()
+
+    async def work(manager):
+        # named by an earlier version, before branch names were hashed
+        api.federated_credentials[manager.app_object_id].append({
+            'id': 'legacy', 'name': 'org-web-release-federated', 'issuer': GITHUB_OIDC_ISSUER,
+            'subject': 'repo:org/web:ref:refs/heads/release'
+        })
+
+        return await manager.ensure_federated_credentials('org', ['web', 'web-release'], ['main', 'release'])
+
+    report = run_with_app(api, work)
+
+    # web-release on main plans the legacy name, held by another subject, and is created under its hashed form
+    assert report['org-web-release-federated'] == 'created'
+    assert sorted(report.values()) == ['created', 'created', 'created', 'exists']
+    assert len(api.federated_credentials[next(iter(api.applications))]) == 4
+
+
+def test_failed_create_does_not_fail_the_rest_of_its_chain(run_with_app):
+    api = FakeApi()
+    taken = ['org-b-federated', AzureAppRegManager._federated_credential_name('org', 'b', 'main', hashed=True)]
+
+    async def work(manager):
+        # both names b could get are held by other subjects, so its create fails with 409
+        api.federated_credentials[manager.app_object_id].extend(
+            {'id': name, 'name': name, 'issuer': GITHUB_OIDC_ISSUER, 'subject': f"repo:other/{name}:ref:refs/heads/main"}
+            for name in taken
+        )
+
+        return await manager.ensure_federated_credentials('org', ['a', 'b', 'c', 'd'])
+
+    report = run_with_app(api, work)
+
+    assert report['org-a-federated'] == 'created'
+    assert str(report['org-b-federated']).startswith('409')
+    assert report['org-c-federated'] == 'created'
+    assert report['org-d-federated'] == 'created'
+
+
+def probe_failing(times, error):
+    """Probe raising error on its first times calls, then returning the number of calls"""
+    calls = []
+
+    async def probe():
+        calls.append(None)
+        if len(calls) <= times:
+            raise error
+        return len(calls)
+
+    return probe
+
+
+def test_wait_until_ready_retries_principal_not_found():
+    probe = probe_failing(2, Exception("Principal x does not exist in the directory t."))
+
+    result, waited = asyncio.run(wait_until_ready(probe, initial_delay=0.01))
+
+    assert result == 3
+    assert waited < 1
+
+
+def test_wait_until_ready_raises_other_errors_at_once():
+    probe = probe_failing(1, Exception("AuthorizationFailed"))
+
+    with pytest.raises(Exception, match="AuthorizationFailed"):
+        asyncio.run(wait_until_ready(probe, initial_delay=0.01))
+
+
+def test_wait_until_ready_gives_up_at_the_deadline():
+    probe = probe_failing(1000, Exception("Principal x does not exist in the directory t."))
+
+    with pytest.raises(Exception, match="does not exist"):
+        asyncio.run(wait_until_ready(probe, deadline=0.1, initial_delay=0.01, max_delay=0.02))
+
+
+def test_roles_wait_for_principal_propagation(run_with_manager):
+    api = FakeApi(propagation_delay=0.2)
+
+    async def work(manager):
+        await manager.create_app_registration('app', "test app")
+        return manager.propagation_wait_seconds
+
+    waited = run_with_manager(api, work)
+
+    assert waited > 0
+    assert len(api.role_assignments) == 2
+
+
+def test_role_index_covers_parent_scopes(run_with_manager):
+    async def work(manager):
+        manager._role_index.add(('/subscriptions/sub/resourcegroups/rg', 'role', 'sp'))
+
+        return [
+            manager._has_role('/subscriptions/sub/resourceGroups/RG', 'ROLE', 'SP'),
+            manager._has_role('/subscriptions/sub/resourcegroups/rg/providers/x/y', 'role', 'sp'),
+            manager._has_role('/subscriptions/sub/resourcegroups/rg-2', 'role', 'sp'),
+            manager._has_role('/subscriptions/sub/resourcegroups/rg', 'other-role', 'sp')
+        ]
+
+    assert run_with_manager(FakeApi(), work) == [True, True, False, False]
+
+
+def test_role_assignment_names_are_deterministic(run_with_manager):
+    async def work(manager):
+        return (
+            manager._generate_guid('/Scope', 'Role', 'SP') == manager._generate_guid('/scope', 'role', 'sp'),
+            manager._generate_guid('/scope', 'role', 'sp') == manager._generate_guid('/scope', 'role', 'sp-2')
+        )
+
+    assert run_with_manager(FakeApi(), work) == (True, False)
+
+
+def test_rerun_lists_roles_once_and_recreates_under_the_same_name(run_with_manager):
+    api = FakeApi()
+    list_call = 'GET management.azure.com{scope}/providers/microsoft.authorization/roleassignments'
+    put_call = 'PUT management.azure.com{scope}/providers/microsoft.authorization/roleassignments/{name}'
+
+    async def create(manager):
+        await manager.create_app_registration('app', "test app")
+        return {'app_object_id': manager.app_object_id, 'app_id': manager.app_id}
+
+    async def rerun(manager):
+        manager.restore_app(app)
+        await manager.ensure_app_roles()
+
+    app = run_with_manager(api, create)
+    names = set(api.role_assignments)
+
+    api.calls.clear()
+    run_with_manager(api, rerun)
+
+    assert api.calls[list_call] == 1
+    assert api.calls[put_call] == 0
+
+    # a role removed outside the tool comes back under its old name
+    api.role_assignments.pop(sorted(names)[0])
+    run_with_manager(api, rerun)
+
+    assert api.calls[put_call] == 1
+    assert set(api.role_assignments) == names
@@ -0,0 +1,27 @@
+import asyncio
+from benchmark import benchmark_config, onboard
+from fakeapi import FakeApi
+
+
+def test_onboarding_against_fake_api(app_key):
+    repositories = ['api', 'web', 'worker']
+    api = FakeApi(repositories=repositories)
+
+    asyncio.run(onboard(api, benchmark_config(api, repositories), github_rps=1000.0))
+
+    assert len(api.applications) == 1
+    assert len(api.service_principals) == 1
+    assert all(api.secrets[repo] for repo in repositories)
+    assert api.calls['POST graph.microsoft.com/v1.0/applications'] == 1
+
+
+def test_rerun_creates_nothing_new(app_key):
+    repositories = ['api']
+    api = FakeApi(repositories=repositories)
+    config = benchmark_config(api, repositories)
+
+    asyncio.run(onboard(api, config, github_rps=1000.0))
+    asyncio.run(onboard(api, config, github_rps=1000.0))
+
+    assert api.calls['POST graph.microsoft.com/v1.0/applications'] == 1
+    assert len(api.role_assignments) == 2
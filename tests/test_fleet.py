@@ -0,0 +1,107 @@
+import asyncio
+import pytest
+from fakeapi import FakeApi
+from fleet import DagScheduler
+
+
+def scheduler(**limits):
+    return DagScheduler({'global': 8, **limits})
+
+
+def test_runs_in_dependency_order_with_results():
+    order = []
+    dag = scheduler()
+
+    async def task(name, value):
+        order.append(name)
+        return value
+
+    dag.add('app', lambda: task('app', 'app-id'))
+    dag.add('role', lambda app_id: task('role', f"role for {app_id}"), deps=['app'])
+    dag.add('secrets', lambda app_id, role: task('secrets', (app_id, role)), deps=['app', 'role'])
+
+    results = asyncio.run(dag.run())
+
+    assert order == ['app', 'role', 'secrets']
+    assert results['secrets'] == ('ok', ('app-id', 'role for app-id'))
+
+
+def test_failure_only_skips_dependents():
+    dag = scheduler()
+
+    async def fail():
+        raise Exception("boom")
+
+    async def succeed(*args):
+        return 'done'
+
+    dag.add('app', fail)
+    dag.add('role', succeed, deps=['app'])
+    dag.add('secrets', succeed, deps=['role'])
+    dag.add('other', succeed)
+
+    results = asyncio.run(dag.run())
+
+    assert results['app'][0] == 'failed'
+    assert results['role'] == ('skipped', "dependency 'app' failed")
+    assert results['secrets'] == ('skipped', "dependency 'role' skipped")
+    assert results['other'] == ('ok', 'done')
+
+
+def test_pool_caps_concurrency():
+    dag = scheduler(github=2)
+    running = []
+    peak = []
+
+    async def task():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+
+    for position in range(6):
+        dag.add(f"secret-{position}", task, pool='github')
+
+    asyncio.run(dag.run())
+
+    assert max(peak) == 2
+
+
+def test_rejects_duplicate_and_unknown_tasks():
+    dag = scheduler()
+
+    async def task():
+        pass
+
+    dag.add('app', task)
+
+    with pytest.raises(Exception, match="Duplicate task"):
+        dag.add('app', task)
+
+    with pytest.raises(Exception, match="unknown task"):
+        dag.add('role', task, deps=['missing'])
+
+
+def test_pool_limits_cap_calls_not_tasks(run_with_manager):
+    api = FakeApi(latency=0.01)
+    in_flight = []
+    peak = []
+    handle = api.handle
+
+    async def counted(method, url, body=None):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        try:
+            return await handle(method, url, body)
+        finally:
+            in_flight.pop()
+
+    api.handle = counted
+
+    async def work(manager):
+        # one task sending many ARM calls at once
+        await asyncio.gather(*[manager.find_resource_groups('Microsoft.ContainerRegistry/registries', 'fakeacr') for _ in range(8)])
+
+    run_with_manager(api, work, limits={'arm': 2})
+
+    assert max(peak) == 2
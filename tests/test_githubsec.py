@@ -0,0 +1,213 @@
+import asyncio
+import time
+import httpx
+import githubsec
+from fakeapi import FakeApi
+from githubsec import AsyncGitHubSecretMagic, GitHubRateLimiter, repository_matcher, split_shared_secrets
+
+
+def test_splits_identical_values():
+    shared, per_repo = split_shared_secrets({
+        'a': {'AZURE_TENANT_ID': 't', 'AZURE_CLIENT_ID': '1', 'REGISTRY': 'r'},
+        'b': {'AZURE_TENANT_ID': 't', 'AZURE_CLIENT_ID': '2', 'REGISTRY': 'r'}
+    })
+
+    assert shared == {'AZURE_TENANT_ID': 't', 'REGISTRY': 'r'}
+    assert per_repo == {'a': {'AZURE_CLIENT_ID': '1'}, 'b': {'AZURE_CLIENT_ID': '2'}}
+
+
+def test_value_missing_from_a_repo_stays_per_repo():
+    shared, per_repo = split_shared_secrets({
+        'a': {'AZURE_TENANT_ID': 't', 'CLUSTER': 'c'},
+        'b': {'AZURE_TENANT_ID': 't'}
+    })
+
+    assert shared == {'AZURE_TENANT_ID': 't'}
+    assert per_repo == {'a': {'CLUSTER': 'c'}, 'b': {}}
+
+
+def test_empty():
+    assert split_shared_secrets({}) == ({}, {})
+
+
+def serve(items, etag='"v1"'):
+    """Client whose GitHub answers /items/<n> and the /items listing with an ETag, other calls go to a FakeApi.
+
+    Returns the client and the If-None-Match header of every /items call.
+    """
+    api = FakeApi()
+    fake = api.http_transport()
+    seen = []
+
+    async def handle(request):
+        if not request.url.path.startswith('/items'):
+            return await fake.handle_async_request(request)
+
+        seen.append(request.headers.get('If-None-Match'))
+        if request.headers.get('If-None-Match') == etag:
+            return httpx.Response(304, headers={'ETag': etag})
+
+        name = request.url.path.rsplit('/', 1)[-1]
+        return httpx.Response(200, headers={'ETag': etag}, json=items if name == 'items' else items[int(name)])
+
+    gh = AsyncGitHubSecretMagic(
+        rate_limiter=GitHubRateLimiter(requests_per_second=1000.0, burst=1000), transport=httpx.MockTransport(handle)
+    )
+    return gh, seen
+
+
+def test_unchanged_get_replays_cached_body(app_key):
+    async def main():
+        gh, seen = serve([{'name': 'zero'}])
+        async with gh:
+            first = await gh._request('GET', '/items/0', owner='fake-org')
+            second = await gh._request('GET', '/items/0', owner='fake-org')
+
+        return first, second, seen
+
+    first, second, seen = asyncio.run(main())
+
+    assert seen == [None, '"v1"']
+    assert second.status_code == 200
+    assert second.json() == first.json() == {'name': 'zero'}
+
+
+def test_etag_cache_is_bounded(app_key, monkeypatch):
+    monkeypatch.setattr(githubsec, 'ETAG_CACHE_MAX_ENTRIES', 2)
+    monkeypatch.setattr(githubsec, 'ETAG_CACHE_MAX_BODY_BYTES', 100)
+
+    async def main():
+        gh, seen = serve([{'name': 'zero'}, {'name': 'one'}, {'name': 'two'}, {'name': 'x' * 200}])
+        async with gh:
+            for index in range(4):
+                await gh._request('GET', f'/items/{index}', owner='fake-org')
+
+            return [url for url, params in gh._etag_cache]
+
+    # the oldest entry is evicted and the large body never stored
+    assert asyncio.run(main()) == ['/items/1', '/items/2']
+
+
+def test_pages_stay_out_of_etag_cache(app_key):
+    async def main():
+        gh, seen = serve([{'name': 'zero'}])
+        async with gh:
+            for _ in range(2):
+                assert [item async for item in gh.paginate('/items', owner='fake-org')] == [{'name': 'zero'}]
+
+            return gh._etag_cache, seen
+
+    cache, seen = asyncio.run(main())
+
+    assert not cache
+    assert seen == [None, None]
+
+
+def test_rate_limited_get_is_retried(app_key):
+    api = FakeApi()
+    fake = api.http_transport()
+    statuses = []
+
+    async def handle(request):
+        if request.url.path != '/items/0':
+            return await fake.handle_async_request(request)
+
+        # the first call is limited, the retry after Retry-After goes through
+        statuses.append(429 if not statuses else 200)
+        return httpx.Response(statuses[-1], headers={'Retry-After': '0'}, json={'name': 'zero'})
+
+    async def main():
+        gh = AsyncGitHubSecretMagic(
+            rate_limiter=GitHubRateLimiter(requests_per_second=1000.0, burst=1000), transport=httpx.MockTransport(handle)
+        )
+        async with gh:
+            return (await gh._request('GET', '/items/0', owner='fake-org')).status_code
+
+    assert asyncio.run(main()) == 200
+    assert statuses == [429, 200]
+
+
+def limited(status, headers=None, text=''):
+    return httpx.Response(status, headers=headers or {}, text=text)
+
+
+def test_retry_delay():
+    limiter = GitHubRateLimiter(secondary_backoff=60.0, max_backoff=300.0)
+    reset_at = str(int(time.time()) + 30)
+
+    assert limiter.retry_delay(limited(429, {'Retry-After': '5'}), 0) == 5.0
+    assert 25 <= limiter.retry_delay(limited(403, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': reset_at}), 0) <= 30
+    assert limiter.retry_delay(limited(403, text="You have exceeded a secondary rate limit"), 1) == 120.0
+    assert limiter.retry_delay(limited(429), 5) == 300.0
+    assert limiter.retry_delay(limited(403, text="Resource not accessible by integration"), 0) is None
+    assert limiter.retry_delay(limited(200), 0) is None
+
+
+def test_low_budget_waits_for_reset(monkeypatch):
+    limiter = GitHubRateLimiter(reserve=10)
+    limiter.update('token', limited(200, {'X-RateLimit-Remaining': '5', 'X-RateLimit-Reset': str(int(time.time()) + 30)}))
+    waits = []
+    sleep = asyncio.sleep
+
+    async def record(delay):
+        waits.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(asyncio, 'sleep', record)
+    asyncio.run(limiter.acquire('token'))
+    asyncio.run(limiter.acquire('token'))
+
+    # one wait for the reset, then the budget is forgotten until the next response reports it
+    assert len(waits) == 1 and 25 <= waits[0] <= 30
+
+
+def test_delete_reports_deleted_then_absent(app_key):
+    api = FakeApi(repositories=['api'])
+    api.secrets['api']['CLIENT_ID'] = 'x'
+
+    async def main():
+        gh = AsyncGitHubSecretMagic(
+            rate_limiter=GitHubRateLimiter(requests_per_second=1000.0, burst=1000), transport=api.http_transport()
+        )
+        async with gh:
+            return [await gh.delete_secret('fake-org', 'api', 'CLIENT_ID') for _ in range(2)]
+
+    assert asyncio.run(main()) == [
+        {'ok': True, 'action': "deleted", 'status': 204, 'error': None},
+        {'ok': True, 'action': "absent", 'status': 404, 'error': None}
+    ]
+
+
+def repo(name, topics=(), archived=False):
+    return {'name': name, 'topics': list(topics), 'archived': archived}
+
+
+def test_repository_matcher():
+    by_glob = repository_matcher(['svc-*', 'API'])
+    assert [by_glob(repo(name)) for name in ('svc-web', 'api', 'web')] == [True, True, False]
+
+    by_regex_and_topic = repository_matcher(regex=r'-v\d+$', topics='Deploy')
+    assert by_regex_and_topic(repo('web-v2', ['deploy', 'team-a']))
+    assert not by_regex_and_topic(repo('web-v2'))
+    assert not by_regex_and_topic(repo('web-v2-old', ['deploy']))
+
+    everything = repository_matcher()
+    assert everything(repo('web'))
+    assert not everything(repo('web', archived=True))
+    assert repository_matcher(include_archived=True)(repo('web', archived=True))
+
+
+def test_select_repositories_follows_every_page(app_key):
+    api = FakeApi(repositories=[f"svc-{index}" for index in range(250)] + ['web'])
+
+    async def main():
+        gh = AsyncGitHubSecretMagic(
+            rate_limiter=GitHubRateLimiter(requests_per_second=1000.0, burst=1000), transport=api.http_transport()
+        )
+        async with gh:
+            return [name async for name, check in gh.select_repositories('fake-org', 'svc-*')]
+
+    selected = asyncio.run(main())
+
+    assert len(selected) == 250 and 'web' not in selected
+    assert api.calls['GET api.github.com/installation/repositories'] == 3
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import time
+import httpx
+import pytest
+from azure.core.credentials import AccessToken
+import graphbatch
+from graphbatch import GraphBatcher, GraphBatchRequest
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Retry delays asked for, without waiting for them"""
+    asked = []
+    sleep = asyncio.sleep
+
+    def record(delay):
+        asked.append(delay)
+        return sleep(0)
+
+    monkeypatch.setattr(graphbatch.asyncio, 'sleep', record)
+    return asked
+
+
+class StaticCredential:
+
+    async def get_token(self, *scopes, **kwargs):
+        return AccessToken('token', int(time.time()) + 3600)
+
+
+def batcher_for(handler):
+    """GraphBatcher whose $batch calls are answered by handler(requests) -> responses"""
+    sent = []
+
+    def respond(request):
+        requests = json.loads(request.content)['requests']
+        sent.append(requests)
+        return httpx.Response(200, json={'responses': handler(requests)})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(respond))
+    return GraphBatcher(StaticCredential(), client=client), sent
+
+
+def ids(batch):
+    return [request.id for request in batch]
+
+
+def test_pack_splits_at_twenty():
+    batcher, _ = batcher_for(None)
+    batches = batcher._pack([GraphBatchRequest(position, 'GET', '/me') for position in range(45)])
+
+    assert [len(batch) for batch in batches] == [20, 20, 5]
+
+
+def test_pack_keeps_chains_together():
+    batcher, _ = batcher_for(None)
+    requests = [GraphBatchRequest(position, 'GET', '/me') for position in range(19)]
+    requests += [GraphBatchRequest('a', 'POST', '/x', {}), GraphBatchRequest('b', 'POST', '/y', {}, depends_on=['a'])]
+
+    batches = batcher._pack(requests)
+
+    assert [ids(batch) for batch in batches] == [[str(position) for position in range(19)], ['a', 'b']]
+
+
+def test_pack_merges_chains_joined_by_one_request():
+    batcher, _ = batcher_for(None)
+    requests = [
+        GraphBatchRequest('a', 'GET', '/a'),
+        GraphBatchRequest('b', 'GET', '/b'),
+        GraphBatchRequest('c', 'GET', '/c', depends_on=['a', 'b'])
+    ]
+
+    assert [ids(batch) for batch in batcher._pack(requests)] == [['a', 'b', 'c']]
+
+
+def test_pack_rejects_unknown_dependency():
+    batcher, _ = batcher_for(None)
+
+    with pytest.raises(Exception, match="must be listed before it"):
+        batcher._pack([GraphBatchRequest('b', 'GET', '/b', depends_on=['a'])])
+
+
+def test_pack_rejects_chain_over_batch_size():
+    batcher, _ = batcher_for(None)
+    requests = [GraphBatchRequest(0, 'GET', '/0')]
+    requests += [GraphBatchRequest(position, 'GET', f'/{position}', depends_on=[position - 1]) for position in range(1, 21)]
+
+    with pytest.raises(Exception, match="does not fit in one batch"):
+        batcher._pack(requests)
+
+
+def test_execute_retries_throttled_and_their_dependents(delays):
+    def handler(requests):
+        # first round: a is throttled and b, which waits on it, fails its dependency
+        first = {'a': 429, 'b': 424} if not sent[1:] else {}
+        return [
+            {'id': request['id'], 'status': first.get(request['id'], 200), 'headers': {'Retry-After': '1'}, 'body': {}}
+            for request in requests
+        ]
+
+    batcher, sent = batcher_for(handler)
+    results = asyncio.run(batcher.execute([
+        GraphBatchRequest('a', 'GET', '/a'),
+        GraphBatchRequest('b', 'GET', '/b', depends_on=['a']),
+        GraphBatchRequest('c', 'GET', '/c')
+    ]))
+
+    assert {request_id: result['status'] for request_id, result in results.items()} == {'a': 200, 'b': 200, 'c': 200}
+    assert [[request['id'] for request in batch] for batch in sent] == [['a', 'b', 'c'], ['a', 'b']]
+    assert sent[1][1]['dependsOn'] == ['a']
+    assert delays == [1.0]
+
+
+def test_execute_gives_up_after_max_retries(delays):
+    batcher, sent = batcher_for(lambda requests: [
+        {'id': request['id'], 'status': 503, 'body': {}} for request in requests
+    ])
+
+    results = asyncio.run(batcher.execute([GraphBatchRequest('a', 'GET', '/a')]))
+
+    assert results['a']['status'] == 503
+    assert len(sent) == batcher.max_retries + 1
+    # no Retry-After, so exponential backoff
+    assert delays == [2.0, 4.0, 8.0]
@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+from fakeapi import FakeApi
+from shards import plan_shards, provision_shards
+
+
+def repo_names(count):
+    return [f"repo-{position:02d}" for position in range(count)]
+
+
+def test_fits_one_app():
+    shards = plan_shards('app', repo_names(10), ['main', 'dev'])
+
+    assert shards == [{'index': 0, 'app_name': 'app', 'repos': repo_names(10)}]
+
+
+def test_fills_lowest_shard_first():
+    shards = plan_shards('app', repo_names(25), ['main'])
+
+    assert [shard['app_name'] for shard in shards] == ['app', 'app-2']
+    assert shards[0]['repos'] == repo_names(20)
+    assert shards[1]['repos'] == repo_names(25)[20:]
+
+
+def test_keeps_existing_placements():
+    shards = plan_shards('app', ['a', 'b', 'c'], ['main'], placements={'c': 1})
+
+    assert shards == [
+        {'index': 0, 'app_name': 'app', 'repos': ['a', 'b']},
+        {'index': 1, 'app_name': 'app-2', 'repos': ['c']}
+    ]
+
+
+def test_moves_placement_that_no_longer_fits():
+    # shard 1 is full of credentials this run does not manage
+    shards = plan_shards('app', ['a', 'b'], ['main'], placements={'b': 1}, used={1: 20})
+
+    assert shards == [{'index': 0, 'app_name': 'app', 'repos': ['a', 'b']}]
+
+
+def test_used_slots_push_repos_to_next_shard():
+    shards = plan_shards('app', ['a', 'b'], ['main', 'dev'], used={0: 19})
+
+    assert [(shard['index'], shard['repos']) for shard in shards] == [(1, ['a', 'b'])]
+
+
+def test_same_input_same_plan():
+    repos = repo_names(45)
+
+    assert [sorted(shard['repos']) for shard in plan_shards('app', repos, ['main'])] == \
+        [sorted(shard['repos']) for shard in plan_shards('app', list(reversed(repos)), ['main'])]
+
+
+def test_too_many_branches():
+    with pytest.raises(Exception, match="federated credentials"):
+        plan_shards('app', ['a'], [f"branch-{position}" for position in range(21)])
+
+
+def onboard_shards(manager, repos, found=None):
+    """provision_shards plus the credentials, as onboarding does, returns {app name: repos}"""
+
+    async def work():
+        shards = await provision_shards(manager, 'app', "test app", 'org', repos, ['main'], found)
+        await asyncio.gather(*[
+            shard_manager.ensure_federated_credentials('org', shard['repos'], ['main']) for shard, shard_manager in shards
+        ])
+        return {shard['app_name']: shard['repos'] for shard, _ in shards}
+
+    return work()
+
+
+def test_repos_stay_on_their_shard_when_fewer_remain(run_with_manager):
+    api = FakeApi()
+    repos = repo_names(25)
+
+    first = run_with_manager(api, lambda manager: onboard_shards(manager, repos))
+    # 15 repos would fit one app, the five on app-2 still stay there
+    second = run_with_manager(api, lambda manager: onboard_shards(manager, repos[10:]))
+
+    assert first == {'app': repos[:20], 'app-2': repos[20:]}
+    assert second == {'app': repos[10:20], 'app-2': repos[20:]}
+    assert len(api.applications) == 2
+
+
+def test_foreign_credentials_keep_their_slots(run_with_manager):
+    api = FakeApi()
+
+    async def work(manager):
+        await manager.create_app_registration('app', "test app", assign_roles=False)
+        api.federated_credentials[manager.app_object_id].extend(
+            {'id': f"other-{position}", 'name': f"other-{position}", 'issuer': 'https://other', 'subject': f"other-{position}"}
+            for position in range(18)
+        )
+
+        return await onboard_shards(manager, ['a', 'b', 'c'])
+
+    assert run_with_manager(api, work) == {'app': ['a', 'b'], 'app-2': ['c']}
+
+
+def test_failed_lookup_is_not_taken_as_absent(run_with_manager):
+    api = FakeApi()
+
+    async def work(manager):
+        # find_apps_by_display_names leaves out the names whose lookup failed
+        async def lookup_failed(names):
+            return {}
+
+        manager.find_apps_by_display_names = lookup_failed
+        return await onboard_shards(manager, ['a'], found={'app': []})
+
+    with pytest.raises(Exception, match="Could not look up app registrations"):
+        run_with_manager(api, work)
+
+    assert not api.applications
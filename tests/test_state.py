@@ -0,0 +1,43 @@
+import time
+from state import StateStore
+
+
+def test_plan_actions():
+    store = StateStore(None, ttl=60)
+    store.record('app', 'my-app', {'id': '1'})
+    store.record('role', 'acr', {'scope': 'old'})
+    store.record('secret', 'repo/AZURE_CLIENT_ID', {'hash': 'h'})
+    store._items['secret:repo/AZURE_CLIENT_ID']['checked_at'] = time.time() - 120
+
+    plan = store.plan([
+        ('app', 'my-app', {'id': '1'}),
+        ('role', 'acr', {'scope': 'new'}),
+        ('secret', 'repo/AZURE_CLIENT_ID', {'hash': 'h'}),
+        ('secret', 'repo/AZURE_TENANT_ID', {'hash': 'h'})
+    ])
+
+    assert plan == [
+        ('skip', 'app', 'my-app'),
+        ('update', 'role', 'acr'),
+        ('check', 'secret', 'repo/AZURE_CLIENT_ID'),
+        ('create', 'secret', 'repo/AZURE_TENANT_ID')
+    ]
+
+
+def test_no_data_ignores_changes():
+    store = StateStore(None)
+    store.record('app', 'my-app', {'id': '1'})
+
+    assert store.plan([('app', 'my-app', None)]) == [('skip', 'app', 'my-app')]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'state.json')
+    store = StateStore(path)
+    store.record('app', 'my-app', {'id': '1'})
+    store.save()
+
+    reloaded = StateStore(path)
+
+    assert reloaded.get('app', 'my-app') == {'id': '1'}
+    assert reloaded.hash_value('secret') == store.hash_value('secret')
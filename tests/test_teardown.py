@@ -0,0 +1,86 @@
+from azapp import AzureAppRegManager
+from fakeapi import FakeApi
+from githubsec import AsyncGitHubSecretMagic, GitHubRateLimiter
+from state import StateStore
+from teardown import discover_owned
+
+
+CONFIG = {
+    'gh_org_user': 'fake-org',
+    'repositories': ['api', 'web'],
+    'branches': ['main', 'release'],
+    'app_name': 'app',
+    'use_org_secrets': True
+}
+
+
+def subject(repo, branch='main', owner='fake-org'):
+    return AzureAppRegManager._federated_subject(owner, repo, branch)
+
+
+def add_app(api, name, credentials=()):
+    """An app registration in api holding (name, subject) credentials, returns its appId"""
+    status, _, app = api._create_application({}, {'displayName': name})
+
+    for credential_name, credential_subject in credentials:
+        api._create_federated({}, {'name': credential_name, 'subject': credential_subject}, app['id'])
+
+    return app['appId']
+
+
+def discover(run_with_manager, api, state=None):
+    async def work(manager):
+        gh_secret_magic = AsyncGitHubSecretMagic(
+            rate_limiter=GitHubRateLimiter(requests_per_second=1000.0, burst=1000), transport=api.http_transport()
+        )
+        async with gh_secret_magic:
+            return await discover_owned(manager, gh_secret_magic, CONFIG, state)
+
+    return run_with_manager(api, work)
+
+
+def test_credentials_count_only_under_a_tool_name_and_subject(app_key, run_with_manager):
+    api = FakeApi(repositories=['api', 'web'])
+    hashed = AzureAppRegManager._federated_credential_name('fake-org', 'api', 'release', primary=False)
+    add_app(api, 'app', [
+        ('fake-org-api-federated', subject('api')),
+        (hashed, subject('api', 'release')),
+        # right subject under someone else's name, and a tool name for another owner's repo
+        ('deploy-web', subject('web')),
+        ('fake-org-web-federated', subject('web', owner='other-org'))
+    ])
+
+    owned = discover(run_with_manager, api)
+
+    assert [name for name, _ in owned['apps']] == ['app']
+    assert sorted(credential['name'] for credential in owned['federated']) == sorted(['fake-org-api-federated', hashed])
+
+
+def test_app_without_tool_credentials_needs_the_journal(app_key, run_with_manager, tmp_path):
+    api = FakeApi(repositories=['api', 'web'])
+    add_app(api, 'app', [('deploy-api', subject('api'))])
+    journaled = add_app(api, 'app-2')
+
+    state = StateStore(str(tmp_path / 'state.json'))
+    state.record('app', 'app-2', {'app_id': journaled})
+
+    owned = discover(run_with_manager, api, state)
+
+    assert [(name, manager.app_id) for name, manager in owned['apps']] == [('app-2', journaled)]
+    assert owned['federated'] == []
+
+
+def test_only_tool_secrets_visible_to_config_repos_are_owned(app_key, run_with_manager):
+    api = FakeApi(repositories=['api', 'web', 'other'])
+    api.secrets['api'].update({'CLIENT_ID': 'x', 'DEPLOY_TOKEN': 'y'})
+    repo_ids = {name: repo['id'] for name, repo in api.repositories.items()}
+    api.org_secrets.update({
+        'TENANT_ID': {'value': 't', 'visibility': 'selected', 'repositories': [repo_ids['api'], repo_ids['web']]},
+        'SUBSCRIPTION_ID': {'value': 's', 'visibility': 'selected', 'repositories': [repo_ids['api'], repo_ids['other']]},
+        'CONTAINER_REGISTRY': {'value': 'r', 'visibility': 'all', 'repositories': []}
+    })
+
+    owned = discover(run_with_manager, api)
+
+    assert owned['secrets'] == [{'repo': 'api', 'name': 'CLIENT_ID'}]
+    assert owned['org_secrets'] == [{'name': 'TENANT_ID'}]
@@ -0,0 +1,119 @@
+import asyncio
+import base64
+import json
+import time
+import pytest
+from azure.core.credentials import AccessToken
+from azure.core.exceptions import ClientAuthenticationError
+from azure.identity import CredentialUnavailableError
+import tokencache
+from tokencache import RememberingChainCredential, TokenCache
+
+ARM = ('https://management.azure.com/.default',)
+
+
+def access_token(oid, lifetime=3600):
+    claims = base64.urlsafe_b64encode(json.dumps({'oid': oid}).encode()).decode().rstrip('=')
+    return AccessToken(f"header.{claims}.signature", int(time.time()) + lifetime)
+
+
+def sign_in(config_dir, user):
+    with open(config_dir / 'azureProfile.json', 'w', encoding='utf-8') as profile_file:
+        json.dump({'subscriptions': [{'id': 'sub', 'isDefault': True, 'user': {'name': user, 'type': 'user'}}]}, profile_file)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('AZURE_CONFIG_DIR', str(tmp_path))
+    monkeypatch.delenv('ONBOARD_TOKEN_CACHE_KEY', raising=False)
+    sign_in(tmp_path, 'alice@contoso.com')
+
+    cache = TokenCache()
+    cache.configure(str(tmp_path / 'tokens.bin'))
+    cache.remember_credential('azure_cli')
+    return cache
+
+
+def reopen(cache):
+    """The cache as the next run sees it"""
+    reopened = TokenCache()
+    reopened.configure(cache.path)
+    return reopened
+
+
+def test_tokens_outlive_the_process(cache):
+    cache.put('tenant', ARM, access_token('alice'))
+
+    assert reopen(cache).get('tenant', ARM).token == access_token('alice').token
+
+
+def test_tokens_near_expiry_are_not_served(cache):
+    cache.put('tenant', ARM, access_token('alice', lifetime=60))
+
+    assert cache.get('tenant', ARM) is None
+
+
+def test_another_az_login_misses_the_cache(cache, tmp_path):
+    cache.put('tenant', ARM, access_token('alice'))
+    sign_in(tmp_path, 'bob@contoso.com')
+
+    assert reopen(cache).get('tenant', ARM) is None
+
+
+def test_switching_credential_drops_tokens(cache):
+    cache.put('tenant', ARM, access_token('alice'))
+    cache.remember_credential('environment')
+    cache.remember_credential('azure_cli')
+
+    assert cache.get('tenant', ARM) is None
+
+
+def test_token_for_another_identity_drops_tokens(cache):
+    graph = ('https://graph.microsoft.com/.default',)
+    cache.put('tenant', ARM, access_token('alice'))
+    cache.put('other-tenant', ARM, access_token('alice-as-guest'))
+    cache.put('tenant', graph, access_token('bob'))
+
+    assert cache.get('tenant', ARM) is None
+    assert cache.get('other-tenant', ARM) is None
+    assert cache.get('tenant', graph) is not None
+
+
+def test_credentials_without_account_hint_are_not_cached(cache):
+    cache.remember_credential('azure_powershell')
+    cache.put('tenant', ARM, access_token('alice'))
+
+    assert cache.get('tenant', ARM) is None
+
+
+class ChainMember:
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    async def get_token(self, *scopes, **kwargs):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return access_token('sp')
+
+    async def close(self):
+        pass
+
+
+def test_chain_starts_with_remembered_and_falls_back(cache, monkeypatch):
+    members = {
+        'environment': ChainMember(),
+        'azure_cli': ChainMember(ClientAuthenticationError("az login expired"))
+    }
+    monkeypatch.setattr(tokencache, '_build_chain_credential', lambda name: members.get(name, ChainMember(CredentialUnavailableError("n/a"))))
+    cache.put('tenant', ARM, access_token('alice'))
+
+    token = asyncio.run(RememberingChainCredential(cache).get_token(*ARM))
+
+    assert token.token == access_token('sp').token
+    assert members['azure_cli'].calls == 1
+    assert cache.credential_name == 'environment'
+    # the CLI login's tokens went with it
+    assert not cache._entries
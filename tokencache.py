@@ -0,0 +1,260 @@
+import base64
+import json
+import os
+import time
+
+
+DEFAULT_TOKEN_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.onboard', 'token_cache.bin')
+
+# cached tokens closer than this to expiry are not handed out again
+TOKEN_REFRESH_MARGIN = 300
+
+# the DefaultAzureCredential order, without the interactive and IDE credentials
+CREDENTIAL_CHAIN = ('environment', 'workload_identity', 'managed_identity', 'azure_cli', 'azure_powershell', 'azure_developer_cli')
+
+
+def _build_chain_credential(name):
+    """Create one async credential of the chain, None when it is not configured here"""
+    from azure.identity import aio as identity
+
+    factories = {
+        'environment': identity.EnvironmentCredential,
+        'workload_identity': identity.WorkloadIdentityCredential,
+        'managed_identity': identity.ManagedIdentityCredential,
+        'azure_cli': identity.AzureCliCredential,
+        'azure_powershell': identity.AzurePowerShellCredential,
+        'azure_developer_cli': identity.AzureDeveloperCliCredential
+    }
+
+    try:
+        return factories[name](additionally_allowed_tenants=['*'])
+
+    except ValueError:
+        # e.g. workload identity without its environment variables
+        return None
+
+
+def _account_hint(name):
+    """Who the chain credential name signs in as, read without requesting a token.
+
+    None when that cannot be told cheaply, the credential's tokens are then not reused from disk.
+    """
+    if name in ('environment', 'workload_identity', 'managed_identity'):
+        return f"{os.getenv('AZURE_CLIENT_ID', 'system')}:{os.getenv('AZURE_USERNAME', '')}"
+
+    if name == 'azure_cli':
+        # az login rewrites the profile, its default subscription names the signed-in account
+        config_dir = os.getenv('AZURE_CONFIG_DIR') or os.path.join(os.path.expanduser('~'), '.azure')
+        try:
+            with open(os.path.join(config_dir, 'azureProfile.json'), 'r', encoding='utf-8-sig') as profile_file:
+                subscriptions = json.load(profile_file).get('subscriptions', [])
+
+        except (OSError, ValueError):
+            return None
+
+        for subscription in subscriptions:
+            if subscription.get('isDefault'):
+                user = subscription.get('user') or {}
+                return f"{user.get('type')}:{user.get('name')}"
+
+    return None
+
+
+def _token_identity(token):
+    """Object id, or app id for an app-only token, from the access token's claims"""
+    try:
+        payload = token.token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+
+    except (IndexError, ValueError):
+        return None
+
+    return claims.get('oid') or claims.get('appid')
+
+
+class TokenCache:
+    """Encrypted on-disk cache of access tokens and of the credential that worked last.
+
+    Disabled until configure() is called. Tokens are stored per credential, signed-in account,
+    tenant and scope, encrypted with Fernet keyed by ONBOARD_TOKEN_CACHE_KEY or else by a key file
+    created next to the cache with owner-only permissions. A switch to another credential of the
+    chain, or a token for another identity, drops every cached token.
+    """
+
+    def __init__(self):
+        self.path = None
+        self._fernet = None
+        self._entries = {}
+        self.credential_name = None
+        self._accounts = {}
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def configure(self, path=None):
+        """Turn the cache on, path defaults to ONBOARD_TOKEN_CACHE or ~/.onboard/token_cache.bin"""
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError:
+            raise Exception("cryptography is required for the token cache: pip install cryptography")
+
+        self.path = path or os.getenv('ONBOARD_TOKEN_CACHE') or DEFAULT_TOKEN_CACHE_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self._fernet = Fernet(self._load_key(Fernet))
+        self.load()
+
+    def _load_key(self, fernet_class):
+        key = os.getenv('ONBOARD_TOKEN_CACHE_KEY')
+        if key:
+            return key.encode()
+
+        key_path = f"{self.path}.key"
+        if os.path.exists(key_path):
+            with open(key_path, 'rb') as key_file:
+                return key_file.read()
+
+        key = fernet_class.generate_key()
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as key_file:
+            key_file.write(key)
+
+        return key
+
+    def load(self):
+        from cryptography.fernet import InvalidToken
+
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, 'rb') as cache_file:
+                cache = json.loads(self._fernet.decrypt(cache_file.read()))
+
+        except (InvalidToken, ValueError):
+            # a cache written with another key is rebuilt rather than trusted
+            print(f"Token cache '{self.path}' could not be read, starting a new one.")
+            return
+
+        now = time.time()
+        self._entries = {key: entry for key, entry in cache.get('tokens', {}).items() if entry['expires_on'] > now}
+        self.credential_name = cache.get('credential')
+
+    def save(self):
+        """Write the cache atomically, readable by the owner only"""
+        temp_path = f"{self.path}.tmp"
+        data = self._fernet.encrypt(json.dumps({'credential': self.credential_name, 'tokens': self._entries}).encode())
+
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as cache_file:
+            cache_file.write(data)
+
+        os.replace(temp_path, self.path)
+
+    def _account(self):
+        if self.credential_name not in self._accounts:
+            self._accounts[self.credential_name] = _account_hint(self.credential_name)
+
+        return self._accounts[self.credential_name]
+
+    def _key(self, tenant_id, scopes):
+        return f"{self.credential_name}|{self._account()}|{tenant_id or 'default'}|{' '.join(scopes)}"
+
+    def get(self, tenant_id, scopes):
+        """A cached AccessToken of the current credential and account, valid past the refresh margin, or None"""
+        if not self.enabled or self._account() is None:
+            return None
+
+        entry = self._entries.get(self._key(tenant_id, scopes))
+        if entry is None or entry['expires_on'] - TOKEN_REFRESH_MARGIN < time.time():
+            return None
+
+        from azure.core.credentials import AccessToken
+
+        return AccessToken(entry['token'], entry['expires_on'])
+
+    def put(self, tenant_id, scopes, token):
+        if not self.enabled or self._account() is None:
+            return
+
+        # the account behind the credential changed without the hint noticing, forget its tokens;
+        # object ids differ between tenants, so only the same tenant's tokens are compared
+        tenant = tenant_id or 'default'
+        identity = _token_identity(token)
+        if any(entry.get('tenant') == tenant and entry.get('identity') != identity for entry in self._entries.values()):
+            self._entries = {}
+
+        self._entries[self._key(tenant_id, scopes)] = {
+            'token': token.token, 'expires_on': token.expires_on, 'tenant': tenant, 'identity': identity
+        }
+        self.save()
+
+    def remember_credential(self, name):
+        """Record the chain credential that got a token, tokens of the previous one are dropped"""
+        if not self.enabled or name == self.credential_name:
+            return
+
+        self.credential_name = name
+        self._entries = {}
+        self.save()
+
+
+class RememberingChainCredential:
+    """Async credential chain that starts with the credential which worked on the last run.
+
+    Credentials are created on first use, so a remembered Azure CLI login never waits on the
+    managed identity probe that DefaultAzureCredential runs before it.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._credentials = {}
+
+    def _credential(self, name):
+        if name not in self._credentials:
+            self._credentials[name] = _build_chain_credential(name)
+
+        return self._credentials[name]
+
+    async def get_token(self, *scopes, **kwargs):
+        from azure.core.exceptions import ClientAuthenticationError
+        from azure.identity import CredentialUnavailableError
+
+        remembered = self.cache.credential_name
+        order = sorted(CREDENTIAL_CHAIN, key=lambda name: name != remembered)
+        errors = []
+
+        for name in order:
+            credential = self._credential(name)
+            if credential is None:
+                continue
+
+            try:
+                token = await credential.get_token(*scopes, **kwargs)
+
+            except CredentialUnavailableError as e:
+                errors.append(f"{name}: {str(e)}")
+                continue
+
+            except ClientAuthenticationError as e:
+                # a remembered credential that stopped working falls back to the rest of the chain
+                if name != remembered:
+                    raise
+
+                errors.append(f"{name}: {str(e)}")
+                continue
+
+            self.cache.remember_credential(name)
+            return token
+
+        raise CredentialUnavailableError("No credential in the chain could get a token: " + "; ".join(errors))
+
+    async def close(self):
+        for credential in self._credentials.values():
+            if credential is not None:
+                await credential.close()
+
+
+# process-wide cache, enabled with configure() by main and fleet
+token_cache = TokenCache()